@@ -0,0 +1,355 @@
+#!/usr/bin/python3
+# Statistical analysis of benchmark results saved by run.py.
+# Computes the ratio of each benchmark's mean time in every configuration to
+# its mean time in a baseline configuration, and geometric means of those
+# ratios per suite and overall, all with bootstrap confidence intervals.
+# Needs NumPy.
+import argparse
+import hashlib
+import json
+import os
+from os import path
+
+import numpy as np
+
+from results import Results
+
+# Configurations in the column order `bench.dat` is written in, which is the
+# order plotdata.gpi expects.
+plot_configurations = ["purecap-bounds", "hybrid-bounds", "purecap-nobounds", "hybrid-nobounds"]
+# Default baseline configuration.
+default_baseline = "hybrid-bounds"
+
+
+# Lists of times as a (lists, longest list) array padded with NaN, and the
+# length of each list.
+def padded_matrix(rows):
+	counts = np.array([len(times) for times in rows], dtype=np.intp)
+	samples = np.full((len(rows), max([1] + list(counts))), np.nan)
+	for i, times in enumerate(rows):
+		samples[i, :len(times)] = times
+	return (samples, counts)
+
+# Means of every row of `samples` after resampling its first `counts` entries
+# with replacement, `resamples` times.
+# Returns a (resamples, benchmarks) array. Resampling is done in chunks to
+# bound memory use.
+def bootstrap_means(samples, counts, resamples, rng, chunk=256):
+	(benchmarks, width) = samples.shape
+	rows = np.arange(benchmarks)[None, :, None]
+	means = np.empty((resamples, benchmarks))
+	for start in range(0, resamples, chunk):
+		size = min(chunk, resamples-start)
+		indices = (rng.random((size, benchmarks, counts.max())) * counts[None, :, None]).astype(np.intp)
+		drawn = samples[rows, indices]
+		# Only the first `counts` draws of each row are used, so rows with fewer
+		# rounds are resampled at their own size.
+		used = np.arange(counts.max())[None, None, :] < counts[None, :, None]
+		means[start:start+size] = np.where(used, drawn, 0).sum(axis=2)/counts[None, :]
+	return means
+
+# Bounds of the central `confidence` interval of `samples` along axis 0.
+def percentile_interval(samples, confidence):
+	tail = (1-confidence)/2*100
+	return (np.percentile(samples, tail, axis=0), np.percentile(samples, 100-tail, axis=0))
+
+# Random number generator for resampling `benchmark` in `configuration`,
+# seeded from `seed` and both names, so that a benchmark's resamples don't
+# depend on what else is analysed and its statistics can be cached.
+def _benchmark_rng(seed, benchmark, configuration):
+	digest = hashlib.sha256("{}\0{}".format(benchmark, configuration).encode("utf-8")).digest()
+	return np.random.default_rng([seed, int.from_bytes(digest[:8], "little")])
+
+# Key of a cached statistic, hashing everything it is computed from.
+def _key(*parts):
+	return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()[:32]
+
+
+class AnalysisCache:
+	"""
+	Statistics computed by `Analysis`, kept between analyses so that only
+	those whose inputs changed are computed again. Each is stored under a key
+	hashing its round times, configuration, baseline and analysis settings.
+
+	directory -- directory to keep the cache in: `index.json` holds the
+	             statistics, and a `.npy` file per suite and configuration its
+	             bootstrap log ratios, from which overall intervals are computed
+	keep -- number of saves an unused entry is kept for, so going back to an
+	        earlier baseline or set of results is quick too
+
+	After construction:
+	files -- map from output file path to a hash of its inputs when it was
+	         last written, for analyze.py
+	"""
+	def __init__(self, directory, keep=8):
+		self.directory = directory
+		self.keep = keep
+		index = {}
+		index_path = path.join(directory, "index.json")
+		if path.exists(index_path):
+			try:
+				with open(index_path) as file:
+					index = json.load(file)
+			except (OSError, ValueError):
+				print("WARN: ignoring unreadable analysis cache {}".format(index_path))
+		# Entries are marked with the number of the save that last used them.
+		self._generation = index.get("generation", 0) + 1
+		self._rows = index.get("rows", {})
+		self._suites = index.get("suites", {})
+		self.files = index.get("files", {})
+		# Log ratio sums computed since loading, by key.
+		self._new_sums = {}
+
+	# Ratio and interval of a benchmark as (ratio, low, high), or `None`.
+	def row(self, key):
+		entry = self._rows.get(key)
+		if entry is None:
+			return None
+		entry[0] = self._generation
+		return tuple(entry[1:])
+
+	def set_row(self, key, values):
+		self._rows[key] = [self._generation, *[float(value) for value in values]]
+
+	# Geometric mean and interval of a suite and its bootstrap log ratio sums as
+	# (geomean, low, high, sums), or `None`.
+	def suite(self, key):
+		entry = self._suites.get(key)
+		if entry is None:
+			return None
+		sums = self._new_sums.get(key)
+		if sums is None:
+			try:
+				sums = np.load(path.join(self.directory, key + ".npy"))
+			except (OSError, ValueError):
+				return None
+		entry[0] = self._generation
+		return (*entry[1:], sums)
+
+	def set_suite(self, key, values, sums):
+		self._suites[key] = [self._generation, *[float(value) for value in values]]
+		self._new_sums[key] = sums
+
+	# Write the cache, dropping entries not used in the last `keep` saves.
+	def save(self):
+		os.makedirs(self.directory, exist_ok=True)
+		oldest = self._generation - self.keep
+		self._rows = {key: entry for key, entry in self._rows.items() if entry[0] > oldest}
+		for key in [key for key, entry in self._suites.items() if entry[0] <= oldest]:
+			del self._suites[key]
+			if path.exists(path.join(self.directory, key + ".npy")):
+				os.remove(path.join(self.directory, key + ".npy"))
+		for key, sums in self._new_sums.items():
+			if key in self._suites:
+				np.save(path.join(self.directory, key + ".npy"), sums)
+		self._new_sums = {}
+		with open(path.join(self.directory, "index.json"), "w") as file:
+			json.dump({"generation": self._generation, "rows": self._rows, "suites": self._suites, "files": self.files}, file)
+		self._generation += 1
+
+
+class Analysis:
+	"""
+	Bootstrap analysis of results against a baseline configuration.
+
+	Only benchmarks with results in every one of `configurations` are used,
+	and of those only ones with a mean time above 0 ns in all of them: libtest
+	reports 0 ns for benchmarks whose work was optimised away, which have no
+	ratio.
+	All arrays are indexed by configuration first, in the order of
+	`configurations`.
+
+	results -- Results to analyse
+	configurations -- configuration names to compare, including the baseline
+	baseline -- configuration name to compare against
+	resamples -- number of bootstrap resamples
+	confidence -- confidence level of the intervals, e.g. 0.95
+	seed -- random seed, so the analysis is repeatable
+	cache -- optional AnalysisCache, so that only the benchmarks and suites
+	         whose inputs changed are resampled
+
+	A benchmark with raw samples (see `Results.samples`) in every one of
+	`configurations` is compared on the mean of those, and its samples are
+	resampled; otherwise its round times are. Each benchmark is resampled with
+	its own seed, derived from `seed` and its name, so its statistics don't
+	depend on the other benchmarks analysed.
+
+	After construction:
+	benchmarks, suites -- names of the analysed benchmarks and their suites
+	dropped -- names of the benchmarks left out for a mean time of 0 ns
+	suite_names -- names of the suites, in order of first appearance
+	ratio, ratio_low, ratio_high -- (configurations, benchmarks) arrays of
+	    the ratio of mean times to the baseline and its interval
+	suite_geomean, suite_low, suite_high -- (configurations, suites) arrays of
+	    the geometric mean ratio of each suite's benchmarks and its interval
+	geomean, geomean_low, geomean_high -- (configurations,) arrays of the
+	    geometric mean ratio of all benchmarks and its interval
+	row_keys, suite_keys -- (configurations, benchmarks) and (configurations,
+	    suites) lists of the keys hashing the inputs of each statistic
+	"""
+	def __init__(self, results, configurations, baseline=default_baseline, resamples=10000, confidence=0.95, seed=0, cache=None):
+		if baseline not in configurations:
+			raise ValueError("baseline {} is not one of the configurations".format(baseline))
+		self.configurations = configurations
+		self.baseline = baseline
+		self.confidence = confidence
+
+		summary = results.summary()
+		indices = [results.configurations.index(name) if name in results.configurations else None for name in configurations]
+		complete = [b for b in range(len(results.benchmarks)) if all((b, c) in summary for c in indices)]
+		if len(complete) == 0:
+			raise ValueError("no benchmark has results for all of {}".format(", ".join(configurations)))
+		self.dropped = [results.benchmarks[b] for b in complete if any(summary[(b, c)][1] <= 0 for c in indices)]
+		complete = [b for b in complete if all(summary[(b, c)][1] > 0 for c in indices)]
+		if len(complete) == 0:
+			raise ValueError("no benchmark has a mean time above 0 ns in all of {}".format(", ".join(configurations)))
+		self.benchmarks = [results.benchmarks[b] for b in complete]
+		self.suites = [results.suites[b] for b in complete]
+		self.suite_names = list(dict.fromkeys(self.suites))
+		members = [[b for b, suite in enumerate(self.suites) if suite == name] for name in self.suite_names]
+
+		# Times to resample of each benchmark in each configuration: all its raw
+		# samples if it has them in every configuration, otherwise its round times.
+		times = {}
+		units = {}
+		for benchmark in self.benchmarks:
+			samples = [results.samples(benchmark, name) for name in configurations]
+			units[benchmark] = "samples" if all(len(rounds) > 0 for rounds in samples) else "rounds"
+			for name, rounds in zip(configurations, samples):
+				if units[benchmark] == "samples":
+					times[(benchmark, name)] = [time for _, round_times in sorted(rounds.items()) for time in round_times]
+				else:
+					times[(benchmark, name)] = [time for time, _ in results.rounds(benchmark, name).values()]
+		settings = (resamples, confidence, seed)
+		self.row_keys = [[_key(benchmark, name, units[benchmark], times[(benchmark, name)], baseline, times[(benchmark, baseline)], settings)
+			for benchmark in self.benchmarks] for name in configurations]
+		self.suite_keys = [[_key(suite, [self.row_keys[i][b] for b in members[s]]) for s, suite in enumerate(self.suite_names)]
+			for i in range(len(configurations))]
+
+		# Bootstrap means of each benchmark in each configuration, resampled when
+		# first needed.
+		boots = {}
+		def boot(benchmark, name):
+			if (benchmark, name) not in boots:
+				(samples, counts) = padded_matrix([times[(benchmark, name)]])
+				# As many resamples at once as fit in about 8 MiB.
+				chunk = max(1, min(resamples, 2**20//len(times[(benchmark, name)])))
+				boots[(benchmark, name)] = bootstrap_means(samples, counts, resamples, _benchmark_rng(seed, benchmark, name), chunk)[:, 0]
+			return boots[(benchmark, name)]
+
+		shape = (len(configurations), len(self.benchmarks))
+		self.ratio, self.ratio_low, self.ratio_high = np.empty(shape), np.empty(shape), np.empty(shape)
+		shape = (len(configurations), len(self.suite_names))
+		self.suite_geomean, self.suite_low, self.suite_high = np.empty(shape), np.empty(shape), np.empty(shape)
+		shape = (len(configurations),)
+		self.geomean, self.geomean_low, self.geomean_high = np.empty(shape), np.empty(shape), np.empty(shape)
+		with np.errstate(divide="ignore", invalid="ignore"):
+			for i, name in enumerate(configurations):
+				# Sum over all benchmarks of the log ratio in each resample.
+				log_sums = np.zeros(resamples)
+				for s, suite_members in enumerate(members):
+					rows = [None if cache is None else cache.row(self.row_keys[i][b]) for b in suite_members]
+					suite = None if cache is None else cache.suite(self.suite_keys[i][s])
+					if suite is None or None in rows:
+						benchmarks = [self.benchmarks[b] for b in suite_members]
+						ratio = [np.mean(times[(benchmark, name)])/np.mean(times[(benchmark, baseline)]) for benchmark in benchmarks]
+						ratio_boot = np.stack([boot(benchmark, name)/boot(benchmark, baseline) for benchmark in benchmarks], axis=1)
+						rows = list(zip(ratio, *percentile_interval(ratio_boot, confidence)))
+						suite_sums = np.log(ratio_boot).sum(axis=1)
+						geomean = np.exp(np.mean(np.log(ratio)))
+						suite = (geomean, *percentile_interval(np.exp(suite_sums/len(suite_members)), confidence), suite_sums)
+						if cache is not None:
+							for b, row in zip(suite_members, rows):
+								cache.set_row(self.row_keys[i][b], row)
+							cache.set_suite(self.suite_keys[i][s], suite[:3], suite_sums)
+					for b, row in zip(suite_members, rows):
+						(self.ratio[i, b], self.ratio_low[i, b], self.ratio_high[i, b]) = row
+					(self.suite_geomean[i, s], self.suite_low[i, s], self.suite_high[i, s]) = suite[:3]
+					log_sums += suite[3]
+
+				self.geomean[i] = np.exp(np.log(self.ratio[i]).mean())
+				(self.geomean_low[i], self.geomean_high[i]) = percentile_interval(np.exp(log_sums/len(self.benchmarks)), confidence)
+
+	# Print a warning naming the benchmarks left out for a mean time of 0 ns.
+	def print_dropped(self):
+		if len(self.dropped) > 0:
+			print("WARN: left out {} benchmark(s) with a mean time of 0 ns: {}".format(len(self.dropped), ", ".join(self.dropped)))
+
+	# Print geometric means per suite and overall.
+	def report(self):
+		self.print_dropped()
+		others = [i for i, name in enumerate(self.configurations) if name != self.baseline]
+		print("Geometric mean time relative to {}, with {:.0f}% confidence intervals".format(self.baseline, self.confidence*100))
+		print("{:30s}".format("suite") + "".join(" {:>28s}".format(self.configurations[i]) for i in others))
+		rows = [(suite, self.suite_geomean[:, s], self.suite_low[:, s], self.suite_high[:, s]) for s, suite in enumerate(self.suite_names)]
+		rows.append(("overall", self.geomean, self.geomean_low, self.geomean_high))
+		for (name, mean, low, high) in rows:
+			print("{:30s}".format(name) + "".join(" {:8.4f} [{:8.4f}, {:8.4f}]".format(mean[i], low[i], high[i]) for i in others))
+
+	# Write the ratio of every benchmark to the baseline, with error ranges from
+	# the bootstrap intervals, to a Pgfplots table file.
+	def write_pgfplots(self, file_path):
+		others = [i for i, name in enumerate(self.configurations) if name != self.baseline]
+		with open(file_path, "w") as file:
+			# Write notes.
+			file.write("# This is benchmark data formatted for rendering via LaTeX and Pgfplots.\n")
+			file.write("# Error ranges are {:.0f}% bootstrap confidence intervals.\n".format(self.confidence*100))
+			file.write("# If you need the list of symbolic values used, copy this:\n")
+			file.write("# symbolic y coords={")
+			file.write(",".join(_tex_name(benchmark) for benchmark in self.benchmarks))
+			file.write("}\n")
+
+			# Write headers.
+			file.write("benchmark")
+			for i in others:
+				mode = self.configurations[i]
+				file.write(" {}-mean {}-error-negative {}-error-positive".format(mode, mode, mode))
+			file.write("\n")
+
+			# Write data.
+			for b, benchmark in enumerate(self.benchmarks):
+				file.write(_tex_name(benchmark))
+				for i in others:
+					mean = self.ratio[i, b]
+					file.write(" {} {} {}".format(mean, mean-self.ratio_low[i, b], self.ratio_high[i, b]-mean))
+				file.write("\n")
+
+	# Write the geometric mean ratio of each suite (or those indexed by
+	# `suites`) to a tab-separated file for gnuplot, with a column for each
+	# configuration in the order of `self.configurations`, followed by the
+	# interval bounds of each.
+	def write_suite_table(self, file_path, suites=None):
+		with open(file_path, "w") as file:
+			file.write("# benchmark\t" + "\t".join(self.configurations))
+			file.write("".join("\t{}-low\t{}-high".format(name, name) for name in self.configurations) + "\n")
+			for s in range(len(self.suite_names)) if suites is None else suites:
+				suite = self.suite_names[s]
+				file.write(suite.replace("_", "-"))
+				file.write("".join("\t{}".format(self.suite_geomean[i, s]) for i in range(len(self.configurations))))
+				file.write("".join("\t{}\t{}".format(self.suite_low[i, s], self.suite_high[i, s]) for i in range(len(self.configurations))))
+				file.write("\n")
+
+
+def _tex_name(benchmark):
+	assert(benchmark.find(" ") == -1)
+	return benchmark.replace("_", "\\_")
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Analyse benchmark results saved by run.py.")
+	parser.add_argument("results", nargs="?", default="./tmp/benchmark_data.npz", help="results file (default: %(default)s)")
+	parser.add_argument("--baseline", default=default_baseline, help="configuration to compare against (default: %(default)s)")
+	parser.add_argument("--configurations", default=",".join(plot_configurations),
+		help="comma separated configurations to analyse, in output column order (default: %(default)s)")
+	parser.add_argument("--resamples", type=int, default=10000, help="number of bootstrap resamples (default: %(default)s)")
+	parser.add_argument("--confidence", type=float, default=0.95, help="confidence level of intervals (default: %(default)s)")
+	parser.add_argument("--seed", type=int, default=0, help="random seed (default: %(default)s)")
+	parser.add_argument("--output", default=None, help="directory to write bench.dat and benchmark_data.dat to (default: next to the results)")
+	args = parser.parse_args()
+
+	output = path.dirname(args.results) if args.output is None else args.output
+	analysis = Analysis(Results.load(args.results), args.configurations.split(","), args.baseline,
+		args.resamples, args.confidence, args.seed)
+	analysis.report()
+	analysis.write_suite_table(path.join(output, "bench.dat"))
+	analysis.write_pgfplots(path.join(output, "benchmark_data.dat"))
@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+# Rebuild the reports of a benchmarking run from its saved results, without
+# running anything: the CSV file of every round, the Pgfplots table and the
+# gnuplot inputs of plotdata.gpi.
+# Statistics are kept in an `analysis.AnalysisCache`, and a file is only
+# written again when what it is made from changed, so after changing the
+# baseline or adding a suite only the rows and files that depend on it are
+# computed again.
+# Needs NumPy.
+import argparse
+import hashlib
+from os import path
+
+import analysis
+from results import Results
+
+# Hash of `parts`, to tell whether the inputs of an output changed.
+def _digest(*parts):
+	return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+# Write `file_name` in directory `output` with `write(file_path)`, unless its
+# inputs (hashed as `digest`) are the same as when it was last written.
+# Returns whether it was written.
+def _update(cache, output, file_name, digest, write):
+	file_path = path.join(output, file_name)
+	key = path.abspath(file_path)
+	if cache.files.get(key) == digest and path.exists(file_path):
+		return False
+	write(file_path)
+	cache.files[key] = digest
+	return True
+
+# Write `benchmark_data.csv` to `output` as run.py does, with the results of
+# `configurations` over `rounds` rounds. Returns the names of the files written.
+def write_csv(results, configurations, rounds, output, cache):
+	rows = [(benchmark, [(sorted(results.rounds(benchmark, name).items()),
+		sorted(round for round, values in results.metric_values(benchmark, name).items() if values.get("timeout")))
+		for name in configurations]) for benchmark in results.benchmarks]
+	digest = _digest(configurations, rounds, rows)
+	written = _update(cache, output, "benchmark_data.csv", digest,
+		lambda file_path: results.write_csv(file_path, configurations, rounds))
+	return ["benchmark_data.csv"] if written else []
+
+# Analyse `results` (see `analysis.Analysis`) and write to `output`:
+#   benchmark_data.dat -- the ratio of each benchmark to the baseline
+#   bench.dat -- the geometric mean ratio of each suite
+#   bench1.dat, bench2.dat -- the first and second half of bench.dat, the
+#                             bottom and top rows of plotdata.gpi
+# Returns the analysis and the names of the files written.
+def write_plot_data(results, configurations, baseline, output, cache, resamples=10000, confidence=0.95, seed=0):
+	plot_analysis = analysis.Analysis(results, configurations, baseline, resamples, confidence, seed, cache)
+	written = []
+	digest = _digest(configurations, plot_analysis.row_keys)
+	if _update(cache, output, "benchmark_data.dat", digest, plot_analysis.write_pgfplots):
+		written.append("benchmark_data.dat")
+	count = len(plot_analysis.suite_names)
+	half = (count+1)//2
+	for file_name, suites in [("bench.dat", range(count)), ("bench1.dat", range(half)), ("bench2.dat", range(half, count))]:
+		digest = _digest(configurations, [[keys[s] for s in suites] for keys in plot_analysis.suite_keys])
+		if _update(cache, output, file_name, digest, lambda file_path: plot_analysis.write_suite_table(file_path, suites)):
+			written.append(file_name)
+	return (plot_analysis, written)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Rebuild reports from benchmark results saved by run.py, computing only what changed.")
+	parser.add_argument("results", nargs="?", default="./tmp/benchmark_data.npz", help="results file (default: %(default)s)")
+	parser.add_argument("--baseline", default=None,
+		help="configuration to compare against (default: {}, or the first configuration)".format(analysis.default_baseline))
+	parser.add_argument("--configurations", default=None,
+		help="comma separated configurations to analyse, in output column order (default: {} if all have results, otherwise those in the results)".format(",".join(analysis.plot_configurations)))
+	parser.add_argument("--rounds", type=int, default=None, help="rounds in the CSV file (default: the most recorded)")
+	parser.add_argument("--resamples", type=int, default=10000, help="number of bootstrap resamples (default: %(default)s)")
+	parser.add_argument("--confidence", type=float, default=0.95, help="confidence level of intervals (default: %(default)s)")
+	parser.add_argument("--seed", type=int, default=0, help="random seed (default: %(default)s)")
+	parser.add_argument("--output", default=None, help="directory to write the reports to (default: next to the results)")
+	parser.add_argument("--cache", default=None, help="directory to keep computed statistics in (default: analysis_cache in the output directory)")
+	parser.add_argument("--quiet", action="store_true", help="don't print the geometric means")
+	args = parser.parse_args()
+
+	if not path.exists(args.results):
+		print("ERROR: no results in {}".format(args.results))
+		exit(1)
+	results = Results.load(args.results)
+	output = path.dirname(args.results) if args.output is None else args.output
+	if args.configurations is not None:
+		configurations = args.configurations.split(",")
+	elif all(name in results.configurations for name in analysis.plot_configurations):
+		configurations = analysis.plot_configurations
+	else:
+		configurations = list(results.configurations)
+	if args.baseline is not None:
+		baseline = args.baseline
+	else:
+		baseline = analysis.default_baseline if analysis.default_baseline in configurations else configurations[0]
+
+	cache = analysis.AnalysisCache(path.join(output, "analysis_cache") if args.cache is None else args.cache)
+	written = write_csv(results, list(results.configurations), max(1, args.rounds or results.max_rounds()), output, cache)
+	try:
+		(plot_analysis, plot_written) = write_plot_data(results, configurations, baseline, output, cache,
+			args.resamples, args.confidence, args.seed)
+	except ValueError as e:
+		print("ERROR: {}".format(e))
+		exit(1)
+	cache.save()
+	if args.quiet:
+		plot_analysis.print_dropped()
+	else:
+		plot_analysis.report()
+	written += plot_written
+	print("Wrote {}".format(", ".join(written)) if len(written) > 0 else "Nothing changed")
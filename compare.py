@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+# Compare two sets of benchmark results saved by run.py, e.g. from two builds
+# of the compiler, and report significant slowdowns and speedups.
+# Each benchmark and configuration found in both sets is tested with a
+# Mann-Whitney U test, and the p-values of all tests are adjusted for multiple
+# comparisons with the Benjamini-Hochberg procedure. The size of each change is
+# the ratio of mean times (new/old), with a bootstrap confidence interval.
+# Needs NumPy.
+import argparse
+import functools
+import math
+import sys
+
+import numpy as np
+
+from analysis import bootstrap_means, padded_matrix, percentile_interval
+from results import Results
+
+
+class Change:
+	"""
+	Comparison of one benchmark in one configuration between two result sets.
+
+	benchmark, configuration -- names
+	unit -- what was compared, "rounds" (one median time per round) or
+	        "samples" (raw samples from the harness, when both sets have them)
+	old_count, new_count -- number of times compared from each set
+	ratio -- ratio of the mean new time to the mean old time, which is 0, inf
+	         or nan if a mean is 0 ns (see `measurable`)
+	low, high -- bounds of the confidence interval of `ratio`
+	p -- p-value of the rank test
+	q -- p-value adjusted for multiple comparisons
+	"""
+	def __init__(self, benchmark, configuration, unit, old_times, new_times):
+		self.benchmark = benchmark
+		self.configuration = configuration
+		self.unit = unit
+		self.old_count = len(old_times)
+		self.new_count = len(new_times)
+		with np.errstate(divide="ignore", invalid="ignore"):
+			self.ratio = np.mean(new_times)/np.mean(old_times)
+		self.low = self.high = None
+		self.p = mann_whitney(old_times, new_times)
+		self.q = None
+
+	# Whether `ratio` is a positive number. It isn't if a mean time is 0 ns,
+	# which libtest reports for benchmarks whose work was optimised away.
+	def measurable(self):
+		return 0 < self.ratio < math.inf
+
+	# Whether the change is significant at false discovery rate `alpha` and at
+	# least `min_change` (a fraction) in size. Changes that aren't `measurable`
+	# have no size, so are never significant.
+	def significant(self, alpha, min_change=0):
+		return self.q < alpha and self.measurable() and abs(math.log(self.ratio)) >= math.log1p(min_change)
+
+
+# Two-sided p-value of the Mann-Whitney U test of whether `x` and `y` come
+# from the same distribution.
+# Small samples without ties use the exact distribution of U, others the
+# normal approximation with a correction for ties.
+def mann_whitney(x, y):
+	(n, m) = (len(x), len(y))
+	ranks = rank([*x, *y])
+	u = ranks[:n].sum() - n*(n+1)/2
+	ties = np.unique(ranks, return_counts=True)[1]
+	if n*m <= 400 and (ties == 1).all():
+		cumulative = _u_cumulative(n, m)
+		u = int(round(u))
+		lower = cumulative[u]
+		upper = 1 - (cumulative[u-1] if u > 0 else 0)
+		return min(1.0, 2*min(lower, upper))
+	mean = n*m/2
+	variance = n*m/12*((n+m+1) - ((ties**3 - ties).sum())/((n+m)*(n+m-1)))
+	if variance == 0:
+		return 1.0
+	# Continuity correction.
+	z = max(0.0, abs(u - mean) - 0.5)/math.sqrt(variance)
+	return math.erfc(z/math.sqrt(2))
+
+# Ranks of `values` starting from 1, with tied values given their mean rank.
+def rank(values):
+	values = np.asarray(values)
+	order = np.argsort(values, kind="mergesort")
+	sorted_values = values[order]
+	# Start of each run of equal values.
+	starts = np.flatnonzero(np.r_[True, sorted_values[1:] != sorted_values[:-1]])
+	ends = np.r_[starts[1:], len(values)]
+	ranks = np.empty(len(values))
+	ranks[order] = np.repeat((starts + ends + 1)/2, ends - starts)
+	return ranks
+
+# Cumulative distribution of U for sample sizes `n` and `m` without ties, as a
+# list indexed by U.
+@functools.lru_cache(maxsize=None)
+def _u_cumulative(n, m):
+	# counts[i][j][u] is the number of orderings of i and j values with that U.
+	counts = [[None]*(m+1) for _ in range(n+1)]
+	for i in range(n+1):
+		for j in range(m+1):
+			if i == 0 or j == 0:
+				counts[i][j] = [1]
+				continue
+			# The largest value is either one of the i (which beats all j) or
+			# one of the j.
+			a = [0]*j + counts[i-1][j]
+			b = counts[i][j-1]
+			counts[i][j] = [(a[u] if u < len(a) else 0) + (b[u] if u < len(b) else 0) for u in range(i*j+1)]
+	total = math.comb(n+m, n)
+	return list(np.cumsum(counts[n][m])/total)
+
+# Set the `q` of each of `changes` using the Benjamini-Hochberg procedure.
+def adjust_p_values(changes):
+	order = sorted(range(len(changes)), key=lambda i: changes[i].p)
+	q = 1.0
+	for position in reversed(range(len(order))):
+		change = changes[order[position]]
+		q = min(q, change.p*len(changes)/(position+1))
+		change.q = q
+
+# Times to compare for `benchmark` in `configuration` of `old` and `new`, as
+# (unit, old times, new times). Raw samples are used if both have them.
+def comparable_times(old, new, benchmark, configuration):
+	old_samples = old.samples(benchmark, configuration)
+	new_samples = new.samples(benchmark, configuration)
+	if len(old_samples) > 0 and len(new_samples) > 0:
+		return ("samples", [t for times in old_samples.values() for t in times], [t for times in new_samples.values() for t in times])
+	return ("rounds",
+		[time for time, _ in old.rounds(benchmark, configuration).values()],
+		[time for time, _ in new.rounds(benchmark, configuration).values()])
+
+# Compare every benchmark and configuration present in both `old` and `new`.
+# Returns a list of `Change`, ranked by size of the change, largest first.
+def compare(old, new, resamples=10000, confidence=0.95, seed=0):
+	changes = []
+	(all_old_times, all_new_times) = ([], [])
+	for configuration in old.configurations:
+		if configuration not in new.configurations:
+			continue
+		for benchmark in old.benchmarks:
+			(unit, old_times, new_times) = comparable_times(old, new, benchmark, configuration)
+			if len(old_times) > 0 and len(new_times) > 0:
+				changes.append(Change(benchmark, configuration, unit, old_times, new_times))
+				all_old_times.append(old_times)
+				all_new_times.append(new_times)
+	if len(changes) == 0:
+		return changes
+	adjust_p_values(changes)
+
+	# Bootstrap all intervals at once.
+	rng = np.random.default_rng(seed)
+	old_boot = bootstrap_means(*padded_matrix(all_old_times), resamples, rng)
+	new_boot = bootstrap_means(*padded_matrix(all_new_times), resamples, rng)
+	with np.errstate(divide="ignore", invalid="ignore"):
+		(low, high) = percentile_interval(new_boot/old_boot, confidence)
+	for change, change_low, change_high in zip(changes, low, high):
+		(change.low, change.high) = (change_low, change_high)
+
+	# Changes without a size go last.
+	changes.sort(key=lambda change: abs(math.log(change.ratio)) if change.measurable() else -1, reverse=True)
+	return changes
+
+def write_csv(file_path, changes):
+	with open(file_path, "w") as file:
+		file.write("benchmark, configuration, unit, old count, new count, ratio, low, high, p, q\n")
+		for c in changes:
+			file.write("{}, {}, {}, {}, {}, {}, {}, {}, {}, {}\n".format(c.benchmark, c.configuration, c.unit,
+				c.old_count, c.new_count, c.ratio, c.low, c.high, c.p, c.q))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Find significant changes between two sets of results saved by run.py.")
+	parser.add_argument("old", help="results to compare against (.npz)")
+	parser.add_argument("new", help="results to compare (.npz)")
+	parser.add_argument("--alpha", type=float, default=0.05, help="false discovery rate (default: %(default)s)")
+	parser.add_argument("--min-change", type=float, default=0.0,
+		help="ignore changes smaller than this fraction, e.g. 0.01 for 1%% (default: %(default)s)")
+	parser.add_argument("--all", action="store_true", help="list every comparison, not only significant changes")
+	parser.add_argument("--resamples", type=int, default=10000, help="number of bootstrap resamples (default: %(default)s)")
+	parser.add_argument("--confidence", type=float, default=0.95, help="confidence level of intervals (default: %(default)s)")
+	parser.add_argument("--seed", type=int, default=0, help="random seed (default: %(default)s)")
+	parser.add_argument("--csv", help="also write every comparison to this CSV file")
+	parser.add_argument("--check", action="store_true", help="exit with status 1 if there are significant slowdowns")
+	args = parser.parse_args()
+
+	changes = compare(Results.load(args.old), Results.load(args.new), args.resamples, args.confidence, args.seed)
+	if args.csv is not None:
+		write_csv(args.csv, changes)
+
+	flagged = [change for change in changes if change.significant(args.alpha, args.min_change)]
+	print("Compared {} benchmark configurations, {} significant changes (false discovery rate {})".format(
+		len(changes), len(flagged), args.alpha))
+	# The smallest p-value a rank test can give is 2/(n+m choose n).
+	underpowered = [change for change in changes if 2/math.comb(change.old_count + change.new_count, change.old_count) > args.alpha]
+	if len(underpowered) > 0:
+		print("WARN: {} benchmark configurations have too few rounds for any change to be significant, use more --rounds".format(len(underpowered)))
+
+	# Summary per configuration.
+	for configuration in dict.fromkeys(change.configuration for change in changes):
+		ratios = [change.ratio for change in changes if change.configuration == configuration and change.measurable()]
+		unmeasurable = sum(1 for change in changes if change.configuration == configuration and not change.measurable())
+		slower = sum(1 for change in flagged if change.configuration == configuration and change.ratio > 1)
+		faster = sum(1 for change in flagged if change.configuration == configuration and change.ratio < 1)
+		geomean = "n/a" if len(ratios) == 0 else "{:.4f}".format(math.exp(sum(math.log(ratio) for ratio in ratios)/len(ratios)))
+		print("  {:30s} geomean {}, {} slower, {} faster".format(configuration, geomean, slower, faster)
+			+ ("" if unmeasurable == 0 else ", {} with a mean of 0 ns left out".format(unmeasurable)))
+
+	print("{:50s} {:20s} {:>8s} {:>20s} {:>10s} {:>10s}".format("benchmark", "configuration", "ratio", "interval", "p", "q"))
+	for change in (changes if args.all else flagged):
+		mark = "" if not change.significant(args.alpha, args.min_change) else ("SLOWER" if change.ratio > 1 else "FASTER")
+		if change.measurable():
+			ratio = "{:8.4f} [{:8.4f}, {:8.4f}]".format(change.ratio, change.low, change.high)
+		else:
+			ratio = "{:>8s} {:20s}".format("n/a", "")
+		print("{:50s} {:20s} {} {:10.2e} {:10.2e} {}".format(change.benchmark, change.configuration, ratio, change.p, change.q, mark))
+
+	if args.check and any(change.ratio > 1 for change in flagged):
+		sys.exit(1)
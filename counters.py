@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+# Wrapper that runs a benchmark binary under a counter collector, used by
+# runner.sh when run.py is given `--counters`.
+#
+#   counters.py [--local] BINARY -- COMMAND...
+#
+# COMMAND runs the benchmark binary BINARY, either directly or through the
+# remote test client. Its output is passed through, followed by one line
+#
+#   counters: {"binary-size": ..., "cycles": ..., ...}
+#
+# that run.py picks up and stores with the benchmark results.
+#
+# The collector is a command prefix taken from BENCH_COUNTERS_COMMAND, where
+# "{output}" is replaced with a file the collector must write `perf stat -x ,`
+# style CSV to (value, unit, metric name). Any metric can be reported this way.
+# The collector runs on this machine, around COMMAND: for a remote benchmark it
+# wraps the test client, so to count on the target it must collect there itself
+# (e.g. over ssh) and write the result to "{output}".
+# With `--local`, COMMAND runs the benchmark on this machine, so `perf stat` is
+# the default collector, and if GNU time is installed the maximum resident set
+# size is measured too. GNU time runs COMMAND itself, so this is the peak RSS
+# of the benchmark rather than of this script or the collector.
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+
+# Events counted by the default collector.
+perf_events = ["cycles", "instructions", "cache-misses", "dTLB-load-misses"]
+
+# Path of GNU time, which can report the maximum resident set size of the
+# command it runs, or `None` if it isn't installed.
+def gnu_time():
+	program = shutil.which("time")
+	if program is None:
+		return None
+	try:
+		res = subprocess.run([program, "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+	except OSError:
+		return None
+	return program if "GNU" in res.stdout else None
+
+# Metrics in `perf stat -x ,` output, as a map from name to value.
+# Events that couldn't be counted are left out.
+def parse_perf_csv(text):
+	metrics = {}
+	for line in text.splitlines():
+		fields = line.split(",")
+		if line.startswith("#") or len(fields) < 3:
+			continue
+		try:
+			metrics[fields[2]] = float(fields[0])
+		except ValueError:
+			# "<not supported>" or "<not counted>".
+			continue
+	return metrics
+
+def main(args):
+	local = len(args) > 0 and args[0] == "--local"
+	if local:
+		args = args[1:]
+	if len(args) < 3 or args[1] != "--":
+		print("Usage: counters.py [--local] BINARY -- COMMAND...", file=sys.stderr)
+		return 2
+	(binary, command) = (args[0], args[2:])
+
+	collector = os.environ.get("BENCH_COUNTERS_COMMAND")
+	if collector is None and local and shutil.which("perf") is not None:
+		collector = "perf stat -x , -e {} -o {{output}} --".format(",".join(perf_events))
+	metrics = {}
+	with tempfile.TemporaryDirectory() as directory:
+		output = os.path.join(directory, "counters.csv")
+		prefix = [] if collector is None else [word.replace("{output}", output) for word in shlex.split(collector)]
+		rss_output = os.path.join(directory, "max-rss")
+		time = gnu_time() if local else None
+		if time is not None:
+			# Innermost, so only the benchmark command is measured.
+			prefix += [time, "-f", "%M", "-o", rss_output]
+		returncode = subprocess.call(prefix + command)
+		if os.path.exists(rss_output):
+			with open(rss_output) as file:
+				lines = file.read().split("\n")
+			# In KiB. GNU time notes a non-zero exit status on the line before.
+			values = [line for line in lines if line.strip().isdigit()]
+			if len(values) > 0:
+				metrics["max-rss"] = int(values[-1])
+		if os.path.exists(output):
+			with open(output) as file:
+				metrics.update(parse_perf_csv(file.read()))
+	if os.path.exists(binary):
+		metrics["binary-size"] = os.path.getsize(binary)
+
+	sys.stdout.flush()
+	print("counters: " + json.dumps(metrics), flush=True)
+	return returncode
+
+if __name__ == "__main__":
+	sys.exit(main(sys.argv[1:]))
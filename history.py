@@ -0,0 +1,285 @@
+#!/usr/bin/python3
+# Database of benchmark results across runs of run.py, keyed by the commit of
+# the compiler that produced them.
+# run.py adds every round it runs, and this script queries the history:
+#
+#   python3 history.py series BENCHMARK       times of a benchmark per build
+#   python3 history.py movers --last N        biggest changes over N builds
+#   python3 history.py overhead --last N      geomean overhead of a
+#                                             configuration per build
+#   python3 history.py durations              where the wall time of a run
+#                                             goes, by suite
+#
+# A build is a compiler commit plus any uncommitted changes to it, so several
+# runs (e.g. reruns of a few suites) of the same build are combined.
+import argparse
+import math
+import sqlite3
+import threading
+import time
+
+_schema = """
+CREATE TABLE IF NOT EXISTS runs (
+	id INTEGER PRIMARY KEY,
+	rust_commit TEXT NOT NULL,
+	dirty TEXT,
+	started REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_build ON runs (rust_commit, dirty);
+CREATE INDEX IF NOT EXISTS runs_started ON runs (started);
+CREATE TABLE IF NOT EXISTS results (
+	run INTEGER NOT NULL REFERENCES runs (id),
+	configuration TEXT NOT NULL,
+	suite TEXT NOT NULL,
+	benchmark TEXT NOT NULL,
+	round INTEGER NOT NULL,
+	time INTEGER NOT NULL,
+	range INTEGER NOT NULL,
+	device TEXT NOT NULL,
+	recorded REAL NOT NULL,
+	UNIQUE (run, configuration, benchmark, round)
+);
+CREATE INDEX IF NOT EXISTS results_benchmark ON results (benchmark, configuration);
+CREATE INDEX IF NOT EXISTS results_suite ON results (configuration, suite);
+CREATE INDEX IF NOT EXISTS results_recorded ON results (recorded);
+CREATE TABLE IF NOT EXISTS phases (
+	run INTEGER NOT NULL REFERENCES runs (id),
+	phase TEXT NOT NULL,
+	configuration TEXT NOT NULL,
+	suite TEXT NOT NULL,
+	round INTEGER,
+	seconds REAL NOT NULL,
+	status TEXT NOT NULL,
+	recorded REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS phases_work ON phases (phase, configuration, suite);
+"""
+
+# Phases of a run whose wall time is recorded:
+# toolchain -- building and installing the compiler for a configuration
+# build -- building the benchmarks of a suite (or subproject) directory
+# round -- running one round of the benchmarks of a directory
+phases = ["toolchain", "build", "round"]
+
+
+class History:
+	"""
+	SQLite database of results from every run.
+
+	runs -- one row per run of run.py, with the compiler commit, hash of
+	        uncommitted compiler changes (NULL if none) and start time
+	results -- one row per round of a benchmark in a run, as in `Results`,
+	           with the suite (or subproject) directory and the time the
+	           round was recorded
+	phases -- one row per phase (see `phases`) of a run, with the seconds it
+	          took and its status ("ok", "fail" or "timeout"), where suite is
+	          empty for toolchains and round is NULL other than for rounds
+
+	file_path -- database file, created if missing
+	"""
+	def __init__(self, file_path):
+		self.run = None
+		# Rounds are recorded from the threads running benchmarks.
+		self._connection = sqlite3.connect(file_path, check_same_thread=False)
+		self._connection.executescript(_schema)
+		self._lock = threading.Lock()
+
+	# Start recording a run of compiler `rust_commit` with uncommitted changes
+	# hashing to `dirty` (or `None`).
+	# With `resume`, the latest run of the same build is continued instead of
+	# starting a new one, matching `Journal`.
+	def start_run(self, rust_commit, dirty, resume=False):
+		with self._lock, self._connection:
+			if resume:
+				row = self._connection.execute("SELECT id FROM runs WHERE rust_commit = ? AND dirty IS ? ORDER BY started DESC LIMIT 1",
+					(rust_commit, dirty)).fetchone()
+				if row is not None:
+					self.run = row[0]
+					return
+			self.run = self._connection.execute("INSERT INTO runs (rust_commit, dirty, started) VALUES (?, ?, ?)",
+				(rust_commit, dirty, time.time())).lastrowid
+
+	# Record a round of `suite` in `configuration`, given as a list of
+	# (benchmark, time, range, device), replacing any earlier record of it in
+	# this run.
+	def record(self, suite, configuration, round, rows):
+		now = time.time()
+		with self._lock, self._connection:
+			self._connection.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+				[(self.run, configuration, suite, benchmark, round, time_taken, time_range, device, now)
+					for benchmark, time_taken, time_range, device in rows])
+
+	# Record that `phase` of `suite` (or subproject directory) in
+	# `configuration` took `seconds`.
+	def record_phase(self, phase, configuration, suite, round, seconds, status="ok"):
+		with self._lock, self._connection:
+			self._connection.execute("INSERT INTO phases VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+				(self.run, phase, configuration, suite, round, seconds, status, time.time()))
+
+	# Phases recorded in run `run`, as a list of (phase, configuration, suite,
+	# round, seconds, status) in the order they finished.
+	def run_phases(self, run):
+		return self._connection.execute("SELECT phase, configuration, suite, round, seconds, status FROM phases WHERE run = ? ORDER BY recorded",
+			(run,)).fetchall()
+
+	# Mean seconds each kind of work took when it succeeded, over the latest
+	# `last` runs (all runs if `None`), as a map from (phase, configuration,
+	# suite) to (mean seconds, count).
+	def phase_durations(self, last=None):
+		query = "SELECT phase, configuration, suite, AVG(seconds), COUNT(*) FROM phases WHERE status = 'ok'"
+		if last is not None:
+			query += " AND run IN (SELECT id FROM runs ORDER BY started DESC LIMIT {})".format(int(last))
+		query += " GROUP BY phase, configuration, suite"
+		return {(phase, configuration, suite): (mean, count) for phase, configuration, suite, mean, count in self._connection.execute(query)}
+
+	# The latest `last` builds (all builds if `None`), oldest first, as a list
+	# of (commit, dirty, time of the build's latest run).
+	def builds(self, last=None):
+		rows = self._connection.execute("SELECT rust_commit, dirty, MAX(started) AS latest FROM runs GROUP BY rust_commit, dirty"
+			" ORDER BY latest DESC" + ("" if last is None else " LIMIT {}".format(int(last)))).fetchall()
+		return list(reversed(rows))
+
+	# Mean time of every benchmark in each build, as a map from (commit, dirty)
+	# to {(benchmark, configuration): (mean time, rounds)}.
+	# Only `builds` (from `History.builds`), and `configurations` and
+	# `benchmark` if given, are included.
+	def build_means(self, builds, configurations=None, benchmark=None):
+		means = {(commit, dirty): {} for commit, dirty, _ in builds}
+		query = ("SELECT runs.rust_commit, runs.dirty, results.benchmark, results.configuration, AVG(results.time), COUNT(*)"
+			" FROM results JOIN runs ON results.run = runs.id")
+		conditions = []
+		parameters = []
+		if configurations is not None:
+			conditions.append("results.configuration IN ({})".format(", ".join("?"*len(configurations))))
+			parameters += configurations
+		if benchmark is not None:
+			conditions.append("results.benchmark = ?")
+			parameters.append(benchmark)
+		if len(conditions) > 0:
+			query += " WHERE " + " AND ".join(conditions)
+		query += " GROUP BY runs.rust_commit, runs.dirty, results.benchmark, results.configuration"
+		for commit, dirty, name, configuration, mean, count in self._connection.execute(query, parameters):
+			if (commit, dirty) in means:
+				means[(commit, dirty)][(name, configuration)] = (mean, count)
+		return means
+
+	def close(self):
+		self._connection.close()
+
+
+def _build_name(commit, dirty):
+	return commit[:12] + ("" if dirty is None else "+" + dirty[:8])
+
+def _date(timestamp):
+	return time.strftime("%Y-%m-%d %H:%M", time.localtime(timestamp))
+
+def _geomean(ratios):
+	return math.exp(sum(math.log(ratio) for ratio in ratios)/len(ratios))
+
+# Print the mean time of `benchmark` in each build.
+def print_series(history, benchmark, configurations=None):
+	builds = history.builds()
+	means = history.build_means(builds, configurations, benchmark)
+	print("{:22s} {:16s} {:20s} {:>14s} {:>6s}".format("build", "date", "configuration", "mean/ns", "rounds"))
+	for commit, dirty, latest in builds:
+		for (_, configuration), (mean, count) in sorted(means[(commit, dirty)].items()):
+			print("{:22s} {:16s} {:20s} {:14.1f} {:6d}".format(_build_name(commit, dirty), _date(latest), configuration, mean, count))
+
+# Print the benchmarks whose mean time changed most between the oldest and
+# newest of the last `last` builds they were run in.
+def print_movers(history, last, configurations=None, top=20):
+	builds = history.builds(last)
+	means = history.build_means(builds, configurations)
+	# First and last mean of each benchmark in the window.
+	first = {}
+	latest = {}
+	for commit, dirty, _ in builds:
+		for key, (mean, _) in means[(commit, dirty)].items():
+			first.setdefault(key, (commit, dirty, mean))
+			latest[key] = (commit, dirty, mean)
+	moves = []
+	for key, (commit, dirty, mean) in latest.items():
+		(first_commit, first_dirty, first_mean) = first[key]
+		if (first_commit, first_dirty) != (commit, dirty) and first_mean > 0 and mean > 0:
+			moves.append((mean/first_mean, key, _build_name(first_commit, first_dirty), _build_name(commit, dirty)))
+	moves.sort(key=lambda move: abs(math.log(move[0])), reverse=True)
+	print("Largest changes over the last {} builds".format(len(builds)))
+	print("{:50s} {:20s} {:>8s} {:22s} {:22s}".format("benchmark", "configuration", "ratio", "from", "to"))
+	for ratio, (benchmark, configuration), from_build, to_build in moves[:top]:
+		print("{:50s} {:20s} {:8.4f} {:22s} {:22s}".format(benchmark, configuration, ratio, from_build, to_build))
+
+# Print the geometric mean ratio of times in `configuration` to `baseline` in
+# each of the last `last` builds, over the benchmarks run in both.
+def print_overhead(history, configuration, baseline, last=None):
+	builds = history.builds(last)
+	means = history.build_means(builds, [configuration, baseline])
+	print("Geometric mean time of {} relative to {}".format(configuration, baseline))
+	print("{:22s} {:16s} {:>8s} {:>10s}".format("build", "date", "ratio", "benchmarks"))
+	for commit, dirty, latest in builds:
+		build = means[(commit, dirty)]
+		ratios = [mean/build[(name, baseline)][0] for (name, mode), (mean, _) in build.items()
+			if mode == configuration and (name, baseline) in build and build[(name, baseline)][0] > 0 and mean > 0]
+		if len(ratios) > 0:
+			print("{:22s} {:16s} {:8.4f} {:10d}".format(_build_name(commit, dirty), _date(latest), _geomean(ratios), len(ratios)))
+
+# Print the mean wall time of each suite directory over the latest `last` runs,
+# largest first: a build and `rounds` rounds in each of the configurations,
+# and its share of the total. With `csv_path`, also write the mean time of
+# every phase of every suite and configuration to that file.
+def print_durations(history, last=None, rounds=3, configurations=None, csv_path=None):
+	durations = history.phase_durations(last)
+	totals = {}
+	for (phase, configuration, suite), (mean, _) in durations.items():
+		if phase == "toolchain" or (configurations is not None and configuration not in configurations):
+			continue
+		total = totals.setdefault(suite, [0.0, 0.0])
+		total[0 if phase == "build" else 1] += mean
+	overall = sum(build + rounds*round_time for build, round_time in totals.values())
+	print("Mean wall time per run with {} round(s), over all configurations".format(rounds))
+	print("{:40s} {:>10s} {:>10s} {:>10s} {:>7s}".format("suite", "build/s", "round/s", "total/s", "share"))
+	for suite, (build, round_time) in sorted(totals.items(), key=lambda item: item[1][0] + rounds*item[1][1], reverse=True):
+		total = build + rounds*round_time
+		print("{:40s} {:10.1f} {:10.1f} {:10.1f} {:6.1f}%".format(suite, build, round_time, total, 100*total/overall if overall > 0 else 0))
+	toolchains = [mean for (phase, _, _), (mean, _) in durations.items() if phase == "toolchain"]
+	if len(toolchains) > 0:
+		print("Mean toolchain build: {:.1f} s".format(sum(toolchains)/len(toolchains)))
+	if csv_path is not None:
+		with open(csv_path, "w") as file:
+			file.write("Phase, Configuration, Suite, Mean seconds, Count\n")
+			for (phase, configuration, suite), (mean, count) in sorted(durations.items()):
+				file.write("{}, {}, {}, {:.3f}, {}\n".format(phase, configuration, suite, mean, count))
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Query the history of benchmark results recorded by run.py.")
+	parser.add_argument("--db", default="./history.sqlite", help="history database (default: %(default)s)")
+	commands = parser.add_subparsers(dest="command", required=True)
+	series = commands.add_parser("series", help="mean time of a benchmark in each build")
+	series.add_argument("benchmark", help="full benchmark name (directory/benchmark)")
+	series.add_argument("--config", help="comma separated configurations to show (default: all)")
+	movers = commands.add_parser("movers", help="benchmarks that changed most over recent builds")
+	movers.add_argument("--last", type=int, default=5, help="number of builds to look at (default: %(default)s)")
+	movers.add_argument("--config", help="comma separated configurations to look at (default: all)")
+	movers.add_argument("--top", type=int, default=20, help="number of benchmarks to list (default: %(default)s)")
+	overhead = commands.add_parser("overhead", help="geometric mean overhead of a configuration in each build")
+	overhead.add_argument("--config", default="purecap-bounds", help="configuration to measure (default: %(default)s)")
+	overhead.add_argument("--baseline", default="hybrid-bounds", help="configuration to compare against (default: %(default)s)")
+	overhead.add_argument("--last", type=int, default=None, help="number of builds to look at (default: all)")
+	durations = commands.add_parser("durations", help="mean wall time of each suite, to find the ones that dominate a run")
+	durations.add_argument("--last", type=int, default=None, help="number of runs to look at (default: all)")
+	durations.add_argument("--rounds", type=int, default=3, help="rounds per run to count (default: %(default)s)")
+	durations.add_argument("--config", help="comma separated configurations to count (default: all)")
+	durations.add_argument("--csv", help="also write the mean time of every phase to CSV file CSV")
+	args = parser.parse_args()
+
+	history = History(args.db)
+	configurations = None if getattr(args, "config", None) is None or args.command == "overhead" else args.config.split(",")
+	if args.command == "series":
+		print_series(history, args.benchmark, configurations)
+	elif args.command == "movers":
+		print_movers(history, args.last, configurations, args.top)
+	elif args.command == "overhead":
+		print_overhead(history, args.config, args.baseline, args.last)
+	elif args.command == "durations":
+		print_durations(history, args.last, args.rounds, configurations, args.csv)
+	history.close()
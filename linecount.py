@@ -0,0 +1,198 @@
+# Line counts of Rust source code, used by `run.py --line-count`.
+# Files are counted in parallel and their counts cached by modification time
+# and content hash, so counting again after a few files changed is quick.
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+from os import path
+import re
+
+# Tokens that matter for counting lines. Runs of other code are matched in one
+# go, stopping before anything that may start a string, comment or brace.
+_token_regex = re.compile(r"""
+	(?P<newline>\n)
+	|(?P<space>[ \t\r\f\v]+)
+	|(?P<line_comment>//[^\n]*)
+	|(?P<block_comment>/\*)
+	|(?P<raw_string>b?r(?P<hashes>\#*)"[\s\S]*?"(?P=hashes))
+	|(?P<string>b?"(?:[^"\\]|\\[\s\S])*")
+	|(?P<char>b?'(?:[^'\\\n]|\\(?:u\{[0-9A-Fa-f_]*\}|x[0-9A-Fa-f]{2}|.))')
+	|(?P<code>(?:[^\s/"'{};rb]|[rb](?!\#*"|'))(?:[^\n/"'{};rb]|[rb](?!\#*"|'))*)
+	|(?P<open>\{)
+	|(?P<close>\})
+	|(?P<semicolon>;)
+	|(?P<other>.)
+""", re.VERBOSE)
+# Ends and starts of (nested) block comments.
+_comment_regex = re.compile(r"/\*|\*/")
+_unsafe_regex = re.compile(r"\bunsafe\b")
+
+# Count the lines in Rust source `text`.
+# Returns (total lines, code lines, comment lines, unsafe lines), where code
+# lines have any code on them, comment lines only comments, and unsafe lines
+# are code lines in (or starting) an `unsafe` block, function, impl or trait.
+def count_lines(text):
+	(total, code, comment, unsafe) = (0, 0, 0, 0)
+	# What the current line has on it.
+	(has_code, has_comment, is_unsafe) = (False, False, False)
+	depth = 0
+	# Brace depth of the unsafe item the code is in, if any, and whether an
+	# `unsafe` keyword was seen that the next `{` belongs to.
+	unsafe_depth = None
+	pending_unsafe = False
+
+	def end_lines(count):
+		nonlocal total, code, comment, unsafe, has_code, has_comment, is_unsafe
+		total += count
+		if has_code:
+			code += count
+			unsafe += count if is_unsafe else 0
+		elif has_comment:
+			comment += count
+		(has_code, has_comment, is_unsafe) = (False, False, False)
+
+	position = 0
+	while position < len(text):
+		token = _token_regex.match(text, position)
+		kind = token.lastgroup
+		position = token.end()
+		if kind == "newline":
+			end_lines(1)
+		elif kind == "space":
+			pass
+		elif kind == "line_comment":
+			has_comment = True
+		elif kind == "block_comment":
+			nesting = 1
+			start = token.start()
+			while nesting > 0:
+				marker = _comment_regex.search(text, position)
+				if marker is None:
+					position = len(text)
+					break
+				nesting += 1 if marker.group(0) == "/*" else -1
+				position = marker.end()
+			# Lines the comment spans are comment lines, unless they have code.
+			for _ in range(text.count("\n", start, position)):
+				has_comment = True
+				end_lines(1)
+			has_comment = True
+		else:
+			has_code = True
+			if kind == "code" and _unsafe_regex.search(token.group(0)):
+				pending_unsafe = True
+			elif kind == "open":
+				depth += 1
+				if pending_unsafe and unsafe_depth is None:
+					unsafe_depth = depth
+				pending_unsafe = False
+			elif kind == "semicolon":
+				# E.g. an `unsafe fn` declaration without a body.
+				pending_unsafe = False
+			is_unsafe = is_unsafe or pending_unsafe or unsafe_depth is not None
+			if kind == "close":
+				if unsafe_depth == depth:
+					unsafe_depth = None
+				depth = max(0, depth - 1)
+			# Strings spanning several lines are code on every line.
+			for _ in range(token.group(0).count("\n")):
+				end_lines(1)
+				(has_code, is_unsafe) = (True, is_unsafe or unsafe_depth is not None)
+	# Last line without a newline.
+	if len(text) > 0 and not text.endswith("\n"):
+		end_lines(1)
+	return (total, code, comment, unsafe)
+
+# Hash and line counts of the Rust source file `file_path`, as
+# (hash, counts as from `count_lines`). The file isn't counted if its hash is
+# `known_hash`, in which case the counts are `None`.
+def _count_file(file_path, known_hash=None):
+	with open(file_path, "rb") as file:
+		data = file.read()
+	digest = hashlib.sha256(data).hexdigest()
+	if digest == known_hash:
+		return (digest, None)
+	return (digest, count_lines(data.decode("utf-8", errors="replace")))
+
+def _count_file_job(job):
+	return _count_file(*job)
+
+# Rust source files in `directory` and its subdirectories, leaving out build
+# output and hidden directories.
+def rust_files(directory):
+	files = []
+	for root, directories, names in os.walk(directory):
+		directories[:] = sorted(name for name in directories if name != "target" and not name.startswith("."))
+		files += [path.join(root, name) for name in sorted(names) if name.endswith(".rs")]
+	return files
+
+# Root directories of the packages in the dependency tree of the workspace
+# described by `metadata` (the output of `cargo metadata --format-version 1`),
+# including dev and build dependencies, leaving out the workspace's own
+# packages.
+def dependency_directories(metadata):
+	packages = {package["id"]: package for package in metadata["packages"]}
+	nodes = {node["id"]: node for node in (metadata.get("resolve") or {}).get("nodes", [])}
+	members = set(metadata["workspace_members"])
+	seen = set(members)
+	stack = list(members)
+	while len(stack) > 0:
+		node = nodes.get(stack.pop())
+		for dependency in [] if node is None else node["dependencies"]:
+			if dependency not in seen:
+				seen.add(dependency)
+				stack.append(dependency)
+	return sorted(path.dirname(packages[id]["manifest_path"]) for id in seen - members if id in packages)
+
+
+class LineCounter:
+	"""
+	Counts lines of Rust source files in parallel, keeping the counts of each
+	file in a cache.
+
+	cache_path -- JSON file to keep the cache in, mapping each file's path to
+	              its modification time, size, hash and counts
+	jobs -- number of processes counting at once
+	"""
+	def __init__(self, cache_path, jobs):
+		self.cache_path = cache_path
+		self.jobs = jobs
+		self._cache = {}
+		if path.exists(cache_path):
+			with open(cache_path) as file:
+				self._cache = json.load(file)
+
+	# Total counts (as from `count_lines`) over the Rust source files in
+	# `directories`, each file counted once.
+	def count(self, directories):
+		files = list(dict.fromkeys(path.abspath(file) for directory in directories for file in rust_files(directory)))
+		stats = {}
+		stale = []
+		for file in files:
+			stat = os.stat(file)
+			stats[file] = (stat.st_mtime_ns, stat.st_size)
+			cached = self._cache.get(file)
+			if cached is None or (cached[0], cached[1]) != stats[file]:
+				stale.append(file)
+
+		if len(stale) > 0:
+			jobs = [(file, None if file not in self._cache else self._cache[file][2]) for file in stale]
+			if self.jobs > 1 and len(stale) > 1:
+				with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+					counted = list(pool.map(_count_file_job, jobs, chunksize=32))
+			else:
+				counted = [_count_file_job(job) for job in jobs]
+			for file, (digest, counts) in zip(stale, counted):
+				# Unchanged contents keep their counts.
+				counts = self._cache[file][3] if counts is None else list(counts)
+				self._cache[file] = [*stats[file], digest, counts]
+
+		totals = [0, 0, 0, 0]
+		for file in files:
+			totals = [total + count for total, count in zip(totals, self._cache[file][3])]
+		return tuple(totals)
+
+	def save(self):
+		with open(self.cache_path, "w") as file:
+			json.dump(self._cache, file)
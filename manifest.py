@@ -0,0 +1,148 @@
+# Manifest of the benchmark suites and compiler configurations run.py uses,
+# read from a TOML file (suites.toml):
+#
+#   rust_path -- path to the clone of the Rust compiler to build
+#   [[configurations]] -- name, target and optional rust_flags of each
+#                         configuration
+#   [[native_configurations]] -- name and optional rust_flags of each
+#                                configuration used with `--native`
+#   [[working]], [[more]], [[broken]] -- suites, with the arguments of
+#                                        `run.Suite` (directory, and optionally
+#                                        repo, branch, patch, subprojects,
+#                                        extra_bench_flags, harness, timeout,
+#                                        round_timeout and build_timeout)
+#
+# Only `working` suites are run, the others are kept for reference.
+# A manifest is parsed and validated once per version of the file: the parsed
+# form is cached, in memory and optionally on disk, keyed by the file's hash.
+import hashlib
+import json
+import os
+from os import path
+
+# Lists of suites in a manifest.
+suite_lists = ["working", "more", "broken"]
+
+# Fields of each kind of entry, as a map from field name to (type, required).
+_suite_fields = {
+	"directory": (str, True),
+	"repo": (str, False),
+	"branch": (str, False),
+	"patch": (str, False),
+	"subprojects": (list, False),
+	"extra_bench_flags": (list, False),
+	"harness": (str, False),
+	"timeout": ((int, float), False),
+	"round_timeout": ((int, float), False),
+	"build_timeout": ((int, float), False),
+}
+_configuration_fields = {
+	"name": (str, True),
+	"target": (str, True),
+	"rust_flags": (str, False),
+}
+_native_configuration_fields = {
+	"name": (str, True),
+	"rust_flags": (str, False),
+}
+
+# Descriptions of the types of fields, for error messages.
+_type_names = {str: "a string", list: "a list of strings", (int, float): "a number"}
+
+# Parsed manifests, by hash of the file.
+_parsed = {}
+
+
+class ManifestError(Exception):
+	pass
+
+
+class Manifest:
+	"""
+	Validated contents of a manifest file.
+
+	rust_path -- path to the Rust compiler directory
+	configurations, native_configurations -- lists of configuration entries,
+	                                         each a dict of the fields above
+	suites -- map from each of `suite_lists` to its list of suite entries
+	"""
+	def __init__(self, data):
+		self.rust_path = data["rust_path"]
+		self.configurations = data.get("configurations", [])
+		self.native_configurations = data.get("native_configurations", [])
+		self.suites = {name: data.get(name, []) for name in suite_lists}
+
+
+# Check that `data`, a parsed manifest, has the expected fields, raising
+# `ManifestError` naming the first problem found if not.
+def validate(data):
+	if not isinstance(data.get("rust_path"), str):
+		raise ManifestError("rust_path must be a string")
+	unknown = set(data) - {"rust_path", "configurations", "native_configurations"} - set(suite_lists)
+	if unknown:
+		raise ManifestError("unknown key(s) {}".format(", ".join(sorted(unknown))))
+
+	for key, fields, name_field in [("configurations", _configuration_fields, "name"),
+			("native_configurations", _native_configuration_fields, "name"),
+			*[(name, _suite_fields, "directory") for name in suite_lists]]:
+		entries = data.get(key, [])
+		if not isinstance(entries, list):
+			raise ManifestError("{} must be an array of tables".format(key))
+		names = set()
+		for i, entry in enumerate(entries):
+			where = "{}[{}]".format(key, i)
+			if not isinstance(entry, dict):
+				raise ManifestError("{} must be a table".format(where))
+			for field, (kind, required) in fields.items():
+				if field not in entry:
+					if required:
+						raise ManifestError("{} is missing {}".format(where, field))
+				elif not isinstance(entry[field], kind) or isinstance(entry[field], bool) or (kind is list and not all(isinstance(item, str) for item in entry[field])):
+					raise ManifestError("{}.{} must be {}".format(where, field, _type_names[kind]))
+			unknown = set(entry) - set(fields)
+			if unknown:
+				raise ManifestError("{} has unknown field(s) {}".format(where, ", ".join(sorted(unknown))))
+			if entry[name_field] in names:
+				raise ManifestError("{} repeats {} {}".format(where, name_field, entry[name_field]))
+			names.add(entry[name_field])
+
+# Load the manifest in `file_path`, raising `ManifestError` if it is invalid,
+# or `ModuleNotFoundError` if it has to be parsed and there is no TOML parser.
+# With `cache_path`, the parsed manifest is also kept in that file, so later
+# processes only parse the manifest again once it has changed.
+def load(file_path, cache_path=None):
+	with open(file_path, "rb") as file:
+		text = file.read()
+	digest = hashlib.sha256(text).hexdigest()
+	if digest in _parsed:
+		return Manifest(_parsed[digest])
+
+	data = None
+	if cache_path is not None and path.exists(cache_path):
+		try:
+			with open(cache_path) as file:
+				cached = json.load(file)
+			if cached.get("hash") == digest:
+				data = cached["manifest"]
+		except (OSError, ValueError, KeyError):
+			pass
+	if data is None:
+		# Python 3.11 has a TOML parser, earlier versions need tomli.
+		try:
+			import tomllib
+		except ModuleNotFoundError:
+			import tomli as tomllib
+		try:
+			data = tomllib.loads(text.decode("utf-8"))
+		except (UnicodeDecodeError, tomllib.TOMLDecodeError) as e:
+			raise ManifestError("{}: {}".format(file_path, e))
+		try:
+			validate(data)
+		except ManifestError as e:
+			raise ManifestError("{}: {}".format(file_path, e))
+		if cache_path is not None:
+			os.makedirs(path.dirname(cache_path) or ".", exist_ok=True)
+			with open(cache_path, "w") as file:
+				json.dump({"hash": digest, "manifest": data}, file)
+	_parsed[digest] = data
+	return Manifest(data)
@@ -0,0 +1,135 @@
+# Progress of a benchmarking run, with an estimate of when it will finish.
+# Work is counted in phases (see `history.phases`), and the time left is
+# predicted from how long the same work took in earlier runs, scaled by how
+# the work done so far compares with those runs.
+import threading
+import time
+
+
+class Progress:
+	"""
+	Work done and left in a run.
+
+	estimates -- map from (phase, configuration, suite) to (mean seconds,
+	             count) from earlier runs, as from `History.phase_durations`
+	parallel -- map from phase to the number of those run at once
+	overlap -- whether builds run at the same time as rounds
+	"""
+	def __init__(self, estimates, parallel, overlap):
+		self.parallel = parallel
+		self.overlap = overlap
+		self.started = time.time()
+		# Past means by (phase, configuration, suite), with fallbacks to the
+		# same suite in any configuration and to any suite.
+		self._estimates = {}
+		fallbacks = {}
+		for (phase, configuration, suite), (mean, count) in estimates.items():
+			self._estimates[(phase, configuration, suite)] = mean
+			for key in [(phase, None, suite), (phase, None, None)]:
+				total = fallbacks.setdefault(key, [0.0, 0])
+				total[0] += mean*count
+				total[1] += count
+		for key, (total, count) in fallbacks.items():
+			self._estimates[key] = total/count
+		# Durations in this run, by (phase, configuration, suite).
+		self._observed = {}
+		# Number of each phase done and left, and work left as a map from
+		# (phase, configuration, suite) to count.
+		self._done = {}
+		self._pending = {}
+		# Estimated and actual seconds of the work done that had an estimate
+		# from earlier runs.
+		self._predicted = 0.0
+		self._actual = 0.0
+		self._lock = threading.Lock()
+
+	# Add `count` of `phase` of `suite` in `configuration` to the work left.
+	def add(self, phase, configuration, suite, count=1):
+		with self._lock:
+			key = (phase, configuration, suite)
+			self._pending[key] = self._pending.get(key, 0) + count
+
+	# Note that one `phase` of `suite` in `configuration` took `seconds`, or
+	# was skipped (e.g. its build failed) if `None`.
+	def finish(self, phase, configuration, suite, seconds=None):
+		with self._lock:
+			key = (phase, configuration, suite)
+			if self._pending.get(key, 0) > 0:
+				self._pending[key] -= 1
+			self._done[phase] = self._done.get(phase, 0) + 1
+			if seconds is None:
+				return
+			past = self._past_estimate(key)
+			if past is not None:
+				self._predicted += past
+				self._actual += seconds
+			total = self._observed.setdefault(key, [0.0, 0])
+			total[0] += seconds
+			total[1] += 1
+
+	# Skip the work left of `phase` of `suite` in `configuration`, e.g. rounds
+	# of a suite that failed to build.
+	def skip(self, phase, configuration, suite, count=1):
+		for _ in range(count):
+			self.finish(phase, configuration, suite)
+
+	def _past_estimate(self, key):
+		(phase, configuration, suite) = key
+		for candidate in [key, (phase, None, suite), (phase, None, None)]:
+			if candidate in self._estimates:
+				return self._estimates[candidate]
+		return None
+
+	# Estimated seconds of one `phase` of `suite` in `configuration`: as it
+	# took earlier in this run, else as in earlier runs, scaled by how long the
+	# work done took compared with those, else as other work of the phase took
+	# in this run. `None` if there's nothing to go on.
+	def _estimate(self, key):
+		if key in self._observed:
+			(total, count) = self._observed[key]
+			return total/count
+		past = self._past_estimate(key)
+		if past is not None:
+			return past*(self._actual/self._predicted if self._predicted > 0 else 1.0)
+		durations = [total/count for (phase, _, _), (total, count) in self._observed.items() if phase == key[0]]
+		return sum(durations)/len(durations) if len(durations) > 0 else None
+
+	# Estimated seconds until the work left is done, as (seconds, map from phase
+	# to the number left of it that there's nothing to estimate from, which
+	# isn't included in the seconds).
+	def remaining(self):
+		with self._lock:
+			seconds = {}
+			unknown = {}
+			for key, count in self._pending.items():
+				if count == 0:
+					continue
+				estimate = self._estimate(key)
+				if estimate is None:
+					unknown[key[0]] = unknown.get(key[0], 0) + count
+				else:
+					seconds[key[0]] = seconds.get(key[0], 0.0) + count*estimate
+		spans = {phase: total/self.parallel.get(phase, 1) for phase, total in seconds.items()}
+		(build, round) = (spans.get("build", 0.0), spans.get("round", 0.0))
+		return (spans.get("toolchain", 0.0) + (max(build, round) if self.overlap else build + round), unknown)
+
+	# One line describing the work done and left, how fast rounds are going and
+	# when the run should finish.
+	def status(self):
+		with self._lock:
+			left = {}
+			for (phase, _, _), count in self._pending.items():
+				left[phase] = left.get(phase, 0) + count
+			counts = ["{}/{} {}s".format(self._done.get(phase, 0), self._done.get(phase, 0) + left.get(phase, 0), phase)
+				for phase in ["toolchain", "build", "round"] if self._done.get(phase, 0) + left.get(phase, 0) > 0]
+			rate = 60*self._done.get("round", 0)/max(1.0, time.time() - self.started)
+		(remaining, unknown) = self.remaining()
+		eta = "{} left, ETA {}".format(_duration(remaining), time.strftime("%H:%M", time.localtime(time.time() + remaining)))
+		if len(unknown) > 0:
+			eta += " plus {} not run before".format(", ".join("{} {}s".format(count, phase) for phase, count in unknown.items()))
+		return "progress: {} done, {:.1f} rounds/min, {}".format(", ".join(counts), rate, eta)
+
+# `seconds` as h:mm:ss.
+def _duration(seconds):
+	seconds = int(seconds)
+	return "{}:{:02d}:{:02d}".format(seconds//3600, seconds//60 % 60, seconds % 60)
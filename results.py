@@ -0,0 +1,453 @@
+# Columnar storage for benchmark results.
+# Results are kept as parallel arrays with one row per benchmark, configuration
+# and round, and can be saved to and loaded from a `.npz` archive that NumPy
+# can also read directly (`numpy.load`).
+from array import array
+import ast
+import struct
+import sys
+import zipfile
+
+# NumPy is optional, so run.py works without it. When installed, statistics
+# over the columns are computed with it.
+try:
+	import numpy as np
+except ModuleNotFoundError:
+	np = None
+
+
+class Results:
+	"""
+	Benchmark results, one row per (benchmark, configuration, round).
+
+	Benchmark, configuration and device names are stored once in
+	`benchmarks`, `configurations` and `devices`, and rows refer to them by
+	index. `suites` holds the suite (or subproject) directory each benchmark
+	in `benchmarks` belongs to.
+
+	benchmark -- index into `benchmarks` for each row
+	configuration -- index into `configurations` for each row
+	round -- round number for each row, starting from 0
+	time -- median time reported for the round in ns
+	range -- spread reported for the round in ns
+	device -- index into `devices` of the device that ran the round, where
+	          the empty string means the default device
+
+	Harnesses that report every sample they measure (rather than a summary
+	per round) have those stored in a second table, with one row per sample:
+
+	sample_benchmark, sample_configuration, sample_round, sample_device --
+	    as above, for each sample
+	sample_time -- time per iteration of the sample in ns (float)
+
+	Other measurements of a round, such as hardware counters, are stored in a
+	third table, with one row per measurement:
+
+	metric_benchmark, metric_configuration, metric_round -- as above
+	metric -- index into `metrics`, the names of the measurements
+	metric_value -- value of the measurement (float)
+	"""
+	# Integer columns, in the order they are saved.
+	columns = ["benchmark", "configuration", "round", "time", "range", "device"]
+	# Integer columns of the sample table, which also has `sample_time`.
+	sample_columns = ["sample_benchmark", "sample_configuration", "sample_round", "sample_device"]
+	# Integer columns of the metric table, which also has `metric_value`.
+	metric_columns = ["metric_benchmark", "metric_configuration", "metric_round", "metric"]
+
+	def __init__(self):
+		self.benchmarks = []
+		self.suites = []
+		self.configurations = []
+		self.devices = []
+		self.metrics = []
+		for column in Results.columns + Results.sample_columns + Results.metric_columns:
+			setattr(self, column, array("q"))
+		self.sample_time = array("d")
+		self.metric_value = array("d")
+
+		# Private
+		self._benchmark_index = {}
+		self._configuration_index = {}
+		self._device_index = {}
+		self._metric_index = {}
+		# Maps (benchmark, configuration) indices to {round: row number}.
+		self._groups = {}
+		# Maps (benchmark, configuration) indices to {round: (first sample row,
+		# last sample row + 1)}.
+		self._sample_groups = {}
+		# Maps (benchmark, configuration) indices to {round: {metric index: row}}.
+		self._metric_groups = {}
+
+	def __len__(self):
+		return len(self.time)
+
+	def _intern(self, names, index, name):
+		i = index.get(name)
+		if i is None:
+			i = len(names)
+			names.append(name)
+			index[name] = i
+		return i
+
+	# Add one round of a benchmark.
+	# Returns False without storing anything if the round is already present.
+	# `suite` defaults to everything before the last "/" in `benchmark`.
+	def add(self, benchmark, configuration, round, time, time_range, device="", suite=None):
+		b = self._intern_benchmark(benchmark, suite)
+		c = self._intern(self.configurations, self._configuration_index, configuration)
+		d = self._intern(self.devices, self._device_index, device)
+		group = self._groups.setdefault((b, c), {})
+		if round in group:
+			return False
+		group[round] = len(self.time)
+		self.benchmark.append(b)
+		self.configuration.append(c)
+		self.round.append(round)
+		self.time.append(time)
+		self.range.append(time_range)
+		self.device.append(d)
+		return True
+
+	# Add the raw samples of one round of a benchmark, as a list of times per
+	# iteration in ns.
+	# Returns False without storing anything if the round already has samples.
+	def add_samples(self, benchmark, configuration, round, times, device="", suite=None):
+		b = self._intern_benchmark(benchmark, suite)
+		c = self._intern(self.configurations, self._configuration_index, configuration)
+		d = self._intern(self.devices, self._device_index, device)
+		group = self._sample_groups.setdefault((b, c), {})
+		if round in group:
+			return False
+		group[round] = (len(self.sample_time), len(self.sample_time)+len(times))
+		for column, value in zip(Results.sample_columns, (b, c, round, d)):
+			getattr(self, column).extend([value]*len(times))
+		self.sample_time.extend(times)
+		return True
+
+	# Add a measurement `metric` of one round of a benchmark.
+	# Returns False without storing anything if the round already has it.
+	def add_metric(self, benchmark, configuration, round, metric, value, suite=None):
+		b = self._intern_benchmark(benchmark, suite)
+		c = self._intern(self.configurations, self._configuration_index, configuration)
+		m = self._intern(self.metrics, self._metric_index, metric)
+		group = self._metric_groups.setdefault((b, c), {}).setdefault(round, {})
+		if m in group:
+			return False
+		group[m] = len(self.metric_value)
+		for column, index in zip(Results.metric_columns, (b, c, round, m)):
+			getattr(self, column).append(index)
+		self.metric_value.append(value)
+		return True
+
+	def _intern_benchmark(self, benchmark, suite):
+		b = self._intern(self.benchmarks, self._benchmark_index, benchmark)
+		if b == len(self.suites):
+			self.suites.append(benchmark.rsplit("/", 1)[0] if suite is None else suite)
+		return b
+
+	# Add all rows from `other`, e.g. to aggregate several runs.
+	# Rounds already present are kept, unless `replace` is set, in which case
+	# all existing rounds, samples and measurements of every (benchmark,
+	# configuration) pair in `other` are dropped first, along with the
+	# "<suite>/*" entry of its suite that marks a run stopped before its
+	# benchmarks were known (see `run.Suite.bench`). With `by_suite`, every
+	# (suite, configuration) pair in `other` is dropped instead, so that
+	# nothing is left of benchmarks that didn't run again.
+	# Returns the number of rows added.
+	def merge(self, other, replace=False, by_suite=False):
+		if replace:
+			pairs = set(other._groups) | set(other._sample_groups) | set(other._metric_groups)
+			if by_suite:
+				replaced = set((other.suites[b], other.configurations[c]) for b, c in pairs)
+				names = self.suites
+			else:
+				replaced = set((other.benchmarks[b], other.configurations[c]) for b, c in pairs)
+				replaced |= set((other.suites[b] + "/*", other.configurations[c]) for b, c in pairs)
+				names = self.benchmarks
+			kept = Results()
+			# Keep names in their original order.
+			kept.suites = list(self.suites)
+			for name in self.benchmarks:
+				kept._intern(kept.benchmarks, kept._benchmark_index, name)
+			for name in self.configurations:
+				kept._intern(kept.configurations, kept._configuration_index, name)
+			for name in self.devices:
+				kept._intern(kept.devices, kept._device_index, name)
+			for b, c, round, time, time_range, d in zip(*(getattr(self, column) for column in Results.columns)):
+				if (names[b], self.configurations[c]) not in replaced:
+					kept.add(self.benchmarks[b], self.configurations[c], round, time, time_range, self.devices[d], self.suites[b])
+			for (b, c), group in self._sample_groups.items():
+				if (names[b], self.configurations[c]) not in replaced:
+					for round, (start, end) in group.items():
+						kept.add_samples(self.benchmarks[b], self.configurations[c], round, self.sample_time[start:end],
+							self.devices[self.sample_device[start]], self.suites[b])
+			for name in self.metrics:
+				kept._intern(kept.metrics, kept._metric_index, name)
+			for b, c, round, m, value in zip(*(getattr(self, column) for column in Results.metric_columns + ["metric_value"])):
+				if (names[b], self.configurations[c]) not in replaced:
+					kept.add_metric(self.benchmarks[b], self.configurations[c], round, self.metrics[m], value, self.suites[b])
+			self.__dict__.update(kept.__dict__)
+		added = 0
+		for b, c, round, time, time_range, d in zip(*(getattr(other, column) for column in Results.columns)):
+			if self.add(other.benchmarks[b], other.configurations[c], round, time, time_range, other.devices[d], other.suites[b]):
+				added += 1
+		for (b, c), group in other._sample_groups.items():
+			for round, (start, end) in group.items():
+				self.add_samples(other.benchmarks[b], other.configurations[c], round, other.sample_time[start:end],
+					other.devices[other.sample_device[start]], other.suites[b])
+		for b, c, round, m, value in zip(*(getattr(other, column) for column in Results.metric_columns + ["metric_value"])):
+			self.add_metric(other.benchmarks[b], other.configurations[c], round, other.metrics[m], value, other.suites[b])
+		return added
+
+	# Rounds recorded for `benchmark` in `configuration` as {round: (time, range)}.
+	def rounds(self, benchmark, configuration):
+		group = self._groups.get((self._benchmark_index.get(benchmark), self._configuration_index.get(configuration)), {})
+		return {round: (self.time[row], self.range[row]) for round, row in group.items()}
+
+	# Measurements recorded for `benchmark` in `configuration` as
+	# {round: {metric: value}}.
+	def metric_values(self, benchmark, configuration):
+		group = self._metric_groups.get((self._benchmark_index.get(benchmark), self._configuration_index.get(configuration)), {})
+		return {round: {self.metrics[m]: self.metric_value[row] for m, row in rows.items()} for round, rows in group.items()}
+
+	# One round of every benchmark from `suite` in `configuration`, as a list of
+	# (benchmark, time, range, device).
+	def suite_round(self, suite, configuration, round):
+		c = self._configuration_index.get(configuration)
+		rows = []
+		for b, benchmark in enumerate(self.benchmarks):
+			row = self._groups.get((b, c), {}).get(round) if self.suites[b] == suite else None
+			if row is not None:
+				rows.append((benchmark, self.time[row], self.range[row], self.devices[self.device[row]]))
+		return rows
+
+	# Raw samples recorded for `benchmark` in `configuration` as {round: times}.
+	def samples(self, benchmark, configuration):
+		group = self._sample_groups.get((self._benchmark_index.get(benchmark), self._configuration_index.get(configuration)), {})
+		return {round: list(self.sample_time[start:end]) for round, (start, end) in group.items()}
+
+	# Rows grouped by (benchmark, configuration) with NumPy, as arrays of each
+	# group's key (benchmark index * number of configurations + configuration
+	# index), number of rows, sum of times, lowest time-range and highest
+	# time+range, and an array of the group of each row.
+	def _numpy_groups(self):
+		(b, c, time, time_range) = (np.frombuffer(getattr(self, column), dtype=np.int64) for column in ["benchmark", "configuration", "time", "range"])
+		keys = b*len(self.configurations) + c
+		order = np.argsort(keys, kind="stable")
+		sorted_keys = keys[order]
+		starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+		counts = np.diff(np.r_[starts, len(keys)])
+		groups = np.empty(len(keys), dtype=np.intp)
+		groups[order] = np.repeat(np.arange(len(starts)), counts)
+		return (sorted_keys[starts], counts, np.add.reduceat(time[order], starts),
+			np.minimum.reduceat((time-time_range)[order], starts), np.maximum.reduceat((time+time_range)[order], starts), groups)
+
+	# Statistics for every (benchmark, configuration) pair, computed in a single
+	# pass over the columns.
+	# Returns a map from (benchmark index, configuration index) to
+	# (number of rounds, mean time, lowest time-range, highest time+range).
+	def summary(self):
+		if np is not None and len(self.time) > 0:
+			(keys, counts, sums, lows, highs, _) = self._numpy_groups()
+			width = len(self.configurations)
+			return {(key//width, key % width): (n, total/n, low, high)
+				for key, n, total, low, high in zip(keys.tolist(), counts.tolist(), sums.tolist(), lows.tolist(), highs.tolist())}
+		groups = {}
+		for b, c, time, time_range in zip(self.benchmark, self.configuration, self.time, self.range):
+			group = groups.get((b, c))
+			if group is None:
+				groups[(b, c)] = [1, time, time-time_range, time+time_range]
+			else:
+				group[0] += 1
+				group[1] += time
+				if time-time_range < group[2]: group[2] = time-time_range
+				if time+time_range > group[3]: group[3] = time+time_range
+		return {key: (n, total/n, low, high) for key, (n, total, low, high) in groups.items()}
+
+	# Highest number of rounds recorded for any benchmark and configuration.
+	def max_rounds(self):
+		return max([0] + [len(group) for group in self._groups.values()])
+
+	# Mean ratio of each device's times to the mean time of the same benchmark
+	# and configuration over all devices, to check for bias between devices.
+	# Returns a map from device name to (mean ratio, number of rounds).
+	def device_bias(self):
+		if np is not None and len(self.time) > 0:
+			(_, counts, sums, _, _, groups) = self._numpy_groups()
+			means = (sums/counts)[groups]
+			valid = means != 0
+			devices = np.frombuffer(self.device, dtype=np.int64)[valid]
+			ratios = np.frombuffer(self.time, dtype=np.int64)[valid]/means[valid]
+			totals = np.bincount(devices, weights=ratios, minlength=len(self.devices))
+			rows = np.bincount(devices, minlength=len(self.devices))
+			return {self.devices[d]: (totals[d]/rows[d], int(rows[d])) for d in range(len(self.devices)) if rows[d] > 0}
+		summary = self.summary()
+		totals = {}
+		for b, c, time, d in zip(self.benchmark, self.configuration, self.time, self.device):
+			mean = summary[(b, c)][1]
+			if mean == 0:
+				continue
+			total = totals.setdefault(d, [0.0, 0])
+			total[0] += time/mean
+			total[1] += 1
+		return {self.devices[d]: (ratio/n, n) for d, (ratio, n) in totals.items()}
+
+	def save(self, file_path):
+		with zipfile.ZipFile(file_path, "w") as archive:
+			_write_npy(archive, "benchmarks", _string_descr(self.benchmarks), len(self.benchmarks), _string_bytes(self.benchmarks))
+			_write_npy(archive, "suites", _string_descr(self.suites), len(self.suites), _string_bytes(self.suites))
+			_write_npy(archive, "configurations", _string_descr(self.configurations), len(self.configurations), _string_bytes(self.configurations))
+			_write_npy(archive, "devices", _string_descr(self.devices), len(self.devices), _string_bytes(self.devices))
+			for column in Results.columns:
+				_write_npy(archive, column, "<i8", len(self), _int_bytes(getattr(self, column)))
+			for column in Results.sample_columns:
+				_write_npy(archive, column, "<i8", len(self.sample_time), _int_bytes(getattr(self, column)))
+			_write_npy(archive, "sample_time", "<f8", len(self.sample_time), _float_bytes(self.sample_time))
+			_write_npy(archive, "metrics", _string_descr(self.metrics), len(self.metrics), _string_bytes(self.metrics))
+			for column in Results.metric_columns:
+				_write_npy(archive, column, "<i8", len(self.metric_value), _int_bytes(getattr(self, column)))
+			_write_npy(archive, "metric_value", "<f8", len(self.metric_value), _float_bytes(self.metric_value))
+
+	@classmethod
+	def load(cls, file_path):
+		results = cls()
+		with zipfile.ZipFile(file_path) as archive:
+			names = archive.namelist()
+			benchmarks = _read_npy(archive.read("benchmarks.npy"))
+			suites = _read_npy(archive.read("suites.npy")) if "suites.npy" in names else [None]*len(benchmarks)
+			configurations = _read_npy(archive.read("configurations.npy"))
+			# Results saved before devices were recorded all ran on the default device.
+			devices = _read_npy(archive.read("devices.npy")) if "devices.npy" in names else [""]
+			columns = [_read_npy(archive.read(column + ".npy")) for column in Results.columns if column + ".npy" in names]
+			# Results saved before samples were recorded have none.
+			sample_columns = [_read_npy(archive.read(column + ".npy")) for column in Results.sample_columns + ["sample_time"]
+				if column + ".npy" in names]
+			# Likewise for metrics.
+			metrics = _read_npy(archive.read("metrics.npy")) if "metrics.npy" in names else []
+			metric_columns = [_read_npy(archive.read(column + ".npy")) for column in Results.metric_columns + ["metric_value"]
+				if column + ".npy" in names]
+		if len(columns) < len(Results.columns):
+			columns.append([0]*len(columns[0]))
+		for b, c, round, time, time_range, d in zip(*columns):
+			results.add(benchmarks[b], configurations[c], round, time, time_range, devices[d], suites[b])
+		# Samples are stored in runs of rows from the same round.
+		start = 0
+		for end in range(1, len(sample_columns[0]) + 1 if sample_columns else 0):
+			if end == len(sample_columns[0]) or any(column[end] != column[start] for column in sample_columns[:4]):
+				(b, c, round, d) = (column[start] for column in sample_columns[:4])
+				results.add_samples(benchmarks[b], configurations[c], round, sample_columns[4][start:end], devices[d], suites[b])
+				start = end
+		for b, c, round, m, value in zip(*metric_columns):
+			results.add_metric(benchmarks[b], configurations[c], round, metrics[m], value, suites[b])
+		return results
+
+	# Write every round and the mean and error range of each configuration to a
+	# CSV file, with configurations in the order of `configuration_names`.
+	def write_csv(self, file_path, configuration_names, rounds):
+		assert(rounds > 0)
+		summary = self.summary()
+		with open(file_path, "w") as file:
+			# Write headers.
+			top_line = "benchmark"
+			bottom_line = " "
+			for name in configuration_names:
+				top_line += ", {}, ".format(name) + ", , "*(rounds-1) + ", , , "
+				bottom_line += ", time/ns, +-/ns"*rounds + ", mean/ns, -/ns, +/ns"
+			file.write(top_line+"\n"+bottom_line+"\n")
+
+			# Write data, marking rounds and configurations that crashed, and
+			# rounds that were stopped for taking too long (see `run.Suite.bench`).
+			for b, benchmark in enumerate(self.benchmarks):
+				file.write(benchmark)
+				for name in configuration_names:
+					mode_data = self.rounds(benchmark, name)
+					metrics = self.metric_values(benchmark, name)
+					for round in range(rounds):
+						missing = ("timeout", "-") if metrics.get(round, {}).get("timeout") else ("-", "-")
+						file.write(", {}, {}".format(*mode_data.get(round, missing)))
+					stats = summary.get((b, self._configuration_index.get(name)))
+					if stats:
+						(_, mean, low, high) = stats
+						file.write(", {}, {}, {}".format(mean, mean-low, high-mean))
+					else:
+						file.write(", -, -, -")
+				file.write("\n")
+
+	# Write every measurement to a CSV file, one line per benchmark,
+	# configuration and round, with a column for each metric.
+	def write_metrics_csv(self, file_path, configuration_names):
+		with open(file_path, "w") as file:
+			file.write(", ".join(["benchmark", "configuration", "round"] + self.metrics) + "\n")
+			for benchmark in self.benchmarks:
+				for name in configuration_names:
+					for round, values in sorted(self.metric_values(benchmark, name).items()):
+						file.write(", ".join([benchmark, name, str(round)] + [str(values.get(metric, "-")) for metric in self.metrics]) + "\n")
+
+
+# Two-sided 95% critical values of Student's t distribution by degrees of freedom.
+_t_95 = [None, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+	2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+	2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+# Mean of `times` and the half-width of its 95% confidence interval.
+# Needs at least two times.
+def confidence_interval(times):
+	n = len(times)
+	assert(n >= 2)
+	mean = sum(times)/n
+	variance = sum((time-mean)**2 for time in times)/(n-1)
+	t = _t_95[n-1] if n-1 < len(_t_95) else 1.960
+	return (mean, t*(variance/n)**0.5)
+
+def _int_bytes(column):
+	if sys.byteorder == "big":
+		column = array("q", column)
+		column.byteswap()
+	return column.tobytes()
+
+def _float_bytes(column):
+	if sys.byteorder == "big":
+		column = array("d", column)
+		column.byteswap()
+	return column.tobytes()
+
+def _string_descr(strings):
+	return "<U{}".format(max([1] + [len(s) for s in strings]))
+
+def _string_bytes(strings):
+	width = int(_string_descr(strings)[2:])
+	return b"".join(s.ljust(width, "\0").encode("utf-32-le") for s in strings)
+
+# Write a one-dimensional array to `archive` in NumPy's `.npy` format.
+def _write_npy(archive, name, descr, length, data):
+	header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({},), }}".format(descr, length)
+	# Pad the header so the data is 64 byte aligned, as NumPy does.
+	header += " "*(-(10+len(header)+1) % 64) + "\n"
+	archive.writestr(name + ".npy", b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1") + data)
+
+# Read a one-dimensional array of 64-bit integers, 64-bit floats or strings in
+# `.npy` format.
+def _read_npy(data):
+	if data[:6] != b"\x93NUMPY":
+		raise ValueError("not a .npy file")
+	if data[6] == 1:
+		(header_length,) = struct.unpack("<H", data[8:10])
+		start = 10
+	else:
+		(header_length,) = struct.unpack("<I", data[8:12])
+		start = 12
+	header = ast.literal_eval(data[start:start+header_length].decode("latin1"))
+	body = data[start+header_length:]
+	descr = header["descr"]
+	if len(header["shape"]) != 1 or header["fortran_order"]:
+		raise ValueError("unsupported array shape")
+	if descr in ("<i8", "<f8"):
+		column = array("q" if descr == "<i8" else "d")
+		column.frombytes(body)
+		if sys.byteorder == "big":
+			column.byteswap()
+		return column
+	elif descr.startswith("<U"):
+		width = int(descr[2:])*4
+		return [body[i:i+width].decode("utf-32-le").rstrip("\0") for i in range(0, len(body), width)]
+	raise ValueError("unsupported array type {}".format(descr))
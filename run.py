@@ -1,12 +1,31 @@
 #!/usr/bin/python3
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from enum import Enum
 import os
 from os import path
-import pickle
+import functools
+import glob
+import queue
+import random
+import hashlib
+import json
 import platform
 import re
+import shlex
+import shutil
+import signal
 import subprocess
 import sys
+import threading
+import time
+
+from history import History
+from progress import Progress
+from results import Results, confidence_interval
+import linecount
+import manifest
+import sizes
+import triage
 
 # Maps platform names to compiler targets.
 # Targets not in this list may work, we just haven't needed to add them yet.
@@ -23,81 +42,520 @@ class RunMode(Enum):
 	BENCH = 1
 	BUILD = 2
 	TEST = 3
-
-run_mode = RunMode.BENCH
-
-if "--build-only" in sys.argv:
-	run_mode = RunMode.BUILD
-if "--test-only" in sys.argv:
-	run_mode = RunMode.TEST
-
-skip_install = ("--skip-install" in sys.argv)
-clone_only = ("--clone-only" in sys.argv)
-do_plot = ("--plot" in sys.argv)
-
-if "--help" in sys.argv:
-	print("./run.py [OPTIONS]")
-	print("  --build-only       Only build projects, do not run benchmarks")
-	print("  --clone-only       Only clone projects, do not build or run benchmarks")
-	print("  --clean            Clean all cloned git repos")
-	print("  --plot             Build PGF plot")
-	print("  --skip-install     Skip reinstalling Rust")
-	print("  --test-only        Only build projects, do not run benchmarks")
-	print("  --line-count       Count lines of code and write to CSV file")
-	exit(0)
-
-def print_result(result):
+	SIZE = 4
+	TRIAGE = 5
+
+# Returns the value given after `name` on the command line, or `default`.
+def get_option(name, default=None):
+	if name not in sys.argv:
+		return default
+	index = sys.argv.index(name)
+	if index+1 >= len(sys.argv):
+		print("ERROR: {} expects a value".format(name))
+		exit(1)
+	return sys.argv[index+1]
+
+# Options used by `Suite` and `Configuration`, for when this file is imported
+# rather than run. Running it sets them, and the other options, from the
+# command line with `parse_options`.
+force_install = False
+counters_command = None
+# Seconds a benchmark run may go without output, a round of a suite directory
+# may take, and building a suite directory may take before it's stopped, or
+# `None` for no limit. Suites can set their own, see `Suite`.
+bench_timeout = None
+round_timeout = None
+build_timeout = None
+
+# Number of times to check again whether bad machine conditions have improved
+# with `--conditions wait`, and seconds to wait before each check.
+condition_retries = 6
+condition_wait = 10
+
+# Set options from the command line, printing help and exiting if asked to or
+# if an option is invalid.
+def parse_options():
+	global run_mode, force_install, clone_only, do_plot, resume, jobs, devices, suite_regex, bench_regex, config_names, shard, \
+		selective, counters, counters_command, native, native_target, pin_cpus, native_runner, order, order_random, \
+		condition_policy, max_load, max_temperature, build_jobs, benchmark_rounds, adaptive, max_rounds, target_error, manifest_path, \
+		suite_list, bench_timeout, round_timeout, build_timeout
+	run_mode = RunMode.BENCH
+
+	if "--build-only" in sys.argv:
+		run_mode = RunMode.BUILD
+	if "--test-only" in sys.argv:
+		run_mode = RunMode.TEST
+	if "--size-report" in sys.argv:
+		run_mode = RunMode.SIZE
+	if "--triage" in sys.argv:
+		run_mode = RunMode.TRIAGE
+
+	force_install = ("--force-install" in sys.argv)
+	clone_only = ("--clone-only" in sys.argv)
+	do_plot = ("--plot" in sys.argv)
+	resume = ("--resume" in sys.argv)
+	manifest_path = get_option("--manifest", manifest_path)
+	# List of suites in the manifest to run, see `manifest.suite_lists`.
+	suite_list = get_option("--suite-list", "broken" if run_mode is RunMode.TRIAGE else "working")
+	if suite_list not in manifest.suite_lists:
+		print("ERROR: --suite-list expects one of {}".format(", ".join(manifest.suite_lists)))
+		exit(1)
+	# Timeouts, see `bench_timeout`. With `--triage`, each benchmark runs on its
+	# own, so `bench_timeout` is how long each may run, and as suites being
+	# triaged may well hang it's 600 s unless given.
+	bench_timeout = get_option("--timeout", 600 if run_mode is RunMode.TRIAGE else None)
+	bench_timeout = None if bench_timeout is None else float(bench_timeout)
+	round_timeout = get_option("--round-timeout")
+	round_timeout = None if round_timeout is None else float(round_timeout)
+	build_timeout = get_option("--build-timeout")
+	build_timeout = None if build_timeout is None else float(build_timeout)
+
+	# Number of git operations to run at once when cloning.
+	jobs = int(get_option("--jobs", os.cpu_count() or 1))
+	if jobs < 1:
+		print("ERROR: --jobs must be at least 1")
+		exit(1)
+	# Addresses of remote test servers to spread benchmarks over, passed to the
+	# test client as TEST_DEVICE_ADDR. `None` uses the client's default address.
+	devices = get_option("--devices")
+	devices = [None] if devices is None else devices.split(",")
+	# Selection of what to run, to rerun part of the benchmarks.
+	# Results of a selective run are merged into the existing results.
+	suite_regex = get_option("--suite")
+	bench_regex = get_option("--bench")
+	suite_regex = None if suite_regex is None else re.compile(suite_regex)
+	bench_regex = None if bench_regex is None else re.compile(bench_regex)
+	config_names = get_option("--config")
+	config_names = None if config_names is None else config_names.split(",")
+	shard = get_option("--shard")
+	if shard is not None:
+		match = re.fullmatch(r"([0-9]+)/([0-9]+)", shard)
+		if match is None or not (1 <= int(match.group(1)) <= int(match.group(2))):
+			print("ERROR: --shard expects I/N with 1 <= I <= N")
+			exit(1)
+		shard = (int(match.group(1)), int(match.group(2)))
+	selective = any(option is not None for option in [suite_regex, bench_regex, config_names, shard])
+	# Collect hardware counters and sizes for each benchmark, see counters.py.
+	# Each benchmark is run on its own so counters can be told apart.
+	counters = ("--counters" in sys.argv)
+	# Collector command for counters.py instead of perf. It runs on the build
+	# machine, wrapping the remote test client for remote configurations.
+	counters_command = get_option("--counters-command")
+	# Run the native configurations on this machine instead of the Morello ones.
+	native = ("--native" in sys.argv)
+	# Target triple for the native configurations, the host's by default.
+	native_target = get_option("--native-target")
+	# CPUs to pin native benchmarks to with taskset, e.g. "3" or "2,3", or "auto"
+	# for the CPUs isolated from the scheduler (`isolcpus`), or else the last CPU.
+	pin_cpus = get_option("--pin")
+	if pin_cpus == "auto":
+		try:
+			with open("/sys/devices/system/cpu/isolated") as file:
+				pin_cpus = file.read().strip()
+		except OSError:
+			pin_cpus = ""
+		if pin_cpus == "":
+			pin_cpus = str((os.cpu_count() or 1) - 1)
+	# Command to run native benchmarks with, e.g. an emulator for another target.
+	native_runner = get_option("--runner")
+	native_runner = [] if native_runner is None else shlex.split(native_runner)
+	if pin_cpus is not None:
+		native_runner = ["taskset", "-c", pin_cpus] + native_runner
+	# Order to run benchmark rounds in:
+	# sequential -- each configuration in turn, building them as they come
+	# interleaved -- each round of a directory in every configuration in turn
+	# random -- shuffled, using `--seed`
+	# Other than sequential, every configuration is built before running any.
+	order = get_option("--order", "sequential")
+	if order not in ("sequential", "interleaved", "random"):
+		print("ERROR: --order expects sequential, interleaved or random")
+		exit(1)
+	order_random = random.Random(int(get_option("--seed", 0)))
+	# What to do when the machine is busy, hot or not at full speed before running
+	# benchmarks on it (only checked for benchmarks running on this machine):
+	# flag -- run anyway, recording the conditions with the results
+	# wait -- wait up to `condition_retries` times for conditions to improve first
+	condition_policy = get_option("--conditions", "flag")
+	if condition_policy not in ("flag", "wait"):
+		print("ERROR: --conditions expects flag or wait")
+		exit(1)
+	# Highest one minute load average and temperature (Celsius) before running
+	# benchmarks on this machine counts as bad conditions.
+	max_load = float(get_option("--max-load", 1.0))
+	max_temperature = float(get_option("--max-temp", 80.0))
+	# Number of suites to build ahead of the one being benchmarked.
+	# Each Cargo build is itself parallel, so this is kept small by default.
+	build_jobs = int(get_option("--build-jobs", 2))
+	if build_jobs < 1:
+		print("ERROR: --build-jobs must be at least 1")
+		exit(1)
+
+	# Number of times to run each benchmark (averages are calculated).
+	benchmark_rounds = int(get_option("--rounds", 3))
+	# With `--adaptive`, `benchmark_rounds` is a minimum. After that, benchmarks are
+	# rerun (using Cargo's bench filter to run only those benchmarks) until the
+	# 95% confidence interval of their mean is within `target_error` of it, up to
+	# `max_rounds` rounds.
+	adaptive = ("--adaptive" in sys.argv)
+	max_rounds = int(get_option("--max-rounds", 10))
+	target_error = float(get_option("--target-error", 0.01))
+	if benchmark_rounds < 1 or (adaptive and benchmark_rounds < 2):
+		print("ERROR: need at least 1 round, or 2 with --adaptive")
+		exit(1)
+
+	if "--help" in sys.argv:
+		print("./run.py [OPTIONS]")
+		print("  --adaptive         Rerun benchmarks until their 95% confidence interval is within --target-error")
+		print("  --bench REGEX      Only run benchmarks whose full name (directory/benchmark) matches REGEX")
+		print("  --build-jobs N     Build N projects ahead of the one being benchmarked (default: 2)")
+		print("  --build-only       Only build projects, do not run benchmarks")
+		print("  --build-timeout S  Stop building a project after S seconds (default: no limit)")
+		print("  --clean            Clean all cloned git repos (mirrors in ./mirrors are kept)")
+		print("  --clone-only       Only clone projects, do not build or run benchmarks")
+		print("  --conditions C     Before --native benchmarks, flag (default) or wait out bad conditions (load, heat, governor)")
+		print("  --config A,B,...   Only run the named configurations")
+		print("  --counters         Record hardware counters, binary size and (locally, with GNU time) max RSS of each benchmark, run one at a time")
+		print("  --counters-command CMD  Collect counters with CMD instead of perf (see counters.py)")
+		print("  --devices A,B,...  Run benchmarks on several remote test servers (host:port)")
+		print("  --force-install    Rebuild and reinstall Rust even if an identical build exists")
+		print("  --jobs N           Clone N projects at once (default: number of CPUs)")
+		print("  --line-count       Count lines of code and write to CSV file")
+		print("  --line-count-deps  Also count lines of code of the dependencies of each suite with --line-count")
+		print("  --manifest FILE    Read suites and configurations from FILE (default: suites.toml)")
+		print("  --max-load L       One minute load average counted as bad conditions (default: 1.0)")
+		print("  --max-rounds N     Most rounds to run a benchmark with --adaptive (default: 10)")
+		print("  --max-temp T       Temperature in Celsius counted as bad conditions (default: 80)")
+		print("  --native           Run the native configurations on this machine instead of the Morello ones")
+		print("  --native-target T  Target triple for --native (default: this machine's)")
+		print("  --order ORDER      Run rounds sequential (default), interleaved across configurations, or in random order")
+		print("  --pin CPUS         Pin --native benchmarks to CPUS with taskset, e.g. 3 or 2,3, or auto for isolated CPUs")
+		print("  --plot             Write bootstrap analysis and plot data (needs NumPy)")
+		print("  --resume           Skip benchmark rounds already recorded in the results journal")
+		print("  --round-timeout S  Stop a round of a project's benchmarks after S seconds (default: no limit)")
+		print("  --rounds N         Number of rounds to run each suite, or minimum with --adaptive (default: 3)")
+		print("  --runner CMD       Run --native benchmarks with CMD, e.g. an emulator for --native-target")
+		print("  --seed N           Random seed for --order random (default: 0)")
+		print("  --shard I/N        Only run the I-th of N equal shares of the suite directories")
+		print("  --size-report      Build benchmarks and tests, and report their code and data sizes against the baseline")
+		print("  --suite REGEX      Only run suite (or subproject) directories matching REGEX")
+		print("  --suite-list L     Take suites from list L of the manifest: working, more or broken (default: working, or broken with --triage)")
+		print("  --target-error E   Relative confidence interval half-width to aim for with --adaptive (default: 0.01)")
+		print("  --test-only        Only build projects, do not run benchmarks")
+		print("  --timeout S        Stop benchmarks after S seconds without output, or S seconds each with --triage (default: no limit, 600 with --triage)")
+		print("  --triage           Run each benchmark on its own and report why suites fail, in ./tmp/triage.json")
+		print("Results of runs using --bench, --config, --shard or --suite are merged into the existing results.")
+		exit(0)
+
+def result_text(result):
 	if result.returncode == 0:
-		print(f"{TTY_GREEN}OK{TTY_RESET}")
+		return f"{TTY_GREEN}OK{TTY_RESET}"
+	elif result.returncode is None:
+		return f"{TTY_RED}TIMEOUT{TTY_RESET}"
 	else:
-		print(f"{TTY_RED}FAIL{TTY_RESET}")
+		return f"{TTY_RED}FAIL{TTY_RESET}"
+
+# Print the result of a command, exiting if it failed.
+# A command that timed out (see `run_cmd`) has already been stopped, so the
+# next one can go ahead.
+def print_result(result):
+	print(result_text(result))
+	if result.returncode is not None and result.returncode != 0:
 		exit(result.returncode)
 
-target = SUPPORTED_PLATFORMS.get((platform.system(), platform.machine()))
-if target is None:
-	print("ERROR: unknown OS or hardware, please add target triple information for this host")
-	exit(1)
+# Compiler target of this machine, or `None` if it isn't in `SUPPORTED_PLATFORMS`.
+def host_target():
+	return SUPPORTED_PLATFORMS.get((platform.system(), platform.machine()))
 
-# Path to the root of the Rust compiler directory.
-# This should contain a clone of the compiler to use.
-rust_path = "PLACEHOLDER: replace with real path"
 # Directory containing benchmarks, assumed to be current working directory.
 benchmark_path = os.getcwd()
+# Manifest of suites and configurations, see manifest.py.
+manifest_path = path.join(benchmark_path, "suites.toml")
 # Directory containing patches, must be an absolute path.
 patch_path = path.join(benchmark_path, "patches")
-# Path to Rust compiler.
-rustc = path.join(rust_path, "build/install-stage2-latest/bin/rustc")
-# Path to Cargo.
-cargo = path.join(rust_path, "build/install-stage2-latest/bin/cargo")
-# Path to remote test client, note that this is called via the runner.sh wrapper.
-# See comments in the wrapper for explanation.
-test_client = path.join(rust_path, f"build/{target}/stage0-bootstrap-tools/{target}/release/remote-test-client")
+# Directory holding a bare mirror of each suite repository.
+# Suites are checked out from here, so `--clean` followed by a rerun only
+# needs a local checkout. A populated mirror directory also works offline.
+mirror_path = path.join(benchmark_path, "mirrors")
+# Directory holding Cargo build output for every configuration and suite.
+# Each configuration gets its own subdirectory, keyed by a fingerprint of the
+# target, flags and compiler, so switching between them reuses earlier builds.
+target_cache_path = path.join(benchmark_path, "target-cache")
 # Path to runner script.
 runner = path.join(benchmark_path, "runner.sh")
+
+# The manifest in `manifest_path`, loaded when first needed.
+# Raises `OSError` or `manifest.ManifestError` if it can't be loaded, or
+# `ModuleNotFoundError` if it needs parsing without a TOML parser.
+@functools.lru_cache(maxsize=None)
+def load_manifest():
+	return manifest.load(manifest_path, path.join(target_cache_path, "manifest.json"))
+
+# Path to the root of the Rust compiler directory, given in the manifest.
+# This should contain a clone of the compiler to use.
+def rust_path():
+	return load_manifest().rust_path
+
+# Path Rust's build system installs the compiler and tools to.
+def install_path():
+	return path.join(rust_path(), "build/install-stage2-latest")
+
+# Directory holding installed toolchains, one per distinct set of compiler
+# sources and flags. Each is moved here from `install_path` after installing.
+def toolchain_path():
+	return path.join(rust_path(), "build/toolchains")
+
+# Path to remote test client, note that this is called via the runner.sh wrapper.
+# See comments in the wrapper for explanation.
+def test_client():
+	target = host_target()
+	return path.join(rust_path(), f"build/{target}/stage0-bootstrap-tools/{target}/release/remote-test-client")
+
 # Linker to use for Morello hybrid mode.
-aarch64_linker = path.join(rust_path, "clang-freebsd.sh")
+def aarch64_linker():
+	return path.join(rust_path(), "clang-freebsd.sh")
+
 # Linker to use for Morello purecap mode.
-purecap_linker = path.join(rust_path, "clang-morello.sh")
-# Regex to find benchmark result lines in Cargo output.
-data_regex = re.compile(r"\ntest ([^ ]+) +\.\.\. bench: +([0-9,]+) ns/iter \(\+/- ([0-9,]+)\)")
-# Path to cargo count binary.
-# Cargo count is available from: https://github.com/kbknapp/cargo-count 
-# This is a bit of dirty hack thrown together in a hurry so sorry it's a mess.
-count_path = "/Users/simon/github/cargo-count/target/debug/cargo-count"
-# Regex to find line count numbers in output.
-count_regex = re.compile(r"\nTotals:[ \t]+([0-9]+)[ \t]+([0-9]+)[ \t]+([0-9]+)[ \t]+([0-9]+)[ \t]+([0-9]+)[ \t]+([0-9]+)[ \t]+\(.+%\)")
-
-
-def run_cmd(cmd, cwd=benchmark_path, env=os.environ.copy()):
-	result = subprocess.run(cmd, cwd=cwd, env=env, encoding="utf-8", stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-	if result.returncode != 0:
+def purecap_linker():
+	return path.join(rust_path(), "clang-morello.sh")
+
+# Regex to match a benchmark result line in Cargo output.
+data_regex = re.compile(r"^test ([^ ]+) +\.\.\. bench: +([0-9,]+) ns/iter \(\+/- ([0-9,]+)\)")
+# Regex to match a benchmark in the output of a benchmark harness's `--list`:
+# libtest lists "name: benchmark", Criterion "name: bench".
+list_regex = re.compile(r"^(.+): bench(?:mark)?$")
+# Regex to match a result line in the output of Criterion's bencher format,
+# where benchmark names may contain spaces.
+criterion_data_regex = re.compile(r"^test (.+?) +\.\.\. bench: +([0-9,]+) ns/iter \(\+/- ([0-9,]+)\)")
+# Regex to match the line counters.py prints after each benchmark binary.
+counters_regex = re.compile(r"^counters: (\{.*\})$")
+# Regex to match test client output when the remote test server can't be reached.
+refused_regex = re.compile(r"[Cc]onnection refused")
+# Regex to match lines of Cargo output that suggest a benchmark has failed.
+problem_regex = re.compile(r"^error[:\[]|panicked at|failed with|signal: |SIGPROT")
+# Cache of line counts of each Rust source file for `--line-count`.
+line_count_cache_path = path.join(benchmark_path, "line_count_cache.json")
+
+
+# Run `cmd`, returning its exit status and output (stdout and stderr together).
+# With `timeout` (seconds), `cmd` and any processes it started are stopped if it
+# runs for longer, and the exit status is `None`.
+def run_cmd(cmd, cwd=benchmark_path, env=os.environ.copy(), quiet=False, timeout=None):
+	if timeout is None:
+		result = subprocess.run(cmd, cwd=cwd, env=env, encoding="utf-8", stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+	else:
+		# In its own process group, so that the processes it starts, e.g. the
+		# benchmark under Cargo, can be stopped along with it.
+		with subprocess.Popen(cmd, cwd=cwd, env=env, encoding="utf-8", errors="replace", stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+				start_new_session=True) as process:
+			timed_out = False
+			try:
+				(output, _) = process.communicate(timeout=timeout)
+			except subprocess.TimeoutExpired:
+				timed_out = True
+				kill_process_group(process)
+				(output, _) = process.communicate()
+			except BaseException:
+				kill_process_group(process)
+				raise
+		result = subprocess.CompletedProcess(cmd, None if timed_out else process.returncode, output)
+	if result.returncode is None and not quiet:
+		print("WARN: `{}' in `{}' timed out after {} s".format(" ".join(cmd), cwd, timeout))
+	elif result.returncode != 0 and not quiet:
 		print("WARN: failed to run `{}' in `{}'".format(" ".join(cmd), cwd))
 		print(result.stdout)
 	return result
 
+# Seconds a process is given to exit after SIGTERM before it's killed.
+kill_grace = 5
+
+# Stop `process`, started in a new session, and every process in its group:
+# first with SIGTERM, so they can clean up (e.g. the test client closing its
+# connection), then with SIGKILL for any left after `kill_grace` seconds.
+def kill_process_group(process):
+	try:
+		os.killpg(process.pid, signal.SIGTERM)
+	except ProcessLookupError:
+		return
+	try:
+		process.wait(timeout=kill_grace)
+	except subprocess.TimeoutExpired:
+		pass
+	try:
+		os.killpg(process.pid, signal.SIGKILL)
+	except ProcessLookupError:
+		pass
+
+
+class Watchdog:
+	"""
+	Stops a process, started in a new session, that hangs. The process group is
+	stopped (see `kill_process_group`) if it goes `timeout` seconds without
+	calling `reset`, or runs for `total_timeout` seconds in all. Either may be
+	`None` for no limit.
+
+	expired -- whether the process was stopped (boolean)
+	"""
+	def __init__(self, process, timeout=None, total_timeout=None):
+		self.expired = False
+		self._process = process
+		self._timeout = timeout
+		self._deadline = None if total_timeout is None else time.monotonic() + total_timeout
+		self._last = time.monotonic()
+		self._done = threading.Event()
+		self._thread = None
+		if timeout is not None or total_timeout is not None:
+			self._thread = threading.Thread(target=self._watch, daemon=True)
+			self._thread.start()
+
+	# Note that the process is making progress, e.g. has written output.
+	def reset(self):
+		self._last = time.monotonic()
+
+	def stop(self):
+		self._done.set()
+		if self._thread is not None:
+			self._thread.join()
+
+	def _watch(self):
+		while not self._done.wait(0.5):
+			now = time.monotonic()
+			if (self._timeout is not None and now - self._last > self._timeout) or (self._deadline is not None and now > self._deadline):
+				self.expired = True
+				kill_process_group(self._process)
+				return
+
+# Run `cmd`, writing its output to `log_path` and passing each line to
+# `on_line` as soon as it arrives, so that output isn't held in memory.
+# `cmd` is stopped if it goes `timeout` seconds without output, or runs for
+# `total_timeout` seconds (see `Watchdog`).
+# Returns the exit status, or `None` if `cmd` was stopped.
+def run_streaming(cmd, cwd, env, log_path, on_line, append=False, timeout=None, total_timeout=None):
+	with open(log_path, "a" if append else "w") as log, subprocess.Popen(cmd, cwd=cwd, env=env, encoding="utf-8", errors="replace",
+			stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True) as process:
+		watchdog = Watchdog(process, timeout, total_timeout)
+		try:
+			for line in process.stdout:
+				watchdog.reset()
+				log.write(line)
+				log.flush()
+				on_line(line.rstrip("\n"))
+		except BaseException:
+			# Not killed along with this process on ^C, as it's in its own session.
+			kill_process_group(process)
+			raise
+		finally:
+			watchdog.stop()
+	return None if watchdog.expired else process.returncode
+
+
+# Locks serialising access to each mirror, as several suites may share one.
+_mirror_locks = {}
+_mirror_locks_guard = threading.Lock()
+
+def mirror_lock(mirror):
+	with _mirror_locks_guard:
+		return _mirror_locks.setdefault(mirror, threading.Lock())
+
+
+class Libtest:
+	"""
+	Adapter for the benchmark harness built into the standard library.
+
+	Results are read from its summary line, which gives the median time per
+	iteration of one run and the spread of the times. No raw samples are
+	available, so each round's median is its only sample.
+	"""
+	# Flags for Cargo to select the benchmark targets to run.
+	cargo_flags = []
+	# Whether the harness saves raw samples, see `samples`.
+	saves_samples = False
+
+	# Flags for the harness to run only the benchmarks named in `bench_filter`,
+	# or all of them if `None`.
+	def harness_flags(self, bench_filter=None):
+		return [] if bench_filter is None else ["--exact"] + bench_filter
+
+	# Benchmark name, time and range in ns from a line of output, or `None` if
+	# the line isn't a result.
+	def parse_line(self, line):
+		item = data_regex.match(line)
+		if item is None:
+			return None
+		return (item.group(1), int(item.group(2).replace(",", "")), int(item.group(3).replace(",", "")))
+
+	# Benchmark name from a line of `--list` output, or `None`.
+	def parse_list_line(self, line):
+		item = list_regex.match(line)
+		return None if item is None else item.group(1)
+
+	# Raw per-iteration times in ns written to `target_dir` since `since` (a
+	# timestamp), as a map from benchmark name to list of times.
+	def samples(self, target_dir, since):
+		return {}
+
+class Criterion(Libtest):
+	"""
+	Adapter for benchmarks using Criterion.rs.
+
+	Criterion is asked for libtest compatible ("bencher") output, which gives
+	a result line per benchmark as it finishes. Criterion also saves every
+	sample it measured to `criterion/<benchmark>/new/sample.json` in the
+	target directory, which is read after the run when the benchmarks ran on
+	this machine. On the Morello machine they are left in the remote test
+	server's directory, which the test client can't copy back, so only the
+	median of each round is kept.
+
+	Spaces in benchmark names are replaced with "_", so names can be used as
+	plot labels.
+	"""
+	# Only bench targets use Criterion, the library's test harness would reject
+	# Criterion's flags.
+	cargo_flags = ["--bench", "*"]
+	saves_samples = True
+
+	def harness_flags(self, bench_filter=None):
+		flags = ["--output-format", "bencher", "--noplot"]
+		if bench_filter is not None:
+			# Criterion takes a single regex filter rather than a list of names.
+			flags.append("^(?:{})$".format("|".join(re.escape(name).replace("_", "[ _]") for name in bench_filter)))
+		return flags
+
+	def parse_line(self, line):
+		item = criterion_data_regex.match(line)
+		if item is None:
+			return None
+		return (item.group(1).replace(" ", "_"), int(item.group(2).replace(",", "")), int(item.group(3).replace(",", "")))
+
+	def parse_list_line(self, line):
+		name = super().parse_list_line(line)
+		return None if name is None else name.replace(" ", "_")
+
+	def samples(self, target_dir, since):
+		samples = {}
+		for benchmark_file in glob.glob(path.join(target_dir, "criterion", "**", "new", "benchmark.json"), recursive=True):
+			sample_file = path.join(path.dirname(benchmark_file), "sample.json")
+			try:
+				if path.getmtime(sample_file) < since:
+					continue
+				with open(benchmark_file) as file:
+					name = json.load(file)["full_id"].replace(" ", "_")
+				with open(sample_file) as file:
+					sample = json.load(file)
+			except (OSError, ValueError, KeyError):
+				continue
+			samples[name] = [time/iters for iters, time in zip(sample["iters"], sample["times"]) if iters > 0]
+		return samples
+
+# Benchmark harnesses by name, see `Suite`.
+harnesses = {
+	"libtest": Libtest(),
+	"criterion": Criterion(),
+}
+
 
 class Suite:
-	def __init__(self, directory, repo=None, branch=None, patch=None, subprojects=[None], extra_bench_flags=[]):
+	def __init__(self, directory, repo=None, branch=None, patch=None, subprojects=[None], extra_bench_flags=[], harness="libtest",
+			timeout=None, round_timeout=None, build_timeout=None):
 		"""
 		Suite represents a benchmark suite.
 
@@ -106,6 +564,9 @@ class Suite:
 		branch -- Git branch to checkout when cloning (string), set to `None` to use default branch.
 		patch -- Patch file in `patch_path` to apply (string), set to `None` to skip.
 		subprojects -- Subprojects to run benchmarks from (list of strings), set to `None` if subprojects are not in use.
+		extra_bench_flags -- Extra flags for `cargo bench` (list of strings), may include flags for the harness after "--".
+		harness -- Benchmark harness the suite uses, a key of `harnesses` (string).
+		timeout, round_timeout, build_timeout -- Seconds a benchmark may go without output, a round may take and a build may take (numbers), set to `None` to use those from the command line.
 		"""
 		self.repo = repo
 		self.branch = branch
@@ -113,14 +574,25 @@ class Suite:
 		self.patch_file = patch
 		self.subprojects = subprojects
 		self.extra_bench_flags = extra_bench_flags
+		if harness not in harnesses:
+			raise ValueError("unknown benchmark harness {} for {}".format(harness, directory))
+		self.harness = harnesses[harness]
+		self.timeout = timeout
+		self.round_timeout = round_timeout
+		self.build_timeout = build_timeout
 
 		# Private
 		self._cargo_env = os.environ.copy()
-		assert(rustc.count(":") == 0)
-		self._cargo_env["PATH"] = path.dirname(rustc)+":"+self._cargo_env.get("PATH", "")
 
-	def log_path(self, configuration):
-		return path.join(benchmark_path, self.directory, "{}-output.log".format(configuration.name))
+	# Directories to run benchmarks in, one for each subproject.
+	def directories(self):
+		subprojects = [None] if self.subprojects is None else self.subprojects
+		return [self.directory if subproject is None else path.join(self.directory, subproject) for subproject in subprojects]
+
+	def log_path(self, configuration, directory=None, device=None):
+		directory = self.directory if directory is None else directory
+		name = configuration.name if device is None else "{}-{}".format(configuration.name, re.sub(r"[^A-Za-z0-9.]", "_", device))
+		return path.join(benchmark_path, directory, "{}-output.log".format(name))
 
 	def clean(self):
 		if self.repo is not None: 
@@ -129,104 +601,386 @@ class Suite:
 			subprocess.run(["rm", "-rf", self.directory])
 			print(f"{TTY_GREEN}OK{TTY_RESET}")
 	
+	# Clone the repository and apply the patch, if not already done.
+	# Nothing is printed, so this is safe to call from several threads at once.
+	# Returns (success, log), where log is the human-readable progress output.
 	def clone_and_patch(self):
+		log = []
 		# Skip benchmarks that aren't from Git repositories.
 		if self.repo is None:
 			if self.patch_file is not None:
-				print("WARN: patch specified for non-Git benchmark {}, ignored".format(suite.directory))
-			return
-
-		if (not os.path.isdir(path.join(benchmark_path, self.directory))):
-			print("Cloning {}... ".format(self.directory), end="")
-			sys.stdout.flush()
-			cmd = ["git", "clone", self.repo]
-			if self.branch is not None:
-				cmd += ["--branch", self.branch]
-			cmd += [self.directory]
-			res = run_cmd(cmd, benchmark_path)
-			print_result(res)
+				log.append("WARN: patch specified for non-Git benchmark {}, ignored".format(self.directory))
+			return (True, log)
+
+		directory = path.join(benchmark_path, self.directory)
+		if (not os.path.isdir(directory)):
+			success, commit = self.update_mirror(log)
+			if not success:
+				return (False, log)
+
+			# Shallow checkout of the pinned commit from the local mirror.
+			# Remove partial checkouts so that the next run tries again.
+			for cmd in [
+				["git", "init", "-q", directory],
+				["git", "fetch", "-q", "--depth", "1", "file://" + self.mirror_directory(), commit],
+				["git", "checkout", "-q", "--detach", "FETCH_HEAD"],
+				["git", "remote", "add", "origin", self.repo],
+			]:
+				res = run_cmd(cmd, cwd=benchmark_path if cmd[1] == "init" else directory, quiet=True)
+				if res.returncode != 0:
+					break
+			log.append("Cloning {}... {}".format(self.directory, result_text(res)))
+			if res.returncode != 0:
+				log.append(res.stdout)
+				shutil.rmtree(directory, ignore_errors=True)
+				return (False, log)
 			if self.patch_file is not None:
-				print("  applying patch {}... ".format(self.patch_file), end="")
-				sys.stdout.flush()
 				cmd = ["git", "apply", path.join(patch_path, self.patch_file)]
-				res = run_cmd(cmd, cwd=path.join(benchmark_path, self.directory))
-				print_result(res)
-
-	# Count lines of code in test repository.
-	# Returns (total lines, lines of code (excludes comments, blanks, unsafe), lines of unsafe).
-	# Needs cargo count to have been built.
-	def line_count(self):
-		# TODO: it would be nice to count lines in dependencies via cargo tree.
-		# TODO: handle subprojects.
-		if len(self.subprojects) != 0 and self.subprojects != [None]:
-			print("WARN: subprojects not supported for line counting")
-			return (0, 0, 0)
-
-		print("Counting {}...".format(self.directory))
-		result = run_cmd([count_path, "count", "--unsafe-statistics", "-l", "rs"],
-			cwd=path.join(benchmark_path, self.directory),
-			env=self._cargo_env
-		)
-		if result.returncode != 0:
-			return (0, 0, 0)
-		matches = count_regex.findall(result.stdout)
-		if len(matches) != 1:
-			print("WARN: wrong number of line count lines")
-			return (0, 0, 0)
-		match = matches[0]
-		lines = int(match[1])
-		code = int(match[4])
-		unsafe = int(match[5])
-		return (lines, code, unsafe)
-
-	def cargo(self, configurtaion, cmd, extra_flags=[]):
-		return run_cmd([cargo, cmd, "--target", configuration.target] + extra_flags,
-			cwd=path.join(benchmark_path, self.directory),
-			env=self._cargo_env
+				res = run_cmd(cmd, cwd=directory, quiet=True)
+				log.append("  applying patch {}... {}".format(self.patch_file, result_text(res)))
+				if res.returncode != 0:
+					log.append(res.stdout)
+					return (False, log)
+		return (True, log)
+
+	# Directory of the bare mirror of this suite's repository in `mirror_path`.
+	def mirror_directory(self):
+		name = path.basename(self.repo.rstrip("/"))
+		if name.endswith(".git"):
+			name = name[:-len(".git")]
+		digest = hashlib.sha1(self.repo.encode("utf-8")).hexdigest()[:12]
+		return path.join(mirror_path, "{}-{}.git".format(name, digest))
+
+	# Make sure the mirror exists and contains `branch`, only touching the
+	# network if it doesn't.
+	# Returns (success, commit hash of `branch`), appending progress to `log`.
+	def update_mirror(self, log):
+		mirror = self.mirror_directory()
+		rev = "HEAD" if self.branch is None else self.branch
+		resolve = ["git", "rev-parse", "--verify", "--quiet", rev + "^{commit}"]
+		with mirror_lock(mirror):
+			if not os.path.isdir(mirror):
+				os.makedirs(mirror_path, exist_ok=True)
+				res = run_cmd(["git", "clone", "-q", "--mirror", self.repo, mirror], quiet=True)
+				log.append("Mirroring {}... {}".format(self.repo, result_text(res)))
+				if res.returncode != 0:
+					log.append(res.stdout)
+					shutil.rmtree(mirror, ignore_errors=True)
+					return (False, None)
+				# Allow checkouts of commits that aren't at the tip of a ref.
+				run_cmd(["git", "config", "uploadpack.allowAnySHA1InWant", "true"], cwd=mirror)
+
+			res = run_cmd(resolve, cwd=mirror, quiet=True)
+			if res.returncode != 0:
+				res = run_cmd(["git", "remote", "update", "--prune"], cwd=mirror, quiet=True)
+				log.append("Updating mirror of {}... {}".format(self.repo, result_text(res)))
+				if res.returncode != 0:
+					log.append(res.stdout)
+					return (False, None)
+				res = run_cmd(resolve, cwd=mirror, quiet=True)
+				if res.returncode != 0:
+					log.append("ERROR: {} not found in {}".format(rev, self.repo))
+					return (False, None)
+		return (True, res.stdout.strip())
+
+	# Root directories of the packages `directory` (defaults to the suite
+	# directory) depends on, from `cargo metadata` with the Cargo of
+	# `configuration`, or `None` if that failed.
+	def dependency_directories(self, configuration, directory=None):
+		directory = self.directory if directory is None else directory
+		env = self._cargo_env.copy()
+		bin_path = configuration.bin_path()
+		env["PATH"] = bin_path+":"+env.get("PATH", "")
+		res = run_cmd([path.join(bin_path, "cargo"), "metadata", "--format-version", "1"], cwd=path.join(benchmark_path, directory), env=env)
+		if res.returncode != 0:
+			return None
+		# Cargo's progress messages are mixed in with the metadata.
+		lines = [line for line in res.stdout.splitlines() if line.startswith("{")]
+		return None if len(lines) == 0 else linecount.dependency_directories(json.loads(lines[-1]))
+
+	# Command, working directory and environment to run Cargo subcommand `cmd`
+	# in `directory` (defaults to the suite directory) for `configuration`.
+	def cargo_command(self, configuration, cmd, extra_flags=[], directory=None):
+		directory = self.directory if directory is None else directory
+		env = self._cargo_env.copy()
+		bin_path = configuration.bin_path()
+		assert(bin_path.count(":") == 0)
+		env["PATH"] = bin_path+":"+env.get("PATH", "")
+		env["CARGO_TARGET_DIR"] = configuration.target_dir(self)
+		env["CARGO_BUILD_RUSTFLAGS"] = configuration.rust_flags
+		if configuration.is_local():
+			# Quoted for runner.sh, which the Cargo configuration runs with
+			# --local for this target (see `write_cargo_config`).
+			env["BENCH_RUNNER"] = shlex.join(configuration.runner)
+		return ([path.join(bin_path, "cargo"), cmd, "--target", configuration.target] + extra_flags,
+			path.join(benchmark_path, directory),
+			env
 		)
 
-	def build(self, configuration):
-		self.cargo(configuration, "build")
+	def cargo(self, configuration, cmd, extra_flags=[], directory=None, timeout=None):
+		(cmd, cwd, env) = self.cargo_command(configuration, cmd, extra_flags, directory)
+		return run_cmd(cmd, cwd=cwd, env=env, timeout=timeout)
+
+	# Timeouts of this suite, its own or else those given on the command line,
+	# as (benchmark, round, build) timeouts, see `bench_timeout`.
+	def timeouts(self):
+		return (bench_timeout if self.timeout is None else self.timeout,
+			round_timeout if self.round_timeout is None else self.round_timeout,
+			build_timeout if self.build_timeout is None else self.build_timeout)
+
+	def build(self, configuration, directory=None):
+		return self.cargo(configuration, "build", directory=directory, timeout=self.timeouts()[2])
+
+	# Flags for `cargo bench`, with `harness_flags` passed on to the harness.
+	def bench_flags(self, harness_flags=[]):
+		flags = self.harness.cargo_flags + self.extra_bench_flags
+		if len(harness_flags) > 0:
+			flags = flags + ([] if "--" in flags else ["--"]) + harness_flags
+		return flags
+
+	# Build benchmarks without running them, so that a later `bench` only has
+	# to run them. Nothing is printed, so this is safe to call from a thread.
+	def build_bench(self, configuration, directory=None):
+		(cmd, cwd, env) = self.cargo_command(configuration, "bench", ["--no-run"] + self.bench_flags(), directory)
+		return run_cmd(cmd, cwd=cwd, env=env, quiet=True, timeout=self.timeouts()[2])
 	
-	def test(self, configuration):
-		return self.cargo(configuration, "test")
-
-	def bench(self, configuration):
-		output = self.cargo(configuration, "bench", extra_flags=self.extra_bench_flags)
-		# Write output to log file for debugging.
-		with open(self.log_path(configuration), "wb") as file:
-			file.write(bytes(output.stdout, "utf-8"))
-
-	def parse_bench_output(self, configuration, results):
-		# Parse output to find results for each benchmark in this suite.
-		with open(self.log_path(configuration), "rb") as file:
-			output = file.read().decode("utf-8")
-
-		success = False
-		for item in data_regex.finditer(output):
-			success = True
+	def test(self, configuration, directory=None):
+		return self.cargo(configuration, "test", directory=directory, timeout=self.timeouts()[1])
+
+	# Build the bench and test binaries in `directory` without running them.
+	# Returns the paths of the binaries, as reported by Cargo, or `None` if a
+	# build failed.
+	def binaries(self, configuration, directory=None):
+		paths = []
+		for cmd, flags in [("bench", self.bench_flags()), ("test", [])]:
+			(cmd, cwd, env) = self.cargo_command(configuration, cmd, ["--no-run", "--message-format=json"] + flags, directory)
+			res = run_cmd(cmd, cwd=cwd, env=env, timeout=self.timeouts()[2])
+			if res.returncode != 0:
+				return None
+			paths += [executable for executable, _ in cargo_executables(res.stdout)]
+		return list(dict.fromkeys(paths))
+
+	# Build the bench binaries in `directory` without running them.
+	# Returns (result of the build, list of (binary path, package directory to
+	# run it in)).
+	def bench_binaries(self, configuration, directory=None):
+		(cmd, cwd, env) = self.cargo_command(configuration, "bench", ["--no-run", "--message-format=json"] + self.bench_flags(), directory)
+		res = run_cmd(cmd, cwd=cwd, env=env, quiet=True, timeout=self.timeouts()[2])
+		return (res, [] if res.returncode != 0 else cargo_executables(res.stdout))
+
+	# Run the bench binary `binary` in `cwd` directly, with `--bench` and the
+	# harness flags `harness_flags`, on `device` for configurations running on
+	# the Morello machine. Unlike runs through `runner.sh`, the exit status is
+	# kept.
+	# Returns (output, exit status), where the status is negative if the binary
+	# was killed by a signal, or `None` if it didn't finish within the
+	# benchmark timeout.
+	def run_binary(self, configuration, binary, cwd, harness_flags, device=None):
+		# Harness flags from `extra_bench_flags` come after "--".
+		extra = self.extra_bench_flags[self.extra_bench_flags.index("--")+1:] if "--" in self.extra_bench_flags else []
+		args = [binary, "--bench"] + extra + harness_flags
+		env = self._cargo_env.copy()
+		if configuration.is_local():
+			cmd = configuration.runner + args
+		else:
+			cmd = [test_client(), "run", "0"] + args
+			if device is not None:
+				env["TEST_DEVICE_ADDR"] = device
+		try:
+			res = run_cmd(cmd, cwd=cwd, env=env, quiet=True, timeout=self.timeouts()[0])
+		except OSError as e:
+			return (str(e), 127)
+		return (res.stdout, res.returncode)
+
+	# Names of the benchmarks in `directory` whose full name (including the
+	# directory) matches `regex`, as listed by the benchmark harness.
+	def list_benches(self, configuration, directory, regex, device=None):
+		(cmd, cwd, env) = self.cargo_command(configuration, "bench", self.bench_flags(["--list"]), directory)
+		if device is not None:
+			env["TEST_DEVICE_ADDR"] = device
+		res = run_cmd(cmd, cwd=cwd, env=env, timeout=self.timeouts()[0])
+		names = []
+		for line in res.stdout.splitlines():
+			name = self.harness.parse_list_line(line)
+			if name is not None and regex.search("{}/{}".format(directory, name)):
+				names.append(name)
+		return names
+
+	# Run benchmarks in `directory`, the suite or one of its subprojects, on
+	# `device` (the test client's default device if `None`).
+	# Results are parsed from Cargo's output as it arrives and appended to
+	# `journal`. The output is also written to the log file. Raw samples the
+	# harness saved are read and journaled after the run. Once the round is
+	# over its results are stored in `results`.
+	# Returns False if the device couldn't be reached, in which case nothing is
+	# stored and the round should be run again elsewhere.
+	# `bench_filter` is a list of benchmark names to run, instead of all of them.
+	# With `isolate`, each benchmark in `bench_filter` is run on its own.
+	# With `counters`, counters.py reports counters after each benchmark binary
+	# finishes, which are stored for the benchmarks it ran.
+	# `conditions` are measurements of the machine taken before the run (see
+	# `machine_conditions`), stored with every benchmark's results.
+	# A run that hangs is stopped (see `timeouts`), and the benchmarks it didn't
+	# finish get a "timeout" metric of 1 instead of results.
+	def bench(self, configuration, directory, round, results, journal, device=None, bench_filter=None, isolate=False, counters=False, conditions=None):
+		(cmd, cwd, env) = self.cargo_command(configuration, "bench", [], directory)
+		if device is not None:
+			env["TEST_DEVICE_ADDR"] = device
+		if counters:
+			env["BENCH_COUNTERS"] = "1"
+			if counters_command is not None:
+				env["BENCH_COUNTERS_COMMAND"] = counters_command
+		prefix = "" if device is None else "[{}] ".format(device)
+		found = []
+		refused = False
+		# Benchmarks run since counters were last reported, and the counters of
+		# each benchmark.
+		unmeasured = []
+		measured = {}
+		def on_line(line):
+			nonlocal refused
+			item = counters_regex.match(line)
+			if item is not None:
+				metrics = json.loads(item.group(1))
+				for name in unmeasured:
+					journal.record_metrics(directory, configuration.name, round, name, metrics)
+					measured[name] = metrics
+				unmeasured.clear()
+				return
+			item = self.harness.parse_line(line)
+			if item is None:
+				# Report signs of trouble immediately rather than after the run.
+				if refused_regex.search(line):
+					refused = True
+				if problem_regex.search(line):
+					print("  {}WARN: {}".format(prefix, line))
+				return
 
 			# Extract data.
-			bench_name = item.group(1)
+			(bench_name, time, time_range) = item
 			name = f"{directory}/{bench_name}"
-			time = int(item.group(2).replace(",", ""))
-			time_range = int(item.group(3).replace(",", ""))
+			print("  {}{:50s} {:>14,} ns/iter (+/- {:,})".format(prefix, bench_name, time, time_range))
 
 			# Store data.
-			benchmark_data = results.get(name, {})
-			mode_data = benchmark_data.get(configuration.name, [])
-			if len(mode_data) > round:
-				print("ERROR: unexpected extra run of benchmark {}".format(name))
-				# exit(1)
-			else:
-				mode_data.append((time, time_range))
-				benchmark_data[configuration.name] = mode_data
-				results[name] = benchmark_data
-			assert(len(mode_data) == round+1)
-		if not success:
+			journal.record(directory, configuration.name, round, name, time, time_range, device)
+			found.append((name, time, time_range))
+			unmeasured.append(name)
+
+		journal.start(directory, configuration.name, round)
+		log_path = self.log_path(configuration, directory, device)
+		started = time.time()
+		(timeout, total_timeout, _) = self.timeouts()
+		filters = [[name] for name in bench_filter] if isolate and bench_filter is not None else [bench_filter]
+		timed_out = []
+		for i, names in enumerate(filters):
+			remaining = None if total_timeout is None else total_timeout - (time.time() - started)
+			if remaining is not None and remaining <= 0:
+				timed_out.append(names)
+				continue
+			status = run_streaming(cmd + self.bench_flags(self.harness.harness_flags(names)), cwd, env, log_path, on_line, append=(i > 0),
+				timeout=timeout, total_timeout=remaining)
+			if refused and device is not None:
+				break
+			if status is None:
+				timed_out.append(names)
+		if refused and device is not None:
+			print("WARN: couldn't reach {} while running {}".format(device, directory))
+			return False
+		names = set(name for name, _, _ in found)
+		if len(timed_out) > 0:
+			limits = ([] if timeout is None else ["{} s without output".format(timeout)]) + ([] if total_timeout is None else ["{} s in all".format(total_timeout)])
+			print("  {}TIMEOUT: stopped {} round {} after {}".format(prefix, directory, round+1, " or ".join(limits)))
+			# Benchmarks the stopped runs were meant to run but didn't, which
+			# without a filter are those of `directory` seen before. If none are
+			# known, the whole directory is marked as "<directory>/*".
+			expected = set()
+			for filter_names in timed_out:
+				if filter_names is not None:
+					expected.update(f"{directory}/{name}" for name in filter_names)
+				else:
+					with results_lock:
+						expected.update(name for b, name in enumerate(results.benchmarks) if results.suites[b] == directory)
+			unfinished = sorted(expected - names - {f"{directory}/*"})
+			for name in unfinished if len(unfinished) > 0 else [f"{directory}/*"]:
+				journal.record_metrics(directory, configuration.name, round, name, {"timeout": 1})
+				measured[name] = dict(measured.get(name, {}), timeout=1)
+		samples = {}
+		if self.harness.saves_samples and not configuration.is_local() and round == 0 and len(names) > 0:
+			print("  {}WARN: raw samples of {} stay on the remote machine, only round medians are kept".format(prefix, directory))
+		for bench_name, times in self.harness.samples(configuration.target_dir(self), started).items():
+			name = f"{directory}/{bench_name}"
+			if name in names:
+				journal.record_samples(directory, configuration.name, round, name, times, device)
+				samples[name] = times
+		for name, time_taken, time_range in found:
+			add_result(results, directory, name, configuration.name, round, time_taken, time_range, device)
+		for name, times in samples.items():
+			add_samples(results, directory, name, configuration.name, round, times, device)
+		if conditions is not None:
+			for name in names:
+				journal.record_metrics(directory, configuration.name, round, name, conditions)
+				measured[name] = dict(conditions, **measured.get(name, {}))
+		for name, metrics in measured.items():
+			add_metrics(results, directory, name, configuration.name, round, metrics)
+		journal.complete(directory, configuration.name, round)
+		if len(found) == 0 and len(timed_out) == 0:
 			print("ERROR: benchmark suite {} generated no results".format(directory))
-			print(output)
+			with open(log_path) as file:
+				print(file.read())
 			# exit(1)
+		return True
+
+# Paths of the executables Cargo reports building in `output`, of a command
+# given `--message-format=json`, as a list of (path, package directory).
+def cargo_executables(output):
+	executables = []
+	for line in output.splitlines():
+		if not line.startswith("{"):
+			continue
+		message = json.loads(line)
+		if message.get("reason") == "compiler-artifact" and message.get("executable") is not None:
+			executables.append((message["executable"], path.dirname(message["manifest_path"])))
+	return executables
+
+# Write the Cargo configuration shared by all configurations, where benchmarks
+# for `local_targets` run on this machine (see `Configuration.is_local`) and
+# those for other targets through the remote test client. Commands are written
+# as arrays, which Cargo doesn't split on spaces.
+# Per-configuration settings are passed through the environment instead, see
+# `Suite.cargo`.
+def write_cargo_config(local_targets=[]):
+	cargo_config_dir = path.join(benchmark_path, ".cargo")
+	if not os.path.exists(cargo_config_dir):
+		os.mkdir(cargo_config_dir)
+	linkers = {"aarch64-unknown-freebsd": aarch64_linker(), "aarch64-unknown-freebsd-purecap": purecap_linker()}
+	runners = {target: [runner, test_client()] for target in linkers}
+	for target in local_targets:
+		runners[target] = [runner, "--local"]
+	lines = []
+	for target, command in runners.items():
+		lines += ["[target.{}]".format(target), "runner = [{}]".format(", ".join(json.dumps(word) for word in command))]
+		if target in linkers:
+			lines.append("linker = {}".format(json.dumps(linkers[target])))
+		lines.append("")
+	with open(path.join(cargo_config_dir, "config.toml"), "w") as cargo_config_file:
+		cargo_config_file.write("\n".join(lines))
+
+# State of the compiler sources in `rust_path()`.
+# Returns (HEAD commit, hash of uncommitted changes or None if clean).
+@functools.lru_cache(maxsize=None)
+def rust_source_state():
+	head = run_cmd(["git", "rev-parse", "HEAD"], cwd=rust_path())
+	status = run_cmd(["git", "status", "--porcelain"], cwd=rust_path())
+	if head.returncode != 0 or status.returncode != 0:
+		print("ERROR: can't get state of compiler sources in {}".format(rust_path()))
+		exit(1)
+	dirty = None
+	if status.stdout.strip() != "":
+		diff = subprocess.run(["git", "diff", "HEAD"], cwd=rust_path(), stdout=subprocess.PIPE)
+		h = hashlib.sha256(diff.stdout)
+		h.update(status.stdout.encode("utf-8"))
+		dirty = h.hexdigest()
+	return (head.stdout.strip(), dirty)
 
 class Configuration:
 	"""
@@ -235,396 +989,874 @@ class Configuration:
 	name -- short-hand name for this config
 	target -- target tripple
 	rust_flags -- rustc flags
+	runner -- command to run benchmarks with on this machine (list of strings,
+	          may be empty), set to `None` to run them on the Morello machine
+	          through the remote test client
 	"""
-	def __init__(self, name, target, rust_flags=""):
+	def __init__(self, name, target, rust_flags="", runner=None):
 		self.name = name
 		self.target = target
 		self.rust_flags = rust_flags
-	
-	def write_cargo_config(self):
-		cargo_config_dir = path.join(benchmark_path, ".cargo")
-		if not os.path.exists(cargo_config_dir):
-			os.mkdir(cargo_config_dir)
-		with open(path.join(cargo_config_dir, "config.toml"), "w") as cargo_config_file:
-			cargo_config_file.write("\n".join([
-				"""[build]""",
-				"""rustflags="{}\"""".format(self.rust_flags),
-				"",
-				"""[target.aarch64-unknown-freebsd]""",
-				"""runner = "{} {}\"""".format(runner, test_client),
-				"""linker = "{}\"""".format(aarch64_linker),
-				"",
-				"""[target.aarch64-unknown-freebsd-purecap]""",
-				"""runner = "{} {}\"""".format(runner, test_client),
-				"""linker = "{}\"""".format(purecap_linker),
-			]))
+		self.runner = runner
 
+	# Whether benchmarks run on this machine rather than the Morello machine.
+	def is_local(self):
+		return self.runner is not None
 	
+	# Hash identifying the build output of this configuration.
+	def fingerprint(self):
+		h = hashlib.sha256()
+		for part in [self.target, self.rust_flags, self.toolchain_fingerprint()]:
+			h.update(part.encode("utf-8"))
+			h.update(b"\0")
+		return h.hexdigest()[:16]
+
+	# Cargo target directory for `suite` built with this configuration.
+	def target_dir(self, suite):
+		return path.join(target_cache_path, "{}-{}".format(self.name, self.fingerprint()), suite.directory)
+
+	# Hash identifying the compiler used by this configuration.
+	# Configurations with the same compiler sources and flags share a toolchain.
+	def toolchain_fingerprint(self):
+		return hashlib.sha256(json.dumps(self.toolchain_info(), sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+	# Inputs the toolchain is built from, recorded alongside installed toolchains.
+	def toolchain_info(self):
+		(head, dirty) = rust_source_state()
+		return {"head": head, "dirty": dirty, "rust_flags": self.rust_flags}
+
+	# Directory of the installed toolchain for this configuration.
+	def toolchain_dir(self):
+		return path.join(toolchain_path(), self.toolchain_fingerprint())
+
+	# Directory containing `rustc` and `cargo` for this configuration.
+	def bin_path(self):
+		return path.join(self.toolchain_dir(), "bin")
+
+	# Whether `build_rust` can reuse an installed toolchain.
+	def toolchain_installed(self):
+		return path.isfile(path.join(self.toolchain_dir(), "toolchain.json")) and not force_install
+
 	# Ensure compiler and tools have been built.
+	# Reuses an installed toolchain built from the same inputs, if there is one.
+	# Returns whether the toolchain was built.
 	def build_rust(self):
-		if skip_install:
-			return
+		x = path.join(rust_path(), "x.py")
+		toolchain = self.toolchain_dir()
+		info_path = path.join(toolchain, "toolchain.json")
+		if self.toolchain_installed():
+			print("Using installed Rust {}".format(self.toolchain_fingerprint()))
+			if not self.is_local() and not path.isfile(test_client()):
+				print("Building remote-test-client... ", end="")
+				sys.stdout.flush()
+				print_result(run_cmd(["python3", x, "build", "src/tools/remote-test-client", "--target", host_target()], cwd=rust_path()))
+			return False
+
 		env = os.environ.copy()
 		env["RUSTFLAGS_STAGE_NOT_0"] = self.rust_flags
 
-		x = path.join(rust_path, "x.py")
 		print("Building Rust... ", end="")
 		sys.stdout.flush()
-		res = run_cmd(["python3", x, "build", "std", "core", "rustc", "cargo"], cwd=rust_path, env=env)
+		res = run_cmd(["python3", x, "build", "std", "core", "rustc", "cargo"], cwd=rust_path(), env=env)
 		print_result(res)
 
-		print("Building remote-test-client... ", end="")
-		sys.stdout.flush()
-		res = run_cmd(["python3", x, "build", "src/tools/remote-test-client", "--target", target], cwd=rust_path)
-		print_result(res)
+		if not self.is_local():
+			print("Building remote-test-client... ", end="")
+			sys.stdout.flush()
+			res = run_cmd(["python3", x, "build", "src/tools/remote-test-client", "--target", host_target()], cwd=rust_path())
+			print_result(res)
 
 		print("Installing Rust compiler... ", end="")
 		sys.stdout.flush()
-		print_result(run_cmd(["python3", x, "install"], cwd=rust_path, env=env))
+		print_result(run_cmd(["python3", x, "install"], cwd=rust_path(), env=env))
 
 		print("Installing Rust tools... ", end="")
 		sys.stdout.flush()
 		print_result(run_cmd(["python3", x, "install", 
 			"cargo", "library/std"
-			], cwd=rust_path, env=env))
-
-
-working = [
-	Suite(repo="https://github.com/bluss/arrayvec", branch="0.7.2", directory="arrayvec-0.7.2"),
-	# TODO: unexpected extra run of benchmark block-ciphers/aes/{encrypt,decrypt}
-	Suite(repo="https://github.com/RustCrypto/block-ciphers", branch="aes-v0.7.2", directory="block-ciphers", subprojects=["aes"]),
-	Suite(repo="https://github.com/rust-lang/hashbrown", branch="v0.11.2", directory="hashbrown-0.11.2"),
-	Suite(repo="https://github.com/RustCrypto/hashes", branch="sha2-v0.10.2", directory="hashes-sha2-v0.10.2", subprojects=["sha2", "sha3"]),
-	Suite(repo="https://github.com/bluss/indexmap", branch="1.8.2", directory="indexmap-1.8.2", patch="indexmap-1.8.2.patch"),
-	Suite(repo="https://github.com/dtolnay/itoa", branch="1.0.3", directory="itoa-1.0.3"),
-	# TODO: LTO needs to be disabled (??)
-	Suite(repo="https://github.com/johannesvollmer/lebe", branch="0.5.0", directory="lebe-0.5.0", patch="lebe-0.5.0.patch"),
-	Suite(repo="https://github.com/bluss/matrixmultiply/", branch="0.3.2", directory="matrixmultiply-0.3.2"),
-
-	# TODO:
-	# ERROR: unexpected extra run of benchmark ndarray-0.15.6/map_regular
-	# ERROR: unexpected extra run of benchmark ndarray-0.15.6/iter_sum_2d_cutout
-	# ERROR: unexpected extra run of benchmark ndarray-0.15.6/iter_sum_2d_regular
-	Suite(repo="https://github.com/rust-ndarray/ndarray", branch="0.15.6", directory="ndarray-0.15.6"),
-	Suite(repo="https://github.com/rust-num/num-bigint", branch="num-bigint-0.4.3", directory="num-bigint-0.4.3"),
-
-	# TODO:
-	# ERROR: unexpected extra run of benchmark petgraph-0.6.0/full_edges_in
-	# ERROR: unexpected extra run of benchmark petgraph-0.6.0/full_edges_out
-	Suite(repo="https://github.com/petgraph/petgraph", branch="0.6.0", directory="petgraph-0.6.0"),
-
-	# TODO: Probably working, very slow!
-	# Suite(repo="https://github.com/rust-random/rand", branch="0.8.5", directory="rand-0.8.5"),
-
-	Suite(repo="https://github.com/paupino/rust-decimal", branch="1.23.1", directory="rust-decimal-1.23.1", patch="rust-decimal-1.23.1.patch"),
-	Suite(repo="https://github.com/mgeisler/smawk", branch="0.2.0", directory="smawk-0.2.0"),
-	Suite(repo="https://github.com/dtolnay/ryu", branch="1.0.12", directory="ryu-1.0.12"),
-	Suite(repo="https://github.com/dguo/strsim-rs", branch="0.10.0", directory="strsim-rs-0.10.0"),
-	# Suite(repo="https://github.com/rust-random/rand", branch="0.8.5", directory="rand-0.8.5"),
-	Suite(repo="https://github.com/garro95/priority-queue", branch=None, directory="priority-queue-1.3.1", patch="priority-queue-1.3.1.patch", extra_bench_flags=["--features",  "benchmarks"]),
-	Suite(repo="https://github.com/uuid-rs/uuid", branch="1.3.0", directory="uuid-rs-1.3.0", patch="uuid-rs-1.3.0.patch"),
-	Suite(repo="https://github.com/petgraph/fixedbitset", branch="0.3.1", directory="fixedbitset-0.3.1"),
-]
-# Benchmarks to run.
-suites = working
-more = [
-]
-
-broken = [
-	# No benches run not sure why
-
-	# TODO: SIGPROT after 2 benches :(
-	Suite(repo="https://github.com/hyperium/hyper", branch="v0.14.24", directory="hyper-0.14.24", patch="hyper-0.14.24.patch", extra_bench_flags=["--features", "full"]),
-
-	# TODO: SIGPROT on Morello, not sure why
-	Suite(repo="https://github.com/ejmahler/RustFFT", branch="6.0.1", directory="RustFFT-6.0.1"),
-
-	# Critereon broken...
-	Suite(repo="https://github.com/marshallpierce/rust-base64", branch="v0.13.1", directory="rust-base64-0.13.1"),
-	Suite(repo="https://github.com/unicode-rs/unicode-xid", branch="v0.2.4", directory="unicode-xid-0.2.4"),
-	Suite(repo="https://github.com/Lokathor/tinyvec", branch="v1.6.0", directory="tinyvec-1.6.0", extra_bench_flags=["--features", "alloc,real_blackbox"]),
-	Suite(repo="https://github.com/seanmonstar/httparse", branch="v1.8.0", directory="httparse-1.8.0", patch="httparse-1.8.0.patch"),
-	Suite(repo="https://github.com/bheisler/criterion.rs", branch="0.3.6", directory="criterion-0.3.6"),
-	Suite(repo="https://github.com/rust-itertools/itertools", branch="v0.10.4", directory="itertools-0.10.4", patch="itertools-0.10.4.patch"),
-	Suite(repo="https://github.com/hyperium/http", branch="v0.2.9", directory="http-0.2.9"),
-
-	# TODO: Critereon broken, LTO needs to be disabled (??).
-	Suite(repo="https://github.com/dimforge/nalgebra", branch="v0.31.1", directory="nalgebra-0.31.1", extra_bench_flags=["--features", "rand"]),
-
-
-	# No benches
-	Suite(repo="https://github.com/bytecodealliance/wasm-tools", branch="wasm-smith-0.4.4", directory="wasm-tools-0.4.4"),
-
-	# Requires AVX2
-	Suite(repo="https://github.com/binaryfields/resid-rs", branch="1.0.4", directory="resid-rs-1.04"),
-
-	# Various dependency problems 
-	Suite(repo="https://github.com/dtolnay/syn", branch="1.0.101", directory="syn-1.0.101"),
-
-
-	# TODO: Something is broken in Critereon, otherwise the tests work :(
-	Suite(repo="https://github.com/fitzgen/generational-arena", branch="0.2.8", directory="generational-arena-0.2.8"),
-
-	# Not sure what's going on here...
-	Suite(repo="https://github.com/serde-rs/serde", branch="v1.0.125", directory="serde-1.0.125"),
-
-	# Illegal transmute using once_cell 
-	Suite(repo="https://github.com/serde-rs/json", branch="v1.0.91", directory="serde-json-1.0.91"),
-
-	# Illegal transmute in wait-timeout
-	Suite(repo="https://github.com/vorner/arc-swap", branch="v1.5.1", directory="arc-swap-1.5.1"),
-
-	# Illegal transmute in dependencies
-	Suite(repo="https://github.com/zesterer/flume", branch=None, directory="flume"),
-
-	# Casts int to PC, invalid on Morello:
-	Suite(repo="https://github.com/rust-lang/backtrace-rs", branch="0.3.66", directory="backtrace-rs-0.3.66"),
-	# Dependency requires edition2021:
-	# Directory name included version 0.10.14 but without a branch this isn't guaranteed, so it's removed for the moment.
-
-	# Need to pin once_cell at "=1.8.0", proc-macro2 at version "=1.0.42", inscrutable linker error:
-	Suite(repo="https://github.com/briansmith/ring", branch="0.10.0", directory="ring-0.10.0"),
-	# Fatal error: arm_neon.h: No such file or directory:
-	Suite(repo="https://github.com/shssoichiro/oxipng", branch="v5.0.1", directory="oxipng-5.0.1"),
-	# Need to pin thread local at 1.1.0, broken use of C ABI with transmute:
-	Suite(repo="https://github.com/dalance/amber", branch="v0.5.8", directory="amber-0.5.8"),
-	# Broken use of C ABI with transmute:
-	Suite(repo="https://github.com/Canop/broot", branch="v1.3.1", directory="broot-1.3.1"),
-	# Broken use of C ABI with transmute:
-	Suite(repo="https://github.com/kivikakk/comrak", branch="0.14.0", directory="comrak-0.14.0"),
-	# Build seems cooked, unclear why:
-	Suite(repo="https://github.com/connorskees/grass", branch="bd83410a8af0c97da78f88b44f8e08682dc47658", directory="grass-0.11.2"),
-]
-
-# Number of times to run each benchmark (averages are calculated).
-benchmark_rounds = 3
+			], cwd=rust_path(), env=env))
+
+		# Keep this install for other configurations built from the same inputs.
+		shutil.rmtree(toolchain, ignore_errors=True)
+		os.makedirs(toolchain_path(), exist_ok=True)
+		shutil.move(install_path(), toolchain)
+		with open(info_path, "w") as file:
+			json.dump(self.toolchain_info(), file, indent=2, sort_keys=True)
+		return True
+
+
+# Guards `results`, which benchmarks running on several devices add to.
+results_lock = threading.Lock()
+
+# Add the result of one round of a benchmark to `results`.
+# `directory` is the suite or subproject directory the benchmark is from.
+def add_result(results, directory, name, configuration_name, round, time, time_range, device=None):
+	with results_lock:
+		added = results.add(name, configuration_name, round, time, time_range, "" if device is None else device, directory)
+	if not added:
+		print("ERROR: unexpected extra run of benchmark {}".format(name))
+		# exit(1)
+
+# Add the raw samples of one round of a benchmark to `results`.
+def add_samples(results, directory, name, configuration_name, round, times, device=None):
+	with results_lock:
+		results.add_samples(name, configuration_name, round, times, "" if device is None else device, directory)
+
+# Add measurements of one round of a benchmark to `results`, given as a map
+# from metric name to value.
+def add_metrics(results, directory, name, configuration_name, round, metrics):
+	with results_lock:
+		for metric, value in metrics.items():
+			results.add_metric(name, configuration_name, round, metric, value, directory)
+
+class Journal:
+	"""
+	Append-only log of benchmark results on disk.
+
+	Results are written and synced as soon as they're parsed, so a run that is
+	interrupted can be continued with `--resume` without losing data. Each line
+	is a JSON object with a "type" and the suite (or subproject) directory,
+	configuration name and round it belongs to:
+
+	start -- a round of a suite is about to be recorded, discarding any
+	         results from an earlier, unfinished attempt at it
+	result -- one benchmark result, with benchmark, time, range and the
+	          device it ran on (`None` for the default device)
+	samples -- raw per-iteration times of one benchmark, with benchmark,
+	           times and device, if the harness provides them
+	metrics -- other measurements of one benchmark, with benchmark and a map
+	           of values, e.g. counters with `--counters`
+	complete -- all results for the round have been recorded
+
+	file_path -- journal file to write to
+	resume -- keep existing journal contents (boolean), otherwise the existing
+	          journal is moved aside to `file_path`.old when the first entry
+	          is written, so a run that records nothing leaves it alone
+	"""
+	def __init__(self, file_path, resume=False):
+		self.file_path = file_path
+		# Set of (suite, configuration, round) with all results recorded.
+		self.completed = set()
+		# Completed results, in the order they were recorded.
+		self.results = []
+		if resume:
+			self._load()
+		self._resume = resume
+		# Opened on the first write.
+		self._file = None
+		self._lock = threading.Lock()
+
+	def _load(self):
+		if not path.exists(self.file_path):
+			return
+		pending = {}
+		with open(self.file_path) as file:
+			for line in file:
+				try:
+					entry = json.loads(line)
+				except json.JSONDecodeError:
+					# Last line may be incomplete if we crashed while writing it.
+					continue
+				key = (entry["suite"], entry["configuration"], entry["round"])
+				if entry["type"] == "start":
+					pending[key] = []
+				elif entry["type"] in ("result", "samples", "metrics"):
+					pending.setdefault(key, []).append(entry)
+				elif entry["type"] == "complete":
+					self.completed.add(key)
+					self.results += pending.pop(key, [])
+
+	def _write(self, entry):
+		with self._lock:
+			if self._file is None:
+				if not self._resume and path.exists(self.file_path):
+					os.replace(self.file_path, self.file_path + ".old")
+				self._file = open(self.file_path, "a")
+			self._file.write(json.dumps(entry) + "\n")
+			self._file.flush()
+			os.fsync(self._file.fileno())
+
+	def start(self, suite, configuration_name, round):
+		self._write({"type": "start", "suite": suite, "configuration": configuration_name, "round": round})
+
+	def record(self, suite, configuration_name, round, benchmark, time, time_range, device=None):
+		self._write({"type": "result", "suite": suite, "configuration": configuration_name, "round": round,
+			"benchmark": benchmark, "time": time, "range": time_range, "device": device})
+
+	def record_samples(self, suite, configuration_name, round, benchmark, times, device=None):
+		self._write({"type": "samples", "suite": suite, "configuration": configuration_name, "round": round,
+			"benchmark": benchmark, "times": times, "device": device})
+
+	def record_metrics(self, suite, configuration_name, round, benchmark, metrics):
+		self._write({"type": "metrics", "suite": suite, "configuration": configuration_name, "round": round,
+			"benchmark": benchmark, "values": metrics})
+
+	def complete(self, suite, configuration_name, round):
+		self._write({"type": "complete", "suite": suite, "configuration": configuration_name, "round": round})
+		self.completed.add((suite, configuration_name, round))
+
+	def is_complete(self, suite, configuration_name, round):
+		return (suite, configuration_name, round) in self.completed
+
+	# Add results loaded from an earlier run to `results`.
+	def replay(self, results):
+		for entry in self.results:
+			if entry["type"] == "samples":
+				add_samples(results, entry["suite"], entry["benchmark"], entry["configuration"], entry["round"], entry["times"], entry["device"])
+			elif entry["type"] == "metrics":
+				add_metrics(results, entry["suite"], entry["benchmark"], entry["configuration"], entry["round"], entry["values"])
+			else:
+				add_result(results, entry["suite"], entry["benchmark"], entry["configuration"], entry["round"], entry["time"], entry["range"], entry.get("device"))
+
+
+# Suites in list `name` of the manifest, one of `manifest.suite_lists`.
+# Only "working" suites are run.
+def manifest_suites(name="working"):
+	return [Suite(**entry) for entry in load_manifest().suites[name]]
+
+# Configurations in the manifest. Native configurations run on this machine,
+# built for `target` (this machine's if `None`) and run with `runner` (see
+# `Configuration`).
+def manifest_configurations(native=False, target=None, runner=[]):
+	if not native:
+		return [Configuration(**entry) for entry in load_manifest().configurations]
+	target = host_target() if target is None else target
+	return [Configuration(entry["name"], target, entry.get("rust_flags", ""), runner) for entry in load_manifest().native_configurations]
+
 # Path to write results out to.
 output_path = "./tmp/"
-# Paths to write debugging information to.
-debug_readable = "./tmp/benchmark_raw.log"
-debug_raw_data = "./tmp/benchmark_raw.pickle"
-
-# Clean up if asked.
-if "--clean" in sys.argv:
-	for suite in suites:
-		suite.clean()
-	exit(0)
-
-# Fetch all the repos, apply patches.
-for suite in suites:
-	suite.clone_and_patch()
-if clone_only:
-	exit(0)
-
-# Do line count.
-if "--line-count" in sys.argv:
-	with open(path.join(output_path, "line_count.csv"), "w") as file:
-		# Write headers.
-		file.write("Benchmark, Total lines, Code lines, Unsafe lines\n")
-		# Write statistics.
-		for suite in suites:
-			(total, code, unsafe) = suite.line_count()
-			if suite.directory.count(",") != 0:
-				print("ERROR: can't use benchmark name in CSV due to comma")
-				exit(1)
-			file.write("{}, {}, {}, {}\n".format(suite.directory, total, code, unsafe))
-	exit(0);
-
-# Map from benchmark name to data map.
-# Data map in turn maps compiler configuration name to times.
-# Times is a list of (time, range) pairs, of length `benchmark_rounds`.
-# Note that benchmark name means a *single* benchmark, not a benchmark suite
-# given in `suites`.
-results = {}
-
-# Iterate over compiler configurations, rebuilding libraries and benchmarks.
-# The order in which these loops are nested matters. We take advantage of Cargo
-# caching builds of libraries and std to save time, and the cache is
-# invalidated every time we change compiler options. For efficient
-# benchmarking, we want to run all benchmarks for a given compiler
-# configuration before using another configuration.
-configurations = [
-	Configuration("purecap-bounds", "aarch64-unknown-freebsd-purecap", ""),
-	Configuration("purecap-nobounds", "aarch64-unknown-freebsd-purecap", "-C drop-bounds-checks=yes"),
-	Configuration("hybrid-bounds", "aarch64-unknown-freebsd", ""),
-	Configuration("hybrid-nobounds", "aarch64-unknown-freebsd", "-C drop-bounds-checks=yes"),
-]
-for configuration in configurations:
-	# Build and run benchmarks.
-	configuration.build_rust()
-	for suite in suites:
-		subprojects = [None] if suite.subprojects is None else suite.subprojects
-		for subproject in subprojects:
-			directory = suite.directory if subproject is None else path.join(suite.directory, subproject)
-			configuration.write_cargo_config()
-
-			# Run suite multiple times for better accuracy.
-			for round in range(benchmark_rounds):
-				print("{:30s} {:20s} round {}".format(directory, configuration.name, round+1))
-				if run_mode == RunMode.BUILD:
-					res = suite.build(configuration)
-					print_result(res)
-				if run_mode == RunMode.TEST:
-					res = suite.test(configuration)
+# Path to write results to as they are produced, see `Journal`.
+journal_path = path.join(output_path, "journal.jsonl")
+# Path to write the report of `--triage` to.
+triage_path = path.join(output_path, "triage.json")
+# Database of results from every run, see `History`.
+history_path = path.join(benchmark_path, "history.sqlite")
+
+# Clone and patch suites using up to `jobs` threads.
+# Each suite's output is printed in one piece as it finishes, and failures are
+# collected and reported together at the end rather than stopping at the first.
+# Returns the list of suites that failed.
+def clone_all(suites, jobs):
+	failed = []
+	with ThreadPoolExecutor(max_workers=jobs) as pool:
+		futures = {pool.submit(suite.clone_and_patch): suite for suite in suites}
+		for future in as_completed(futures):
+			suite = futures[future]
+			try:
+				success, log = future.result()
+			except Exception as e:
+				success, log = False, ["Cloning {}... {}".format(suite.directory, f"{TTY_RED}FAIL{TTY_RESET}"), str(e)]
+			if log:
+				print("\n".join(log))
+			if not success:
+				failed.append(suite)
+	return failed
+
+# Run benchmark jobs, (configuration, suite, directory, round, bench filter)
+# tuples, in order.
+# Each device in `devices` runs one job at a time, taking the next one as soon
+# as it is idle. Jobs wait for the build of their configuration and directory
+# in `builds`, and `built` records which builds have been waited for and
+# whether they succeeded.
+# A job that fails because its device can't be reached is retried on a device
+# that hasn't tried it yet.
+def run_jobs(jobs, builds, built, devices):
+	pending = queue.Queue()
+	for job in jobs:
+		pending.put((job, frozenset()))
+	lock = threading.Lock()
+	remaining = len(jobs)
+
+	def wait_for_build(configuration, directory):
+		res = builds[(configuration.name, directory)].result()
+		with lock:
+			if (configuration.name, directory) not in built:
+				built[(configuration.name, directory)] = res.returncode == 0
+				print("{:30s} {:20s} build {}".format(directory, configuration.name, result_text(res)))
+				if res.returncode is None:
+					print("ERROR: timed out building benchmarks for {}".format(directory))
+				elif res.returncode != 0:
+					print("ERROR: failed to build benchmarks for {}".format(directory))
 					print(res.stdout)
-				elif run_mode == RunMode.BENCH:
-					suite.bench(configuration)
-					suite.parse_bench_output(configuration, results)
-
-# Dump intermediate results for debugging in case something crashes later.
-# with open(debug_readable, "w") as file:
-# 	file.write(str(results))
-# with open(debug_raw_data, "wb") as file:
-# 	pickle.dump(results, file)
-
-# Write statistics to CSV file.
-def write_stats():
-	with open(path.join(output_path, "benchmark_data.csv"), "w") as file:
-		# Write headers.
-		top_line = "benchmark"
-		bottom_line = " "
-		for configuration in configurations:
-			assert(benchmark_rounds > 0)
-			first = True
-			for _ in range(benchmark_rounds):
-				if first:
-					first = False
-					top_line += ", {}, ".format(configuration.name)
+		return built[(configuration.name, directory)]
+
+	def finish():
+		nonlocal remaining
+		with lock:
+			remaining -= 1
+
+	def worker(device):
+		while True:
+			with lock:
+				if remaining == 0:
+					return
+			try:
+				(job, tried) = pending.get(timeout=1)
+			except queue.Empty:
+				continue
+			(configuration, suite, directory, round, bench_filter) = job
+			if device in tried:
+				# Leave this job for a device that hasn't tried it yet.
+				pending.put((job, tried))
+				time.sleep(1)
+				continue
+			if not wait_for_build(configuration, directory):
+				progress.skip("round", configuration.name, directory)
+				finish()
+				continue
+			if bench_filter is None and (bench_regex is not None or counters):
+				bench_filter = list_benches(configuration, suite, directory, device)
+				if len(bench_filter) == 0:
+					progress.skip("round", configuration.name, directory)
+					finish()
+					continue
+			conditions = check_conditions(configuration, directory) if configuration.is_local() else None
+			print("{:30s} {:20s} round {}{}".format(directory, configuration.name, round+1,
+				"" if device is None else " on {}".format(device)))
+			started = time.time()
+			try:
+				# Counters are reported per binary run, so with counters each
+				# benchmark runs on its own to get counters of its own.
+				reached = suite.bench(configuration, directory, round, results, journal, device, bench_filter,
+					isolate=counters, counters=counters, conditions=conditions)
+			except Exception:
+				# Don't leave other devices waiting for a job that will never finish.
+				finish()
+				raise
+			if reached:
+				with results_lock:
+					rows = results.suite_round(directory, configuration.name, round)
+				history.record(directory, configuration.name, round, rows)
+				record_phase("round", configuration, directory, round, time.time() - started)
+				print(progress.status())
+				finish()
+				continue
+			tried = tried | {device}
+			if len(tried) == len(devices):
+				print("ERROR: no device could run {} round {}".format(directory, round+1))
+				progress.skip("round", configuration.name, directory)
+				finish()
+			else:
+				pending.put((job, tried))
+
+	# Benchmarks selected by `--bench` (all of them with `--counters`) in each
+	# directory, listed once per configuration.
+	listed = {}
+	def list_benches(configuration, suite, directory, device):
+		key = (configuration.name, directory)
+		with lock:
+			if key in listed:
+				return listed[key]
+		names = suite.list_benches(configuration, directory, re.compile("") if bench_regex is None else bench_regex, device)
+		with lock:
+			if key not in listed:
+				listed[key] = names
+				print("{:30s} {:20s} {} benchmark(s) selected".format(directory, configuration.name, len(names)))
+			return listed[key]
+
+	threads = [threading.Thread(target=worker, args=(device,)) for device in devices]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+# Benchmarks from `directory` whose 95% confidence interval for `configuration`
+# is wider than `target_error` relative to the mean, and that have had fewer
+# than `max_rounds` rounds. Returns the names the benchmark harness uses.
+def noisy_benchmarks(configuration, directory):
+	prefix = directory + "/"
+	noisy = []
+	for name in results.benchmarks:
+		if not name.startswith(prefix):
+			continue
+		times = [time for time, _ in results.rounds(name, configuration.name).values()]
+		if len(times) < 2 or len(times) >= max_rounds:
+			continue
+		(mean, half_width) = confidence_interval(times)
+		if mean > 0 and half_width/mean > target_error:
+			noisy.append(name[len(prefix):])
+	return noisy
+
+# Conditions on this machine that affect benchmark times, as a map from name
+# to value. Includes whatever is available of:
+# load -- one minute load average
+# temperature -- highest temperature of any thermal zone, in Celsius
+# governor-performance -- 1 if the frequency governor of every CPU benchmarks
+#                         are pinned to (or every CPU) is "performance", else 0
+def machine_conditions():
+	conditions = {"load": os.getloadavg()[0]}
+	temperatures = []
+	for zone in glob.glob("/sys/class/thermal/thermal_zone*/temp"):
+		try:
+			with open(zone) as file:
+				temperatures.append(int(file.read())/1000)
+		except (OSError, ValueError):
+			continue
+	if len(temperatures) > 0:
+		conditions["temperature"] = max(temperatures)
+	cpus = None if pin_cpus is None else set(cpu_list(pin_cpus))
+	governors = []
+	for governor_file in glob.glob("/sys/devices/system/cpu/cpu[0-9]*/cpufreq/scaling_governor"):
+		cpu = int(re.search(r"cpu([0-9]+)/cpufreq", governor_file).group(1))
+		if cpus is None or cpu in cpus:
+			with open(governor_file) as file:
+				governors.append(file.read().strip())
+	if len(governors) > 0:
+		conditions["governor-performance"] = 1 if all(governor == "performance" for governor in governors) else 0
+	return conditions
+
+# CPU numbers in a list like "0-2,5", as used by taskset and sysfs.
+def cpu_list(text):
+	cpus = []
+	for part in text.split(","):
+		(first, _, last) = part.partition("-")
+		cpus += range(int(first), int(last or first)+1)
+	return cpus
+
+# Reasons `conditions` (from `machine_conditions`) are bad for benchmarking.
+def condition_problems(conditions):
+	problems = []
+	if conditions["load"] > max_load:
+		problems.append("load average {:.2f}".format(conditions["load"]))
+	if conditions.get("temperature", 0) > max_temperature:
+		problems.append("temperature {:.0f}C".format(conditions["temperature"]))
+	if conditions.get("governor-performance", 1) == 0:
+		problems.append("CPU frequency governor is not performance")
+	return problems
+
+# Check conditions before running benchmarks from `directory` on this machine,
+# waiting for them to improve if `--conditions wait` is given.
+# Returns the conditions to record with the results, including "flagged", which
+# is 1 if they were still bad.
+def check_conditions(configuration, directory):
+	conditions = machine_conditions()
+	problems = condition_problems(conditions)
+	retries = condition_retries if condition_policy == "wait" else 0
+	while len(problems) > 0 and retries > 0:
+		time.sleep(condition_wait)
+		conditions = machine_conditions()
+		problems = condition_problems(conditions)
+		retries -= 1
+	if len(problems) > 0:
+		print("{:30s} {:20s} WARN: bad conditions, results flagged: {}".format(directory, configuration.name, ", ".join(problems)))
+	conditions["flagged"] = 1 if len(problems) > 0 else 0
+	return conditions
+
+# Put `jobs` (see `run_jobs`) in the order given by `--order`. They start out
+# in sequential order: by configuration, then directory, then round.
+def order_jobs(jobs):
+	if order == "interleaved":
+		# Each round goes through directories in order, running every
+		# configuration of a directory one after another, so slow drift in the
+		# machine's speed affects all configurations alike.
+		directories = [directory for _, directory in units]
+		return sorted(jobs, key=lambda job: (job[3], directories.index(job[2])))
+	elif order == "random":
+		jobs = list(jobs)
+		order_random.shuffle(jobs)
+		return jobs
+	return jobs
+
+# Record that `phase` (see `history.phases`) of `directory` in `configuration`
+# took `seconds`, in the history and the progress of this run.
+def record_phase(phase, configuration, directory, round, seconds, status="ok"):
+	history.record_phase(phase, configuration.name, directory, round, seconds, status)
+	progress.finish(phase, configuration.name, directory, seconds if status == "ok" else None)
+
+# Build the benchmarks of `directory` with `configuration` (see
+# `Suite.build_bench`), recording how long it took.
+def timed_build(configuration, suite, directory):
+	started = time.time()
+	res = suite.build_bench(configuration, directory)
+	status = "ok" if res.returncode == 0 else "timeout" if res.returncode is None else "fail"
+	record_phase("build", configuration, directory, None, time.time() - started, status)
+	return res
+
+# Add the work `run_configurations` need to `progress`: building toolchains
+# that aren't installed, and building and running every suite directory with
+# rounds that aren't recorded yet.
+def plan_progress(run_configurations):
+	toolchains = set()
+	for configuration in run_configurations:
+		pending = [(directory, len([round for round in range(benchmark_rounds) if not journal.is_complete(directory, configuration.name, round)]))
+			for _, directory in units]
+		pending = [(directory, rounds) for directory, rounds in pending if rounds > 0]
+		if len(pending) == 0:
+			continue
+		# Configurations with the same compiler share a toolchain.
+		if not configuration.toolchain_installed() and (force_install or configuration.toolchain_fingerprint() not in toolchains):
+			progress.add("toolchain", configuration.name, "")
+			toolchains.add(configuration.toolchain_fingerprint())
+		for directory, rounds in pending:
+			progress.add("build", configuration.name, directory)
+			progress.add("round", configuration.name, directory, rounds)
+
+# Run benchmarks for `configurations`, building them first.
+# Builds run in the background ahead of the benchmarks that need them, so the
+# host compiles while the target runs benchmarks.
+# Benchmarks running on this machine would be slowed down by the builds, so for
+# those everything is built first, and benchmarks run one at a time.
+def bench_configurations(configurations):
+	jobs = []
+	for configuration in configurations:
+		for suite, directory in units:
+			for round in range(benchmark_rounds):
+				if journal.is_complete(directory, configuration.name, round):
+					print("{:30s} {:20s} round {} (recorded)".format(directory, configuration.name, round+1))
 				else:
-					top_line += ", , "
-				bottom_line += ", time/ns, +-/ns"
-			top_line += ", , , "
-			bottom_line += ", mean/ns, -/ns, +/ns"
-		file.write(top_line+"\n"+bottom_line+"\n")
-
-		# Write data.
-		for benchmark, benchmark_data in results.items():
-			file.write(benchmark)
+					jobs.append((configuration, suite, directory, round, None))
+
+	builds = {}
+	built = {}
+	local = any(configuration.is_local() for configuration in configurations)
+	run_devices = [None] if local else devices
+	with ThreadPoolExecutor(max_workers=build_jobs) as build_pool:
+		def submit_builds(jobs):
+			for configuration, suite, directory, _, _ in jobs:
+				if (configuration.name, directory) not in builds:
+					builds[(configuration.name, directory)] = build_pool.submit(timed_build, configuration, suite, directory)
+			if local:
+				for build in builds.values():
+					build.result()
+
+		submit_builds(jobs)
+		run_jobs(order_jobs(jobs), builds, built, run_devices)
+
+		# Rerun only the benchmarks that are still too noisy, a round at a time.
+		round = benchmark_rounds
+		while adaptive and round < max_rounds:
+			jobs = []
+			any_noisy = False
 			for configuration in configurations:
-				# mode, target, flags
-				# Collect data and statistics together, marking modes that crashed.
-				mode_data = benchmark_data.get(configuration.name)
-				if mode_data:
-					assert(len(mode_data) == benchmark_rounds) # make sure data is sensible
-					sum = 0
-					min = None
-					max = None
-					for time, time_range in mode_data:
-						sum += time
-						low = time-time_range
-						high = time+time_range
-						if (not min) or low < min: min = low
-						if (not max) or high > max: max = high
-					mean = sum/benchmark_rounds
-					assert(str(mean).find(",") == -1) # make sure locale doesn't break CSV file
-					assert(min != None and max != None and max >= min)
-					assert(min <= mean)
-					assert(max >= mean)
-					range_negative = mean-min
-					range_positive = max-mean
+				for suite, directory in units:
+					noisy = noisy_benchmarks(configuration, directory)
+					if len(noisy) == 0:
+						continue
+					any_noisy = True
+					if journal.is_complete(directory, configuration.name, round):
+						print("{:30s} {:20s} round {} (recorded)".format(directory, configuration.name, round+1))
+						continue
+					print("{:30s} {:20s} {} noisy benchmark(s)".format(directory, configuration.name, len(noisy)))
+					jobs.append((configuration, suite, directory, round, noisy))
+					progress.add("round", configuration.name, directory)
+			if not any_noisy:
+				break
+			submit_builds(jobs)
+			run_jobs(order_jobs(jobs), builds, built, run_devices)
+			round += 1
+
+# Run each benchmark of `units` built with `configuration` on its own, and find
+# out what happens to it, see triage.py. Suites in `failed_suites` couldn't be
+# cloned, so are only reported as such.
+# Directories are built `build_jobs` at a time. As timing doesn't matter here,
+# benchmarks running on this machine run `jobs` at a time, and those running on
+# the Morello machine one at a time on each of `devices`.
+# The output of each directory is written to `<configuration>-triage.log` in it.
+# Returns a report entry for each directory (see `triage.write_report`), in
+# the order of `units`.
+def triage_configuration(configuration, units, failed_suites):
+	slots = queue.Queue()
+	for device in [None]*jobs if configuration.is_local() else devices:
+		slots.put(device)
+
+	# Run `binary` on the next free device, returning (output, exit status,
+	# seconds taken).
+	def run_on_device(suite, binary, cwd, harness_flags):
+		device = slots.get()
+		try:
+			started = time.time()
+			(output, returncode) = suite.run_binary(configuration, binary, cwd, harness_flags, device)
+			return (output, returncode, time.time() - started)
+		finally:
+			slots.put(device)
+
+	def make_entry(suite, directory, outcome, detail, benchmarks=[]):
+		counts = {}
+		for benchmark in benchmarks:
+			counts[benchmark["outcome"]] = counts.get(benchmark["outcome"], 0) + 1
+		return {"directory": directory, "suite": suite.directory, "configuration": configuration.name,
+			"outcome": outcome, "detail": detail, "counts": counts, "benchmarks": benchmarks}
+
+	def triage_directory(suite, directory):
+		if suite in failed_suites:
+			return make_entry(suite, directory, "clone-failure", None)
+		log = []
+		def write_log():
+			with open(path.join(benchmark_path, directory, "{}-triage.log".format(configuration.name)), "w") as file:
+				file.write("\n".join(log))
+		(res, binaries) = suite.bench_binaries(configuration, directory)
+		log.append(res.stdout)
+		if res.returncode is None:
+			write_log()
+			return make_entry(suite, directory, "timeout", "build stopped after {} s".format(suite.timeouts()[2]))
+		if res.returncode != 0:
+			write_log()
+			return make_entry(suite, directory, *triage.classify_build(res.stdout))
+
+		# Benchmarks to run, as (binary, package directory, name).
+		selected = []
+		benchmarks = []
+		for binary, cwd in binaries:
+			(output, returncode, seconds) = run_on_device(suite, binary, cwd, ["--list"])
+			log.append("$ {} --bench --list\n{}".format(binary, output))
+			names = [name for name in map(suite.harness.parse_list_line, output.splitlines()) if name is not None]
+			problem = triage.classify_run(output, returncode, len(names) > 0) if returncode != 0 else triage.classify_list(output, names)
+			if problem is not None:
+				(outcome, detail) = problem
+				benchmarks.append({"binary": path.basename(binary), "benchmark": None, "outcome": outcome, "detail": detail, "seconds": round(seconds, 3)})
+				if returncode != 0:
+					continue
+			selected += [(binary, cwd, name) for name in names
+				if bench_regex is None or bench_regex.search("{}/{}".format(directory, name))]
+
+		futures = [run_pool.submit(run_on_device, suite, binary, cwd, suite.harness.harness_flags([name])) for binary, cwd, name in selected]
+		for (binary, _, name), future in zip(selected, futures):
+			(output, returncode, seconds) = future.result()
+			log.append("$ {} --bench {}\n{}".format(binary, name, output))
+			found = any(item is not None and item[0] == name for item in map(suite.harness.parse_line, output.splitlines()))
+			(outcome, detail) = triage.classify_run(output, returncode, found)
+			benchmarks.append({"binary": path.basename(binary), "benchmark": name, "outcome": outcome, "detail": detail, "seconds": round(seconds, 3)})
+		write_log()
+		outcome = triage.directory_outcome([benchmark["outcome"] for benchmark in benchmarks])
+		details = [benchmark["detail"] for benchmark in benchmarks if benchmark["outcome"] == outcome and benchmark["detail"]]
+		return make_entry(suite, directory, outcome, details[0] if len(details) > 0 else None, benchmarks)
+
+	entries = {}
+	with ThreadPoolExecutor(max_workers=slots.qsize()) as run_pool, ThreadPoolExecutor(max_workers=build_jobs) as directory_pool:
+		futures = {}
+		for suite, directory in units:
+			futures[directory_pool.submit(triage_directory, suite, directory)] = directory
+		for future in as_completed(futures):
+			entries[futures[future]] = entry = future.result()
+			print("{:30s} {:20s} triage {}".format(entry["directory"], entry["configuration"], entry["outcome"]))
+	return [entries[directory] for _, directory in units]
+
+# Clone, build and run benchmarks as asked on the command line.
+def main():
+	global suites, units, results, journal, history, progress
+	parse_options()
+	if host_target() is None:
+		print("ERROR: unknown OS or hardware, please add target triple information for this host")
+		exit(1)
+	# Benchmarks to run.
+	try:
+		suites = manifest_suites(suite_list)
+	except (OSError, ValueError, manifest.ManifestError) as e:
+		print("ERROR: can't load manifest: {}".format(e))
+		exit(1)
+	except ModuleNotFoundError:
+		print("ERROR: reading {} needs Python 3.11 or the tomli package".format(path.basename(manifest_path)))
+		exit(1)
+
+	# Suite directories to run (suites or their subprojects), as (suite, directory)
+	# pairs, narrowed down by `--suite` and `--shard`.
+	units = [(suite, directory) for suite in suites for directory in suite.directories()
+		if suite_regex is None or suite_regex.search(directory)]
+	if shard is not None:
+		units = [unit for i, unit in enumerate(units) if i % shard[1] == shard[0]-1]
+	suites = [suite for suite in suites if any(unit[0] is suite for unit in units)]
+
+	# Clean up if asked.
+	if "--clean" in sys.argv:
+		for suite in suites:
+			suite.clean()
+		exit(0)
+
+	# Fetch all the repos, apply patches.
+	failed = clone_all(suites, jobs)
+	# Triage reports suites that fail to clone along with the rest.
+	if failed and run_mode is not RunMode.TRIAGE:
+		print("ERROR: failed to clone or patch {} suite(s):".format(len(failed)))
+		for suite in failed:
+			print("  {}".format(suite.directory))
+		exit(1)
+	if clone_only:
+		exit(0)
+
+	# Do line count.
+	if "--line-count" in sys.argv:
+		counter = linecount.LineCounter(line_count_cache_path, jobs)
+		count_dependencies = ("--line-count-deps" in sys.argv)
+		if count_dependencies:
+			# Dependencies are found with the Cargo of the first configuration.
+			configuration = manifest_configurations(native, native_target, native_runner)[0]
+			configuration.build_rust()
+		with open(path.join(output_path, "line_count.csv"), "w") as file:
+			# Write headers.
+			file.write("Benchmark, Total lines, Code lines, Comment lines, Unsafe lines")
+			file.write(", Dependency total lines, Dependency code lines, Dependency comment lines, Dependency unsafe lines\n" if count_dependencies else "\n")
+			# Write statistics.
+			for suite, directory in units:
+				if directory.count(",") != 0:
+					print("ERROR: can't use benchmark name in CSV due to comma")
+					exit(1)
+				print("Counting {}...".format(directory))
+				counts = counter.count([path.join(benchmark_path, directory)])
+				if count_dependencies:
+					dependencies = suite.dependency_directories(configuration, directory)
+					if dependencies is None:
+						print("WARN: can't find dependencies of {}".format(directory))
+						dependencies = []
+					counts += counter.count(dependencies)
+				file.write("{}, {}\n".format(directory, ", ".join(str(count) for count in counts)))
+		counter.save()
+		exit(0);
+
+	# Iterate over compiler configurations, rebuilding libraries and benchmarks.
+	# Each configuration builds into its own directory in `target_cache_path`, so
+	# the order of these loops doesn't affect how much Cargo has to rebuild.
+	configurations = manifest_configurations()
+	# Configurations run on this machine with `--native`, to try things out
+	# without a Morello machine or to get reference results. Benchmarks run
+	# directly, pinned with taskset if asked, or through `--runner` (e.g. QEMU when
+	# `--native-target` isn't this machine's).
+	if native:
+		configurations = manifest_configurations(True, native_target, native_runner)
+	# Configuration other configurations are compared against.
+	baseline_name = "native-bounds" if native else "hybrid-bounds"
+	# Configurations to run, narrowed down by `--config`. Results are still written
+	# for all of `configurations`.
+	run_configurations = configurations
+	if config_names is not None:
+		unknown = set(config_names) - set(configuration.name for configuration in configurations)
+		if unknown:
+			print("ERROR: unknown configuration(s) {}".format(", ".join(sorted(unknown))))
+			exit(1)
+		run_configurations = [configuration for configuration in configurations if configuration.name in config_names]
+
+	write_cargo_config(list(dict.fromkeys(configuration.target for configuration in run_configurations if configuration.is_local())))
+	os.makedirs(output_path, exist_ok=True)
+	if run_mode is RunMode.TRIAGE:
+		entries = []
+		for configuration in run_configurations:
+			configuration.build_rust()
+			entries += triage_configuration(configuration, units, failed)
+		triage.print_summary(entries, suite_list)
+		triage.write_report(triage_path, entries, {"suite_list": suite_list, "timeout": bench_timeout})
+		exit(0)
+
+	# Time and range of every round of every benchmark in every configuration.
+	# Note that benchmark name means a *single* benchmark, not a benchmark suite
+	# given in `suites`.
+	results = Results()
+	if run_mode is RunMode.BENCH:
+		# Only benchmarking writes the journal, so other modes leave the results
+		# of an interrupted run to be resumed.
+		journal = Journal(journal_path, resume)
+		journal.replay(results)
+		history = History(history_path)
+		history.start_run(*rust_source_state(), resume)
+		# Progress of the run, with an estimate of the time left from the phases
+		# of earlier runs in the history.
+		local = any(configuration.is_local() for configuration in run_configurations)
+		progress = Progress(history.phase_durations(), {"round": 1 if local else len(devices), "build": build_jobs}, not local)
+		plan_progress(run_configurations)
+		print(progress.status())
+
+	bench_pending = []
+	# Sizes of the binaries of each suite directory and configuration with
+	# `--size-report`, as a map from (directory, configuration name) to
+	# (sections, functions) as given by `sizes.combined_sizes`.
+	binary_sizes = {}
+	for configuration in run_configurations:
+		# Nothing to do for this configuration if resuming and all of it is recorded.
+		# With `--adaptive`, extra rounds may still be due, which only
+		# `bench_configurations` can tell from the journal.
+		if run_mode == RunMode.BENCH and not adaptive and all(journal.is_complete(directory, configuration.name, round)
+				for _, directory in units for round in range(benchmark_rounds)):
+			print("{:30s} {:20s} (recorded)".format("all suites", configuration.name))
+			continue
+
+		# Build and run benchmarks.
+		started = time.time()
+		if configuration.build_rust() and run_mode is RunMode.BENCH:
+			record_phase("toolchain", configuration, "", None, time.time() - started)
+			print(progress.status())
+		if run_mode == RunMode.SIZE:
+			for suite, directory in units:
+				print("{:30s} {:20s} ".format(directory, configuration.name), end="", flush=True)
+				binaries = suite.binaries(configuration, directory)
+				if binaries is None:
+					print(f"{TTY_RED}FAIL{TTY_RESET}")
+					continue
+				try:
+					binary_sizes[(directory, configuration.name)] = sizes.combined_sizes(binaries)
+				except ValueError as e:
+					print("WARN: can't measure binaries: {}".format(e))
+					continue
+				print("{} binaries, {} bytes of text".format(len(binaries), binary_sizes[(directory, configuration.name)][0]["text"]))
+			continue
+		if run_mode != RunMode.BENCH:
+			for suite, directory in units:
+				# Run suite multiple times for better accuracy.
+				for round in range(benchmark_rounds):
+					print("{:30s} {:20s} round {}".format(directory, configuration.name, round+1))
+					if run_mode == RunMode.BUILD:
+						res = suite.build(configuration, directory)
+						print_result(res)
+					if run_mode == RunMode.TEST:
+						res = suite.test(configuration, directory)
+						print(res.stdout)
+			continue
+
+		# Run suite multiple times for better accuracy.
+		# Other orders mix configurations, so need all compilers built first.
+		if order == "sequential":
+			bench_configurations([configuration])
+		else:
+			bench_pending.append(configuration)
+	if len(bench_pending) > 0:
+		bench_configurations(bench_pending)
+
+	if run_mode is RunMode.SIZE:
+		sizes.write_csv(path.join(output_path, "binary_sizes.csv"), binary_sizes)
+		if not any(name == baseline_name for _, name in binary_sizes):
+			print("WARN: baseline {} not built, not comparing sizes".format(baseline_name))
+			exit(0)
+		deltas = sizes.report(binary_sizes, baseline_name)
+		sizes.write_deltas_csv(path.join(output_path, "function_size_deltas.csv"), deltas)
+		exit(0)
+	if run_mode is not RunMode.BENCH:
+		exit(0)
+	elif run_mode is RunMode.BENCH:
+		configuration_names = [configuration.name for configuration in configurations]
+		results_path = path.join(output_path, "benchmark_data.npz")
+		if selective and path.exists(results_path):
+			# Replace earlier results for the suites that were rerun, or with
+			# `--bench` only for the benchmarks that were.
+			previous = Results.load(results_path)
+			previous.merge(results, replace=True, by_suite=bench_regex is None)
+			results = previous
+		results.save(results_path)
+		with open(path.join(output_path, "timings.csv"), "w") as file:
+			file.write("Phase, Configuration, Directory, Round, Seconds, Status\n")
+			for phase, configuration_name, directory, round, seconds, status in history.run_phases(history.run):
+				file.write("{}, {}, {}, {}, {:.3f}, {}\n".format(phase, configuration_name, directory, "" if round is None else round+1, seconds, status))
+		if len(results.devices) > 1:
+			print("Mean time relative to all devices:")
+			for device, (ratio, count) in sorted(results.device_bias().items()):
+				print("  {:30s} {:.4f} ({} rounds)".format(device or "(default)", ratio, count))
+		results.write_csv(path.join(output_path, "benchmark_data.csv"), configuration_names, max(benchmark_rounds, results.max_rounds()))
+		if len(results.metrics) > 0:
+			results.write_metrics_csv(path.join(output_path, "benchmark_metrics.csv"), configuration_names)
+		if do_plot:
+			# Only needed for plotting, so NumPy is not required otherwise.
+			import analysis
+			import analyze
+			# Shared with analyze.py, so rebuilding the reports later only computes
+			# what changed.
+			cache = analysis.AnalysisCache(path.join(output_path, "analysis_cache"))
+			try:
+				if native:
+					(plot_analysis, _) = analyze.write_plot_data(results, configuration_names, baseline_name, output_path, cache)
 				else:
-					mode_data = [("-", "-")]*benchmark_rounds
-					mean = "-"
-					range_negative = "-"
-					range_positive = "-"
-
-				# Add data and statistics to file.
-				for time, time_range in mode_data:
-					file.write(", {}, {}".format(time, time_range))
-				file.write(", {}, {}, {}".format(mean, range_negative, range_positive))
-			file.write("\n")
-
-# Write statistics to Pgfplots table file.
-def plot_data():
-	with open(path.join(output_path, "benchmark_data.dat"), "w") as file:
-		# Write notes.
-		file.write("# This is benchmark data formatted for rendering via LaTeX and Pgfplots.\n")
-		file.write("# If you need the list of symbolic values used, copy this:\n")
-		file.write("# symbolic y coords={")
-		first = True
-		for benchmark in results.keys():
-			if first:
-				first = False
-			else:
-				file.write(",")
-			assert(benchmark.find(" ") == -1)
-			file.write(benchmark.replace("_", "\\_"))
-		file.write("}\n")
-
-		# Get modes to compare to one baseline.
-		assert(len(configurations) >= 2)
-		baseline_mode = "hybrid-bounds"
-		other_modes = []
-		for mode, target, flags in configurations:
-			if mode != baseline_mode:
-				other_modes.append(mode)
-
-		# Write headers.
-		file.write("benchmark")
-		for mode in other_modes:
-			file.write(" {}-mean {}-error-negative {}-error-positive".format(mode, mode, mode))
-		file.write("\n")
-
-		# Write processed data.
-		for benchmark, benchmark_data in results.items():
-			# Skip benchmarks we didn't get a full set of results from.
-			if any(map(lambda mode_data: mode_data is None, benchmark_data.values())):
-				continue
+					(plot_analysis, _) = analyze.write_plot_data(results, analysis.plot_configurations, analysis.default_baseline, output_path, cache)
+			except ValueError as e:
+				print("ERROR: can't analyse results: {}".format(e))
+				exit(1)
+			cache.save()
+			plot_analysis.report()
+
 
-			# Calculate means and error ranges for each mode.
-			computed_data = {}
-			for mode, target, flags in configurations:
-				mode_data = benchmark_data[mode]
-				assert(len(mode_data) == benchmark_rounds) # make sure data is sensible
-				assert(benchmark_rounds > 0)
-				sum = 0
-				min = None
-				max = None
-				for time, time_range in mode_data:
-					sum += time
-					low = time-time_range
-					high = time+time_range
-					if (not min) or low < min: min = low
-					if (not max) or high > max: max = high
-				mean = sum/benchmark_rounds
-				assert(min != None and max != None and max >= min)
-				assert(min <= mean)
-				assert(max >= mean)
-				computed_data[mode] = (mean, min, max)
-
-			# Write speedup relative to baseline to file.
-			baseline_data = computed_data[baseline_mode]
-			assert(benchmark.find(" ") == -1)
-			file.write(benchmark.replace("_", "\\_"))
-			for mode in other_modes:
-				mode_data = computed_data[mode]
-				mean = mode_data[0]/baseline_data[0]
-				assert(mean > 0)
-				min = None
-				max = None
-				for a in baseline_data:
-					for b in mode_data:
-						factor = 0 if a == 0 else b/a
-						assert(factor > 0)
-						if min is None or factor < min: min = factor
-						if max is None or factor > max: max = factor
-				assert(min is not None)
-				assert(max is not None)
-				assert(min <= mean)
-				assert(max >= mean)
-				range_negative = mean-min
-				range_positive = max-mean
-
-				# Make sure locale doesn't break table file.
-				assert(str(mean).find(" ") == -1)
-				assert(str(range_negative).find(" ") == -1)
-				assert(str(range_positive).find(" ") == -1)
-				file.write(" {} {} {}".format(mean, range_negative, range_positive))
-			file.write("\n")
-
-if run_mode is not RunMode.BENCH:
-	exit(0)
-elif run_mode is RunMode.BENCH:
-	write_stats()
-	if do_plot:
-		plot_data()
+if __name__ == "__main__":
+	main()
@@ -8,8 +8,33 @@
 # This script expects the path to the test client as its first argument,
 # followed by the benchmark to run.
 # This save duplicating path information.
+# The test client connects to the server given by TEST_DEVICE_ADDR, which
+# run.py sets for each benchmark when using several servers (`--devices`).
+
+# With `run.py --counters` (BENCH_COUNTERS is set), the benchmark is run
+# through counters.py, which reports counters and sizes after the output.
+
+# For configurations that run on the build machine (`run.py --native`), the
+# first argument is --local instead, and the benchmark is run here, prefixed by
+# the command in BENCH_RUNNER (quoted for the shell) if it is set, e.g. taskset
+# or an emulator.
+if [ "$1" = "--local" ]; then
+	shift 1
+	BINARY="$1"
+	eval "set -- $BENCH_RUNNER \"\$@\""
+	if [ -n "$BENCH_COUNTERS" ]; then
+		python3 "$(dirname "$0")/counters.py" --local "$BINARY" -- "$@"
+	else
+		"$@"
+	fi
+	exit 0
+fi
 
 CLIENT="$1"
 shift 1 # remove first argmuent from "$@"
-"$CLIENT" run 0 "$@"
+if [ -n "$BENCH_COUNTERS" ]; then
+	python3 "$(dirname "$0")/counters.py" "$1" -- "$CLIENT" run 0 "$@"
+else
+	"$CLIENT" run 0 "$@"
+fi
 exit 0
@@ -0,0 +1,187 @@
+# Code size measurements of ELF binaries, used by `run.py --size-report`.
+# Binaries are memory-mapped and only the section headers and symbol tables
+# are read, so large binaries are cheap to measure.
+import mmap
+import re
+import struct
+
+# Section header flags and types.
+_SHF_WRITE = 0x1
+_SHF_ALLOC = 0x2
+_SHF_EXECINSTR = 0x4
+_SHT_SYMTAB = 2
+_SHT_NOBITS = 8
+_SHT_DYNSYM = 11
+# Symbol type of functions.
+_STT_FUNC = 2
+
+# Groups sections are counted in, by the kind of memory they occupy.
+groups = ["text", "rodata", "data", "bss"]
+
+# Hash at the end of a legacy mangled Rust symbol, which differs between
+# compilers and flags.
+_hash_regex = re.compile(r"^h[0-9a-f]{16}$")
+
+class ElfSizes:
+	"""
+	Sizes of the sections and functions of an ELF binary.
+
+	sections -- map from group in `groups` to total size in bytes of the
+	            allocated sections in it: executable (text), read-only
+	            (rodata), writable (data), and zero-initialised (bss)
+	functions -- map from (demangled) function name to size in bytes
+	"""
+	def __init__(self, file_path):
+		self.sections = {group: 0 for group in groups}
+		self.functions = {}
+		with open(file_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+			self._read(data)
+
+	def _read(self, data):
+		if data[:4] != b"\x7fELF":
+			raise ValueError("not an ELF file")
+		is_64 = data[4] == 2
+		endian = "<" if data[5] == 1 else ">"
+		if is_64:
+			(shoff,) = struct.unpack_from(endian + "Q", data, 0x28)
+			(shentsize, shnum, shstrndx) = struct.unpack_from(endian + "HHH", data, 0x3a)
+			# name, type, flags, addr, offset, size, link, info, addralign, entsize
+			section_format = endian + "IIQQQQIIQQ"
+			# name, info, other, shndx, value, size
+			symbol_format = endian + "IBBHQQ"
+		else:
+			(shoff,) = struct.unpack_from(endian + "I", data, 0x20)
+			(shentsize, shnum, shstrndx) = struct.unpack_from(endian + "HHH", data, 0x2e)
+			section_format = endian + "IIIIIIIIII"
+			# name, value, size, info, other, shndx
+			symbol_format = endian + "IIIBBH"
+		sections = [struct.unpack_from(section_format, data, shoff + i*shentsize) for i in range(shnum)]
+
+		for (_, kind, flags, _, _, size, _, _, _, _) in sections:
+			if not flags & _SHF_ALLOC:
+				continue
+			if kind == _SHT_NOBITS:
+				self.sections["bss"] += size
+			elif flags & _SHF_EXECINSTR:
+				self.sections["text"] += size
+			elif flags & _SHF_WRITE:
+				self.sections["data"] += size
+			else:
+				self.sections["rodata"] += size
+
+		# Use the full symbol table if there is one, else the dynamic one.
+		tables = [section for section in sections if section[1] == _SHT_SYMTAB] or [section for section in sections if section[1] == _SHT_DYNSYM]
+		for (_, _, _, _, offset, size, link, _, _, entsize) in tables:
+			(_, _, _, _, names_offset, names_size, _, _, _, _) = sections[link]
+			symbols = memoryview(data)[offset:offset+size - size % entsize]
+			try:
+				for symbol in struct.iter_unpack(symbol_format, symbols) if entsize == struct.calcsize(symbol_format) else []:
+					if is_64:
+						(name, info, _, _, _, symbol_size) = symbol
+					else:
+						(name, _, symbol_size, info, _, _) = symbol
+					if info & 0xf != _STT_FUNC or symbol_size == 0 or name >= names_size:
+						continue
+					start = names_offset + name
+					end = data.find(b"\0", start, names_offset + names_size)
+					function = demangle(data[start:end if end >= 0 else names_offset + names_size].decode("utf-8", "replace"))
+					self.functions[function] = max(self.functions.get(function, 0), symbol_size)
+			finally:
+				symbols.release()
+
+# Readable name of a legacy mangled Rust (or C++ style) symbol, without the
+# hash Rust adds, so the same function can be matched between binaries built
+# with different flags. Other names are returned unchanged.
+def demangle(name):
+	if not name.startswith("_ZN") or not name.endswith("E"):
+		return name
+	parts = []
+	i = 3
+	while i < len(name)-1:
+		length = re.match(r"[0-9]+", name[i:])
+		if length is None:
+			return name
+		i += len(length.group(0))
+		parts.append(name[i:i+int(length.group(0))])
+		i += int(length.group(0))
+	if len(parts) > 0 and _hash_regex.match(parts[-1]):
+		parts.pop()
+	# Undo the escapes legacy mangling uses for punctuation.
+	readable = "::".join(parts)
+	for escape, text in [("$LT$", "<"), ("$GT$", ">"), ("$RF$", "&"), ("$BP$", "*"), ("$LP$", "("), ("$RP$", ")"), ("$C$", ","), ("$u20$", " "),
+			("$u27$", "'"), ("$u5b$", "["), ("$u5d$", "]"), ("$u7b$", "{"), ("$u7d$", "}"), ("$u7e$", "~"), ("..", "::")]:
+		readable = readable.replace(escape, text)
+	return readable
+
+# Combined sizes of the binaries in `file_paths`, as (sections, functions)
+# like `ElfSizes`. Section sizes are summed over binaries, and each function
+# counts once, with its largest size, as binaries share code from common crates.
+def combined_sizes(file_paths):
+	sections = {group: 0 for group in groups}
+	functions = {}
+	for file_path in file_paths:
+		sizes = ElfSizes(file_path)
+		for group, size in sizes.sections.items():
+			sections[group] += size
+		for function, size in sizes.functions.items():
+			functions[function] = max(functions.get(function, 0), size)
+	return (sections, functions)
+
+# Changes in function sizes from `baseline` to `functions` (maps from name to
+# size), as a list of (change in bytes, name, baseline size, size), largest
+# change first. Functions missing from one side count as size 0.
+def function_deltas(baseline, functions):
+	deltas = []
+	for name in set(baseline) | set(functions):
+		(before, after) = (baseline.get(name, 0), functions.get(name, 0))
+		if before != after:
+			deltas.append((after - before, name, before, after))
+	deltas.sort(key=lambda delta: abs(delta[0]), reverse=True)
+	return deltas
+
+# Write the section sizes in `binary_sizes`, a map from (directory,
+# configuration) to (sections, functions) as given by `combined_sizes`.
+def write_csv(file_path, binary_sizes):
+	with open(file_path, "w") as file:
+		file.write("Directory, Configuration, {}, Functions\n".format(", ".join(groups)))
+		for (directory, configuration), (sections, functions) in sorted(binary_sizes.items()):
+			file.write("{}, {}, {}, {}\n".format(directory, configuration, ", ".join(str(sections[group]) for group in groups), len(functions)))
+
+# Print how the sizes in `binary_sizes` (as for `write_csv`) differ from those
+# of configuration `baseline`, in total per configuration and for the `top`
+# functions that changed most.
+# Returns every function size change, as a list of (directory, configuration,
+# change, function, baseline size, size), largest change first.
+def report(binary_sizes, baseline, top=20):
+	configurations = list(dict.fromkeys(configuration for _, configuration in binary_sizes if configuration != baseline))
+	deltas = []
+	print("Total size relative to {}, over the directories built in both".format(baseline))
+	print("{:20s} {}".format("configuration", " ".join("{:>18s}".format(group) for group in groups)))
+	for configuration in configurations:
+		totals = {group: 0 for group in groups}
+		baseline_totals = {group: 0 for group in groups}
+		for (directory, name), (sections, functions) in binary_sizes.items():
+			if name != configuration or (directory, baseline) not in binary_sizes:
+				continue
+			(baseline_sections, baseline_functions) = binary_sizes[(directory, baseline)]
+			for group in groups:
+				totals[group] += sections[group]
+				baseline_totals[group] += baseline_sections[group]
+			deltas += [(directory, configuration, *delta) for delta in function_deltas(baseline_functions, functions)]
+		print("{:20s} {}".format(configuration, " ".join("{:>+10d} ({:5.3f})".format(totals[group] - baseline_totals[group],
+			totals[group]/baseline_totals[group] if baseline_totals[group] > 0 else 1.0) for group in groups)))
+	deltas.sort(key=lambda delta: abs(delta[2]), reverse=True)
+
+	print("Largest function size changes relative to {}".format(baseline))
+	print("{:30s} {:20s} {:>10s} {:>10s} {:>10s} {}".format("directory", "configuration", "change", "before", "after", "function"))
+	for directory, configuration, change, function, before, after in deltas[:top]:
+		print("{:30s} {:20s} {:>+10d} {:10d} {:10d} {}".format(directory, configuration, change, before, after, function))
+	return deltas
+
+# Write function size changes, as returned by `report`.
+def write_deltas_csv(file_path, deltas):
+	with open(file_path, "w") as file:
+		file.write("Directory, Configuration, Change, Before, After, Function\n")
+		for directory, configuration, change, function, before, after in deltas:
+			# Function names can contain commas.
+			file.write("{}, {}, {}, {}, {}, \"{}\"\n".format(directory, configuration, change, before, after, function.replace("\"", "\"\"")))
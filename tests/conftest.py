@@ -0,0 +1,6 @@
+# The modules under test are scripts in the repository root rather than a
+# package, so make them importable.
+import sys
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
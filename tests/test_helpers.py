@@ -0,0 +1,203 @@
+# Tests of the helper modules of run.py that don't need a compiler or a
+# Morello machine. Run with `python -m pytest tests`.
+import struct
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import compare
+import linecount
+import manifest
+import run
+import sizes
+import triage
+from results import Results
+
+
+def test_results_save_load(tmp_path):
+	results = Results()
+	results.add("suite/a", "purecap-bounds", 0, 1000, 10, suite="suite")
+	results.add("suite/a", "purecap-bounds", 1, 1100, 12, device="10.0.0.2:12345", suite="suite")
+	results.add("suite/ü", "hybrid-bounds", 0, 5, 0, suite="suite")
+	results.add_samples("suite/a", "purecap-bounds", 0, [1.5, 2.25, 3.0], suite="suite")
+	results.add_metric("suite/a", "purecap-bounds", 0, "cycles", 1e9, suite="suite")
+	results.save(tmp_path / "results.npz")
+
+	loaded = Results.load(tmp_path / "results.npz")
+	assert loaded.benchmarks == results.benchmarks
+	assert loaded.suites == results.suites
+	assert loaded.configurations == results.configurations
+	assert loaded.devices == results.devices
+	assert loaded.rounds("suite/a", "purecap-bounds") == results.rounds("suite/a", "purecap-bounds")
+	assert loaded.rounds("suite/ü", "hybrid-bounds") == {0: (5, 0)}
+	assert loaded.samples("suite/a", "purecap-bounds") == {0: [1.5, 2.25, 3.0]}
+	assert loaded.metric_values("suite/a", "purecap-bounds") == {0: {"cycles": 1e9}}
+
+def test_results_load_with_numpy(tmp_path):
+	np = pytest.importorskip("numpy")
+	results = Results()
+	results.add("suite/a", "purecap-bounds", 0, 1000, 10)
+	results.add_samples("suite/a", "purecap-bounds", 0, [1.5, 2.5])
+	results.save(tmp_path / "results.npz")
+	with np.load(tmp_path / "results.npz") as data:
+		assert list(data["benchmarks"]) == ["suite/a"]
+		assert list(data["time"]) == [1000]
+		assert list(data["sample_time"]) == [1.5, 2.5]
+
+
+def test_mann_whitney_exact():
+	# All of x below all of y: U = 0, which is 1 of the 20 orderings, on
+	# either side.
+	assert compare.mann_whitney([1, 2, 3], [4, 5, 6]) == pytest.approx(0.1)
+	assert compare.mann_whitney([4, 5, 6], [1, 2, 3]) == pytest.approx(0.1)
+	assert compare.mann_whitney([1, 3, 5], [2, 4, 6]) == pytest.approx(0.7)
+
+def test_mann_whitney_ties():
+	assert compare.mann_whitney([1, 1, 1], [1, 1, 1]) == 1.0
+	assert compare.mann_whitney([1]*30 + [2]*10, [2]*30 + [3]*10) < 1e-6
+
+def test_adjust_p_values():
+	changes = [SimpleNamespace(p=p) for p in [0.01, 0.04, 0.03]]
+	compare.adjust_p_values(changes)
+	assert [change.q for change in changes] == pytest.approx([0.03, 0.04, 0.04])
+
+
+# A little-endian ELF64 file with a 16 byte text section, a 32 byte bss
+# section and a symbol table with one 12 byte function, `name`.
+def _elf_file(name):
+	strtab = b"\0" + name + b"\0"
+	shstrtab = b"\0.text\0.bss\0.symtab\0.strtab\0.shstrtab\0"
+	text = b"\0"*16
+	# name, info (global function), other, shndx, value, size
+	symtab = struct.pack("<IBBHQQ", 0, 0, 0, 0, 0, 0) + struct.pack("<IBBHQQ", 1, 0x12, 0, 1, 0, 12)
+	data = bytearray(64)
+	offsets = []
+	for contents in [text, symtab, strtab, shstrtab]:
+		offsets.append(len(data))
+		data += contents
+	shoff = len(data)
+	# name, type, flags, addr, offset, size, link, info, addralign, entsize
+	headers = [
+		(0, 0, 0, 0, 0, 0, 0, 0, 0, 0),
+		(1, 1, 0x6, 0, offsets[0], len(text), 0, 0, 16, 0),
+		(7, 8, 0x3, 0, offsets[1], 32, 0, 0, 8, 0),
+		(12, 2, 0, 0, offsets[1], len(symtab), 4, 1, 8, 24),
+		(20, 3, 0, 0, offsets[2], len(strtab), 0, 0, 1, 0),
+		(28, 3, 0, 0, offsets[3], len(shstrtab), 0, 0, 1, 0),
+	]
+	for header in headers:
+		data += struct.pack("<IIQQQQIIQQ", *header)
+	data[:6] = b"\x7fELF\x02\x01"
+	struct.pack_into("<Q", data, 0x28, shoff)
+	struct.pack_into("<HHH", data, 0x3a, 64, len(headers), 5)
+	return bytes(data)
+
+def test_elf_sizes(tmp_path):
+	binary = tmp_path / "bench"
+	binary.write_bytes(_elf_file(b"_ZN4core3fmt5write17h0123456789abcdefE"))
+	elf = sizes.ElfSizes(binary)
+	assert elf.sections == {"text": 16, "rodata": 0, "data": 0, "bss": 32}
+	assert elf.functions == {"core::fmt::write": 12}
+
+def test_elf_sizes_not_elf(tmp_path):
+	binary = tmp_path / "script"
+	binary.write_bytes(b"#!/bin/sh\n")
+	with pytest.raises(ValueError):
+		sizes.ElfSizes(binary)
+
+
+def test_count_lines():
+	text = "\n".join([
+		"// A comment",
+		"fn main() {",
+		"    let s = \"// not a comment { \";",
+		"    /* block",
+		"       comment */",
+		"    unsafe {",
+		"        f(); /* trailing */",
+		"    }",
+		"",
+		"    let c = '}';",
+		"}",
+	]) + "\n"
+	assert linecount.count_lines(text) == (11, 7, 3, 3)
+
+def test_count_lines_unsafe_fn():
+	text = "unsafe fn f() {\n    g()\n}\nfn h() {}\n"
+	assert linecount.count_lines(text) == (4, 4, 0, 3)
+
+
+def test_classify_build():
+	assert triage.classify_build("Compiling x\nerror: linking with `cc` failed: exit status: 1\n")[0] == "link-failure"
+	assert triage.classify_build("error[E0425]: cannot find value `x`\n") == ("build-failure", "error[E0425]: cannot find value `x`")
+
+@pytest.mark.parametrize("output, returncode, found, outcome", [
+	("test a ... bench: 10 ns/iter (+/- 1)", 0, True, "ok"),
+	("still running", None, False, "timeout"),
+	("", -34, False, "capability-fault"),
+	("In-address space security exception", 1, False, "capability-fault"),
+	("error: Unrecognized option: 'bench'", 101, False, "harness-incompatibility"),
+	("thread 'main' panicked at src/lib.rs:1:1", 101, False, "crash"),
+	("", -11, False, "crash"),
+	("done", 0, False, "harness-incompatibility"),
+])
+def test_classify_run(output, returncode, found, outcome):
+	assert triage.classify_run(output, returncode, found)[0] == outcome
+
+def test_classify_list():
+	assert triage.classify_list("a: benchmark\n\n0 tests, 1 benchmark\n", ["a"]) is None
+	assert triage.classify_list("a: bench\n", ["a"]) is None
+	assert triage.classify_list("a: benchmark\n0 tests, 2 benchmarks\n", ["a"])[0] == "harness-incompatibility"
+
+def test_directory_outcome():
+	assert triage.directory_outcome([]) == "no-benchmarks"
+	assert triage.directory_outcome(["ok", "ok"]) == "ok"
+	assert triage.directory_outcome(["ok", "crash", "timeout", "crash"]) == "crash"
+	# Ties go to the earliest outcome.
+	assert triage.directory_outcome(["timeout", "crash"]) == "crash"
+
+
+def _manifest(**data):
+	return dict({"rust_path": "/rust", "configurations": [{"name": "purecap", "target": "aarch64-unknown-freebsd-purecap"}],
+		"working": [{"directory": "a", "repo": "https://example.com/a", "timeout": 60}]}, **data)
+
+def test_validate_manifest():
+	manifest.validate(_manifest())
+
+@pytest.mark.parametrize("data, message", [
+	(_manifest(rust_path=1), "rust_path must be a string"),
+	(_manifest(extra=[]), "unknown key(s) extra"),
+	(_manifest(working={}), "working must be an array of tables"),
+	(_manifest(configurations=[{"name": "purecap"}]), "configurations[0] is missing target"),
+	(_manifest(working=[{"directory": "a", "timeout": "60"}]), "working[0].timeout must be a number"),
+	(_manifest(working=[{"directory": "a", "timeout": True}]), "working[0].timeout must be a number"),
+	(_manifest(working=[{"directory": "a", "subprojects": ["x", 1]}]), "working[0].subprojects must be a list of strings"),
+	(_manifest(broken=[{"directory": "a", "colour": "red"}]), "broken[0] has unknown field(s) colour"),
+	(_manifest(more=[{"directory": "a"}, {"directory": "a"}]), "more[1] repeats directory a"),
+])
+def test_validate_manifest_errors(data, message):
+	with pytest.raises(manifest.ManifestError) as error:
+		manifest.validate(data)
+	assert str(error.value) == message
+
+
+# A stand-in for the remote test client that starts a benchmark which hangs.
+_sleeping_runner = [sys.executable, "-c", "import subprocess; subprocess.run(['sleep', '60'])"]
+
+def test_run_cmd_timeout(tmp_path):
+	started = time.monotonic()
+	result = run.run_cmd(_sleeping_runner, cwd=tmp_path, quiet=True, timeout=0.5)
+	assert result.returncode is None
+	assert time.monotonic() - started < run.kill_grace + 5
+
+def test_run_streaming_timeout(tmp_path):
+	lines = []
+	command = [sys.executable, "-c", "print('started', flush=True); import subprocess; subprocess.run(['sleep', '60'])"]
+	started = time.monotonic()
+	status = run.run_streaming(command, tmp_path, None, tmp_path / "log", lines.append, timeout=1)
+	assert status is None
+	assert lines == ["started"]
+	assert time.monotonic() - started < run.kill_grace + 5
+	assert (tmp_path / "log").read_text() == "started\n"
@@ -0,0 +1,134 @@
+# Classification of what goes wrong with a suite, used by `run.py --triage`.
+# Each benchmark is run on its own, and what happened to it is told from its
+# exit status and output, so the reason a suite is broken is recorded rather
+# than found by reading logs.
+import json
+import re
+
+# Outcomes, from the first thing that can go wrong with a suite to the last.
+# clone-failure -- the repository couldn't be cloned or patched
+# build-failure -- the benchmarks don't compile
+# link-failure -- the benchmarks compile but don't link
+# no-benchmarks -- the benchmark binaries list no benchmarks
+# harness-incompatibility -- a benchmark binary rejects the harness's flags or
+#                            its output can't be parsed
+# capability-fault -- a benchmark was killed by SIGPROT, a CHERI capability
+#                     fault (bounds, permissions or tag violation)
+# crash -- a benchmark was killed by another signal, panicked or failed
+# timeout -- a benchmark didn't finish in time
+# ok -- a benchmark ran and produced a result
+outcomes = ["clone-failure", "build-failure", "link-failure", "no-benchmarks", "harness-incompatibility",
+	"capability-fault", "crash", "timeout", "ok"]
+
+# Regex to match linker errors in Cargo output.
+_link_regex = re.compile(r"error: link(?:ing with `[^`]*` failed|er `[^`]*` not found)|undefined (?:reference|symbol)|(?:ld|lld)(?:\.lld)?: error")
+# Regex to match an error in Cargo output.
+_error_regex = re.compile(r"^error(?:\[E[0-9]+\])?: ")
+# Regex to match a capability fault in benchmark output. SIGPROT is signal 34
+# on CheriBSD, reported by the remote test client or the shell.
+_capability_regex = re.compile(r"SIGPROT|signal:? 34\b|In-address space security exception|[Cc]apability (?:fault|violation)")
+# Regex to match a harness refusing its arguments.
+_harness_regex = re.compile(r"[Uu]nrecognized option|[Uu]nexpected argument|[Uu]nknown (?:option|argument)|error: Found argument|[Ii]nvalid (?:option|value)")
+# Regex to match other signs of a benchmark failing.
+_crash_regex = re.compile(r"panicked at|died due to signal|signal: [0-9]+|Segmentation fault|Bus error|Illegal instruction|Aborted|Abort trap")
+# Regex to match the count libtest prints at the end of `--list` output.
+_list_count_regex = re.compile(r"^([0-9]+) tests?, ([0-9]+) benchmarks?$")
+
+# First line of `output` matching `regex`, or `None`.
+def _first_match(regex, output):
+	for line in output.splitlines():
+		if regex.search(line):
+			return line.strip()
+	return None
+
+# Last non-empty line of `output`, for when nothing more telling is found.
+def _last_line(output):
+	lines = [line.strip() for line in output.splitlines() if line.strip() != ""]
+	return lines[-1] if len(lines) > 0 else ""
+
+# Outcome of building benchmarks that failed with `output`, as (outcome,
+# detail), where detail is the line of output that shows what went wrong.
+def classify_build(output):
+	detail = _first_match(_link_regex, output)
+	if detail is not None:
+		return ("link-failure", detail)
+	return ("build-failure", _first_match(_error_regex, output) or _last_line(output))
+
+# Outcome of running one benchmark (or listing benchmarks) as (outcome, detail).
+# `returncode` is the exit status of the benchmark binary, negative if it was
+# killed by a signal, or `None` if it timed out. `found` is whether its result
+# (or for a listing, any benchmark) was found in `output`.
+def classify_run(output, returncode, found):
+	if returncode is None:
+		return ("timeout", _last_line(output) or None)
+	detail = _first_match(_capability_regex, output)
+	if detail is not None or returncode == -34:
+		return ("capability-fault", detail or "killed by signal 34")
+	detail = _first_match(_harness_regex, output)
+	if detail is not None:
+		return ("harness-incompatibility", detail)
+	detail = _first_match(_crash_regex, output)
+	if detail is not None or returncode < 0:
+		return ("crash", detail or "killed by signal {}".format(-returncode))
+	if returncode != 0:
+		return ("crash", "exit status {}: {}".format(returncode, _last_line(output)))
+	if not found:
+		return ("harness-incompatibility", "no result in output: {}".format(_last_line(output)))
+	return ("ok", None)
+
+# Outcome of a successful listing of benchmarks with `output`, where `names`
+# are the benchmarks recognised in it, as (outcome, detail), or `None` if the
+# listing is fine (a binary may have no benchmarks). libtest ends its listing
+# with a count of tests and benchmarks, which tells a listing that couldn't be
+# parsed apart from one without benchmarks.
+def classify_list(output, names):
+	counts = [_list_count_regex.match(line.strip()) for line in output.splitlines()]
+	listed = sum(int(count.group(2)) for count in counts if count is not None)
+	if listed > len(names):
+		return ("harness-incompatibility", "{} benchmark(s) listed, {} recognised".format(listed, len(names)))
+	return None
+
+# Outcome of a suite directory from the outcomes of its benchmarks: "ok" if
+# they all ran, otherwise the most common failure (the earliest in `outcomes`
+# on a tie).
+def directory_outcome(benchmark_outcomes):
+	failures = [outcome for outcome in benchmark_outcomes if outcome != "ok"]
+	if len(benchmark_outcomes) == 0:
+		return "no-benchmarks"
+	if len(failures) == 0:
+		return "ok"
+	return min(set(failures), key=lambda outcome: (-failures.count(outcome), outcomes.index(outcome)))
+
+# Write `entries`, a list of the triage results of each suite directory and
+# configuration, as JSON:
+#   directory, suite, configuration -- what was triaged
+#   outcome, detail -- see `directory_outcome` and `classify_run`
+#   counts -- number of benchmarks with each outcome
+#   benchmarks -- list of binary, benchmark, outcome, detail and seconds taken
+# `info` is written alongside, e.g. the options used.
+def write_report(file_path, entries, info):
+	with open(file_path, "w") as file:
+		json.dump(dict(info, directories=entries), file, indent=2)
+		file.write("\n")
+
+# Print a table of `entries` (as for `write_report`), and which suites could
+# move between lists of the manifest: those from `suite_list` (other than
+# "working") whose directories were ok in every configuration, or from the
+# "working" list that weren't.
+def print_summary(entries, suite_list):
+	print("{:30s} {:20s} {:24s} {}".format("directory", "configuration", "outcome", "benchmarks"))
+	suite_ok = {}
+	for entry in entries:
+		counts = ", ".join("{} {}".format(count, outcome) for outcome, count in sorted(entry["counts"].items(), key=lambda item: outcomes.index(item[0])))
+		print("{:30s} {:20s} {:24s} {}".format(entry["directory"], entry["configuration"], entry["outcome"], counts))
+		if entry["outcome"] != "ok" and entry["detail"]:
+			print("  {}".format(entry["detail"]))
+		suite_ok[entry["suite"]] = suite_ok.get(entry["suite"], True) and entry["outcome"] == "ok"
+	if suite_list == "working":
+		moving = [suite for suite, ok in suite_ok.items() if not ok]
+		message = "Suites with failures, could move to broken"
+	else:
+		moving = [suite for suite, ok in suite_ok.items() if ok]
+		message = "Suites that ran in every configuration, could move to working"
+	if len(moving) > 0:
+		print("{}: {}".format(message, ", ".join(moving)))